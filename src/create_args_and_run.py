@@ -7,9 +7,14 @@ This script has to create the arguments for the model script, and run it.
 """
 
 import os, sys
+import numpy as np
+from factcheck import metrics, results_store, sweep
+from factcheck.labeling import DEFAULT_POLICY, DEFAULT_DECISION
 
 SUPPRESS_OUTPUT = True # If True, the output of the running model will be suppressed
 SAVE_INFERENCE = True # If True, the inference won't be overwritten
+WRITE_TEXT_REPORTS = False # If True, a human-readable report is also written for each set of arguments (the results are always saved in results/results.jsonl)
+IN_PROCESS_SWEEP = True # If True, the model is loaded and the queries are retrieved once, and every threshold/N combination is labelled in this process with the factcheck package, instead of running the script (see factcheck/sweep.py)
 
 # Read the parameters
 if len(sys.argv) != 6:
@@ -23,13 +28,8 @@ test_set_file = sys.argv[4]
 examples_file = sys.argv[5]
 
 # Create the arguments
-thresholds = [0.3, 0.35, 0.4, 0.45, 0.5, 0.55, 0.6, 0.65, 0.7, 0.75, 0.8, 0.85]
-ns = [1, 2, 3, 4, 5]
-args_lists = []
-for threshold in thresholds:
-    for n in ns:
-        args = "--threshold " + str(threshold) + " --n " + str(n)
-        args_lists.append(args)
+thresholds = sweep.THRESHOLDS
+ns = sweep.NS
 
 # If the results directory does not exist, exit
 if not os.path.exists(os.path.join(output, "results")):
@@ -42,14 +42,19 @@ if SAVE_INFERENCE:
         print("Inference directory not found")
         sys.exit(1)
 
-output_path = output # Output for the model script only
 
-# Run the script for each set of arguments
-for args in args_lists:
+def run_subprocess(threshold, n):
+    """
+    Run the model script as a separate process for the given arguments, writing its inference file.
+    Return the codes of the labels.
+    """
+    args = sweep.config_args(threshold, n)
     if SAVE_INFERENCE:
-        output_path = os.path.join(output, "inference", "semantic_search-" + args.replace("--", "").replace(" ", "-"))
+        output_path = os.path.join(output, "inference", sweep.config_name(threshold, n))
         if not os.path.exists(output_path):
             os.makedirs(output_path)
+    else:
+        output_path = output
     print("\033[92m" + "Evaluating semantic_search with args: " + args + "\033[0m")
     command = "python3 " + script + " " + input + " --examples " + examples_file + " --output " + output_path + " " + args
     # Run the script
@@ -58,13 +63,34 @@ for args in args_lists:
     if os.system(command) != 0:
         print("\033[91m" + "Error in " + script + "\033[0m")
         sys.exit(1)
+    return metrics.load_inference(os.path.join(output_path, "inference.tsv"))
 
-    # Get results path: output/results/script_name_<variables>.txt (e.g. output_path/results/semantic_search-threshold-0.3-n-1.txt)
-    results_path = os.path.join(output, "results", "semantic_search-" + args.replace("--", "").replace(" ", "-") + ".txt")
 
-    # Run compute_metrics.py
-    inference = os.path.join(output_path, "inference.tsv")
-    command = "python3 compute_metrics.py semantic_search " + test_set_file + " " + inference + " " + results_path
-    if os.system(command) != 0:
-        print("\033[91m" + "Error in compute_metrics.py" + "\033[0m")
+if IN_PROCESS_SWEEP:
+    from factcheck import Retriever
+    print("\033[92m" + "Loading the model and evaluating " + str(len(thresholds) * len(ns)) + " sets of arguments" + "\033[0m")
+    sweep.run_sweep(Retriever(), input, output, test_set_file, examples_file, thresholds, ns,
+                    save_inference=SAVE_INFERENCE, write_text_reports=WRITE_TEXT_REPORTS, verbose=not SUPPRESS_OUTPUT)
+else:
+    # Load the test set once: the column is the name of the output folder ("claim", "news-like" or "social-like")
+    mode, test_set, column = results_store.run_info(output)
+    evaluator = metrics.Evaluator(test_set_file, column)
+
+    # Run the script for each set of arguments, and compute the metrics of all of them at once
+    configs = [(threshold, n) for threshold in thresholds for n in ns]
+    predicted = [run_subprocess(threshold, n) for threshold, n in configs]
+    try:
+        results = evaluator.evaluate(np.stack(predicted))
+    except ValueError as e:
+        print("Error: " + str(e))
         sys.exit(1)
+
+    records = []
+    for (threshold, n), result in zip(configs, results):
+        records.append(dict({"mode": mode, "test_set": test_set, "column": column, "model": "semantic_search", "policy": DEFAULT_POLICY, "decision": DEFAULT_DECISION, "min_margin": 0.0, "threshold": threshold, "n": n}, **result))
+        if WRITE_TEXT_REPORTS:
+            # Get results path: output/results/script_name_<variables>.txt (e.g. output_path/results/semantic_search-threshold-0.3-n-1.txt)
+            metrics.write_report(os.path.join(output, "results", sweep.config_name(threshold, n) + ".txt"), "semantic_search", test_set_file, result)
+    results_store.write_results(os.path.join(output, "results", results_store.RESULTS_FILE), records)
+
+print("Results saved in " + os.path.join(output, "results", results_store.RESULTS_FILE))
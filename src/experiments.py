@@ -0,0 +1,163 @@
+#!/usr/bin/python3
+
+# Usage: python3 experiments.py <model_folder> <test_set_folder> <examples_file_folder> <mode> [<mode> ...] [--workers WORKERS] [--resume]
+
+"""
+Parallel version of experiments.sh, for one or more modes at once.
+The mode/test-set/column grid is expanded into a graph of tasks, run on a pool of processes:
+- embed: compute the embeddings of a control set (saved in the embedding cache). The control sets are embedded one after another, from the smallest,
+  so that each one only encodes the claims that are not in the previous ones (see factcheck/embedding_cache.py).
+- sweep: create the input of a test set column, and run the whole threshold x N sweep on it (see factcheck/sweep.py). Depends on the embed task of its control set.
+- stats: run get_stats.py on a mode and test set. Depends on the sweep tasks of its columns.
+Each worker process loads the model once, and shares it between all the tasks it runs.
+With --resume, the previous results are kept, and the sweeps whose results table already exists are skipped.
+"""
+
+import os, sys, shutil, argparse, subprocess
+import concurrent.futures
+
+# The modes of experiments.sh: results name, columns, test sets, control set file
+MODES = {
+    0: ("non-controlled/in-domain", ["claim", "social-like"], ["idtestset"], "train_dev.tsv"), # NON-CONTROLED SETUP: control-set = train + dev; test-sets = in-domain
+    1: ("controlled/in-domain", ["news-like", "social-like"], ["idtestset"], "train_dev_id.tsv"), # CONTROLED SETUP: control-set = train + dev + in-domain; test-sets = in-domain
+    2: ("non-controlled/out-of-domain", ["claim", "social-like"], ["oodtestset"], "train_dev.tsv"), # NON-CONTROLED SETUP: control-set = train + dev; test-sets = out-of-domain
+    3: ("controlled/out-of-domain", ["news-like", "social-like"], ["oodtestset"], "train_dev_ood.tsv"), # CONTROLED SETUP: control-set = train + dev + out-of-domain; test-sets = out-of-domain
+    4: ("non-controlled/out-of-domain-id", ["claim", "social-like"], ["oodtestset"], "train_dev_id.tsv"), # NON-CONTROLED SETUP: control-set = train + dev + in-domain; test-sets = out-of-domain
+}
+TEST_SET_FILES = {"idtestset": "in_domain.tsv", "oodtestset": "out_of_domain.tsv"}
+
+_retriever = None # Model loaded once in each worker process
+
+
+def init_worker(threads):
+    """
+    Initialize a worker process: limit its threads, so that the workers do not compete for the cores, and load the model.
+    """
+    global _retriever
+    import torch
+    from factcheck import Retriever
+    torch.set_num_threads(threads)
+    _retriever = Retriever()
+
+
+def embed_task(examples_file):
+    _retriever.load_examples(examples_file)
+    return len(_retriever.corpus)
+
+
+def sweep_task(test_set_file, column, output, examples_file):
+    import test_to_input, contextlib
+    from factcheck import sweep
+    os.makedirs(os.path.join(output, "results"), exist_ok=True)
+    os.makedirs(os.path.join(output, "inference"), exist_ok=True)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        input_path = test_to_input.create_input(test_set_file, column, output)
+    records = sweep.run_sweep(_retriever, input_path, output, test_set_file, examples_file)
+    return len(records)
+
+
+def stats_task(directory, results_folder):
+    script = os.path.join(os.path.dirname(os.path.realpath(__file__)), "get_stats.py")
+    return subprocess.run([sys.executable, script, directory, results_folder], stdout=subprocess.DEVNULL, check=True).returncode
+
+
+def build_tasks(modes, test_set_folder, examples_file_folder, output_path, results_path, resume):
+    """
+    Return the task graph: a dictionary mapping each task name to (function, arguments, names of the tasks it depends on).
+    """
+    tasks = {}
+
+    # Embed the control sets one after another, from the smallest
+    examples_files = sorted(set(os.path.join(examples_file_folder, MODES[mode][3]) for mode in modes), key=os.path.getsize)
+    previous = []
+    for examples_file in examples_files:
+        tasks["embed " + os.path.basename(examples_file)] = (embed_task, (examples_file,), previous)
+        previous = ["embed " + os.path.basename(examples_file)]
+
+    for mode in modes:
+        results_name, columns, test_sets, examples_name = MODES[mode]
+        for test_set in test_sets:
+            test_set_file = os.path.join(test_set_folder, TEST_SET_FILES[test_set])
+            sweeps = []
+            for column in columns:
+                output = os.path.join(output_path, "mode" + str(mode), test_set, column)
+                name = "sweep mode" + str(mode) + "/" + test_set + "/" + column
+                if resume and os.path.isfile(os.path.join(output, "results", "results.jsonl")):
+                    continue
+                tasks[name] = (sweep_task, (test_set_file, column, output, os.path.join(examples_file_folder, examples_name)), ["embed " + examples_name])
+                sweeps.append(name)
+            tasks["stats mode" + str(mode) + "/" + test_set] = (stats_task, (os.path.join(output_path, "mode" + str(mode), test_set), os.path.join(results_path, results_name)), sweeps)
+    return tasks
+
+
+def run_tasks(tasks, workers):
+    """
+    Run the tasks on a pool of processes, each one as soon as the tasks it depends on are done.
+    """
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    done = set()
+    running = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(threads,)) as executor:
+        while len(done) < len(tasks):
+            for name, (function, args, dependencies) in tasks.items():
+                if name not in done and name not in running.values() and all(dependency in done for dependency in dependencies):
+                    running[executor.submit(function, *args)] = name
+            finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    future.result()
+                except Exception as e:
+                    print("\033[91m" + "Error in " + name + ": " + str(e) + "\033[0m")
+                    executor.shutdown(cancel_futures=True)
+                    sys.exit(1)
+                done.add(name)
+                print("\033[92m" + "Done: " + name + " (" + str(len(done)) + "/" + str(len(tasks)) + ")" + "\033[0m")
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("model_folder", help="Folder containing semantic_search.py")
+    parser.add_argument("test_set_folder", help="Folder containing in_domain.tsv and out_of_domain.tsv")
+    parser.add_argument("examples_file_folder", help="Folder containing the control sets")
+    parser.add_argument("modes", help="Modes to run (see experiments.sh)", type=int, nargs="+")
+    parser.add_argument("--workers", help="Number of worker processes (default: number of cores, at most the number of sweeps)", type=int, default=None)
+    parser.add_argument("--resume", help="Keep the previous results, and skip the completed sweeps", action="store_true")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+
+    # Check the arguments
+    if not os.path.isfile(os.path.join(args.model_folder, "semantic_search.py")):
+        print("Model script not found")
+        sys.exit(1)
+    for test_set_file in TEST_SET_FILES.values():
+        if not os.path.isfile(os.path.join(args.test_set_folder, test_set_file)):
+            print("Test set not found: " + test_set_file)
+            sys.exit(1)
+    if not os.path.isdir(args.examples_file_folder):
+        print("Examples file folder not found")
+        sys.exit(1)
+    for mode in args.modes:
+        if mode not in MODES:
+            print("Mode not valid: " + str(mode))
+            sys.exit(1)
+
+    test_set_folder = os.path.realpath(args.test_set_folder)
+    examples_file_folder = os.path.realpath(args.examples_file_folder)
+    # Output path is the folder of this script, the results path is in its parent folder
+    output_path = os.path.dirname(os.path.realpath(__file__))
+    results_path = os.path.join(os.path.dirname(output_path), "results")
+
+    # Delete the previous results folders
+    if not args.resume:
+        for mode in args.modes:
+            shutil.rmtree(os.path.join(output_path, "mode" + str(mode)), ignore_errors=True)
+
+    tasks = build_tasks(args.modes, test_set_folder, examples_file_folder, output_path, results_path, args.resume)
+    sweeps = len([name for name in tasks if name.startswith("sweep")])
+    workers = args.workers if args.workers is not None else max(1, min(os.cpu_count() or 1, sweeps))
+    print("\033[92m" + "Running " + str(len(tasks)) + " tasks on " + str(workers) + " workers" + "\033[0m")
+    run_tasks(tasks, workers)
@@ -0,0 +1,30 @@
+"""
+Automated fact-checking by semantic search, with abstention.
+The pipeline stages can be composed in one process, sharing the loaded model, control sets and test sets:
+- InputBuilder: build the input claims from a column of a test set (inputs.py)
+- Retriever: embed a control set and retrieve the nearest examples of the claims (retrieval.py)
+- Labeler: label the claims with the majority label of their nearest examples, see output_label() (labeling.py)
+- Evaluator: compute the metrics of the labels against a test set (metrics.py)
+- NeighbourTable: save the retrieved examples of the queries, to label them again with another voting policy (neighbours.py)
+The scripts in src/ are command line interfaces of these objects.
+"""
+
+import importlib
+
+# Public objects, and the module defining each of them. They are imported on first use, so that e.g. the metrics can be used without loading torch.
+_EXPORTS = {
+    "InputBuilder": "inputs",
+    "Retriever": "retrieval",
+    "Labeler": "labeling",
+    "output_label": "labeling",
+    "Evaluator": "metrics",
+    "NeighbourTable": "neighbours",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name in _EXPORTS:
+        return getattr(importlib.import_module("." + _EXPORTS[name], __name__), name)
+    raise AttributeError("module " + __name__ + " has no attribute " + name)
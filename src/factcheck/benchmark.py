@@ -0,0 +1,209 @@
+#!/usr/bin/python3
+
+# Usage: python3 -m factcheck.benchmark <examples_file> <test_set_file> <column> [--sizes SIZE [SIZE ...]] [--output OUTPUT_FOLDER] [--compare RESULTS_FILE]
+
+"""
+End-to-end benchmark of the pipeline, stage by stage, on CPU and offline (the model must be in the local cache):
+model load, dataset parsing (control set and test set), corpus encoding, index build, query encoding, similarity, top-k,
+voting (every threshold and N of the sweep), metrics, and report writing (inference files and results table).
+Every stage is timed with its throughput (items per second), and with the peak memory (RSS) of the process at its end.
+Each control set size runs in a new process, so that the model load and the peak memory of a size do not depend on the previous ones.
+Besides the control set itself, it runs on synthetic control sets of the given sizes (e.g. 10k to 1M examples): their embeddings are
+the embeddings of random examples of the control set with some noise, and their labels are the labels of these examples,
+so only the encoding of the real control set is measured, and the stages after it run at the synthetic size.
+The measures are saved as a JSON Lines table in the output folder (one row per size and stage, with the git commit),
+and compared with a previous table (by default the latest one of the folder), to see the regressions between versions.
+"""
+
+import os, sys, time, argparse, resource, subprocess, tempfile, platform
+import concurrent.futures, multiprocessing
+import numpy as np
+
+# SETTINGS
+SIZES = [10000, 100000, 1000000] # Sizes of the synthetic control sets
+SYNTHETIC_NOISE = 0.1 # Standard deviation of the noise added to the embeddings of the synthetic examples, relative to their average coordinate
+BENCHMARK_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "benchmarks") # Where the measures are saved
+
+
+def peak_rss_mb():
+    """
+    Return the peak resident memory of the process so far, in MB.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024 # bytes on macOS, KB on Linux
+
+
+def git_commit():
+    """
+    Return the current git commit of the repository, or None if it is not available.
+    """
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.realpath(__file__)), stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def synthetic_embeddings(embeddings, labels, size, seed=0):
+    """
+    Return the embeddings and the labels of a synthetic control set of the given size, made of random examples of the control set with noise.
+    """
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, embeddings.shape[0], size=size)
+    scale = SYNTHETIC_NOISE * np.abs(embeddings).mean()
+    synthetic = embeddings[rows] + rng.standard_normal((size, embeddings.shape[1]), dtype=np.float32) * scale
+    return synthetic.astype(np.float32), [labels[row] for row in rows]
+
+
+def run_benchmark(examples_file, test_set_file, column, size=None):
+    """
+    Run every stage of the pipeline once, on the control set, or on a synthetic control set of the given size.
+    Return one dictionary per stage: seconds, number of items processed, items per second and peak memory.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from . import datasets, search_index, results_store
+    from .retrieval import Retriever, MODEL_NAME, preprocess_query
+    from .inputs import InputBuilder
+    from .labeling import Labeler
+    from .metrics import Evaluator, encode_predicted
+    from .sweep import THRESHOLDS, NS, config_name
+
+    measures = []
+    def measure(stage, seconds, items):
+        measures.append({"stage": stage, "seconds": seconds, "items": items, "items_per_s": items / seconds if seconds > 0 else None, "peak_rss_mb": peak_rss_mb()})
+
+    start = time.perf_counter()
+    embedder = SentenceTransformer(MODEL_NAME, device="cpu")
+    measure("model_load", time.perf_counter() - start, 1)
+
+    start = time.perf_counter()
+    dataset = datasets.read_table(examples_file, ["claim", "label"])
+    queries = [preprocess_query(query) for query in InputBuilder(test_set_file).queries(column)]
+    evaluator = Evaluator(test_set_file, column)
+    corpus = dataset["claim"].tolist()
+    corpus_labels = dataset["label"].tolist()
+    measure("dataset_parse", time.perf_counter() - start, len(corpus) + len(queries))
+
+    # The caches are disabled, so that every stage is computed
+    retriever = Retriever(embedder=embedder, use_cache=False, query_cache=False)
+    start = time.perf_counter()
+    embeddings = retriever.encode_corpus(corpus)
+    measure("corpus_encode", time.perf_counter() - start, len(corpus))
+    if size is not None:
+        embeddings, corpus_labels = synthetic_embeddings(search_index.normalize(embeddings), corpus_labels, size)
+        corpus = ["synthetic example " + str(i) for i in range(size)]
+
+    start = time.perf_counter()
+    index = search_index.ExactIndex(embeddings)
+    measure("index_build", time.perf_counter() - start, len(corpus))
+
+    start = time.perf_counter()
+    query_embeddings = retriever.encode_queries(queries)
+    measure("query_encode", time.perf_counter() - start, len(queries))
+
+    # Same computation as ExactIndex.search(), in chunks of queries as Retriever.retrieve(), with the similarity and the top-k timed separately
+    top_k = min(max(NS), len(corpus))
+    similarity_time = 0.0
+    top_k_time = 0.0
+    top_scores = []
+    top_indices = []
+    for chunk_start in range(0, len(queries), retriever.chunk_size):
+        start = time.perf_counter()
+        chunk = torch.nn.functional.normalize(torch.as_tensor(query_embeddings[chunk_start:chunk_start + retriever.chunk_size]), p=2, dim=1)
+        cos_scores = torch.mm(chunk, index.embeddings.transpose(0, 1))
+        similarity_time += time.perf_counter() - start
+        start = time.perf_counter()
+        top_results = torch.topk(cos_scores, k=top_k, dim=1)
+        top_scores.append(top_results[0].cpu().numpy())
+        top_indices.append(top_results[1].cpu().numpy())
+        top_k_time += time.perf_counter() - start
+        del cos_scores
+    top_scores = np.concatenate(top_scores).astype(np.float64)
+    top_indices = np.concatenate(top_indices)
+    measure("similarity", similarity_time, len(queries))
+    measure("top_k", top_k_time, len(queries))
+
+    labeler = Labeler(corpus, corpus_labels)
+    configs = [(threshold, n) for threshold in THRESHOLDS for n in NS]
+    start = time.perf_counter()
+    labels = [labeler.label_all(top_scores, top_indices, n, threshold) for threshold, n in configs]
+    measure("voting", time.perf_counter() - start, len(queries) * len(configs))
+
+    start = time.perf_counter()
+    results = evaluator.evaluate(np.stack([encode_predicted(config_labels) for config_labels in labels]))
+    measure("metrics", time.perf_counter() - start, len(queries) * len(configs))
+
+    with tempfile.TemporaryDirectory() as output:
+        start = time.perf_counter()
+        for (threshold, n), config_labels in zip(configs, labels):
+            output_path = os.path.join(output, "inference", config_name(threshold, n))
+            os.makedirs(output_path, exist_ok=True)
+            labeler.write_inference(os.path.join(output_path, "inference.tsv"), queries, config_labels, top_scores, top_indices, n, threshold)
+        results_store.write_results(os.path.join(output, results_store.RESULTS_FILE), [dict({"threshold": threshold, "n": n}, **result) for (threshold, n), result in zip(configs, results)])
+        measure("report_writing", time.perf_counter() - start, len(queries) * len(configs))
+
+    for row in measures:
+        row.update({"examples": len(corpus), "synthetic": size is not None, "queries": len(queries)})
+    return measures
+
+
+def benchmark(examples_file, test_set_file, column, sizes=SIZES):
+    """
+    Run the benchmark on the control set and on a synthetic control set of each size, each one in a new process.
+    Return the measures of all the runs, with the information of the environment.
+    """
+    info = {"date": time.strftime("%Y-%m-%d %H:%M:%S"), "commit": git_commit(), "python": platform.python_version(), "cpus": os.cpu_count(),
+            "examples_file": os.path.basename(examples_file), "test_set": os.path.basename(test_set_file), "column": column}
+    rows = []
+    for size in [None] + list(sizes):
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            rows.extend(dict(info, **row) for row in executor.submit(run_benchmark, examples_file, test_set_file, column, size).result())
+    return rows
+
+
+def latest_results(folder, exclude=None):
+    """
+    Return the path of the most recent results table of the folder (other than exclude), or None.
+    """
+    if not os.path.isdir(folder):
+        return None
+    paths = [os.path.join(folder, file) for file in os.listdir(folder) if file.endswith(".jsonl") and os.path.join(folder, file) != exclude]
+    return max(paths, key=os.path.getmtime) if len(paths) > 0 else None
+
+
+def compare(rows, previous_rows):
+    """
+    Return the ratio of the time of each stage to its time in the previous results (same control set size and stage), None if it was not measured.
+    """
+    previous = {(row["examples"], row["synthetic"], row["stage"]): row["seconds"] for row in previous_rows}
+    return [row["seconds"] / previous[(row["examples"], row["synthetic"], row["stage"])] if previous.get((row["examples"], row["synthetic"], row["stage"])) else None for row in rows]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("examples_file", help="Control set")
+    parser.add_argument("test_set_file", help="Test set")
+    parser.add_argument("column", help="Input column of the test set (claim, news-like or social-like)")
+    parser.add_argument("--sizes", help="Sizes of the synthetic control sets (default: " + " ".join(str(size) for size in SIZES) + ")", type=int, nargs="*", default=SIZES)
+    parser.add_argument("--output", help="Folder where the measures are saved (default: " + BENCHMARK_DIR + ")", default=BENCHMARK_DIR)
+    parser.add_argument("--compare", help="Results table to compare with (default: the latest one of the output folder)", default=None)
+    args = parser.parse_args()
+
+    # The model is loaded from the local cache only
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+    from . import results_store
+    rows = benchmark(args.examples_file, args.test_set_file, args.column, args.sizes)
+    os.makedirs(args.output, exist_ok=True)
+    output_path = os.path.join(args.output, time.strftime("%Y%m%d-%H%M%S") + ("-" + rows[0]["commit"] if rows[0]["commit"] else "") + ".jsonl")
+    previous_path = args.compare if args.compare is not None else latest_results(args.output)
+    results_store.write_results(output_path, rows)
+
+    ratios = compare(rows, results_store.read_results(previous_path)) if previous_path is not None else [None] * len(rows)
+    print("examples\tstage\ttime (s)\titems/s\tpeak RSS (MB)" + ("\tvs " + os.path.basename(previous_path) if previous_path is not None else ""))
+    for row, ratio in zip(rows, ratios):
+        print(str(row["examples"]) + (" (synthetic)" if row["synthetic"] else "") + "\t" + row["stage"] + "\t{:.3f}\t{}\t{:.0f}".format(
+              row["seconds"], "{:.1f}".format(row["items_per_s"]) if row["items_per_s"] is not None else "-", row["peak_rss_mb"])
+              + ("\t{:.2f}x".format(ratio) if ratio is not None else ("\t-" if previous_path is not None else "")))
+    print("\nSaved in " + output_path)
@@ -0,0 +1,62 @@
+"""
+Calibration of the vote margins (see voting.margins()) into confidence scores: the estimated probability that a prediction is correct.
+The map from margin to probability is fitted by isotonic regression on predictions whose correctness is known (e.g. the queries of a test set),
+so it is non-decreasing: a larger margin never gives a lower confidence.
+"""
+
+import numpy as np
+
+
+class Calibration:
+    """
+    Non-decreasing piecewise linear map from vote margin to probability of a correct prediction.
+    """
+
+    def __init__(self, margins, probabilities):
+        self.margins = np.asarray(margins, dtype=np.float64)
+        self.probabilities = np.asarray(probabilities, dtype=np.float64)
+
+    @classmethod
+    def fit(cls, margins, correct):
+        """
+        Fit the map on the margins of some predictions and whether each of them is correct (pool adjacent violators algorithm).
+        """
+        order = np.argsort(margins, kind="stable")
+        margins = np.asarray(margins, dtype=np.float64)[order]
+        correct = np.asarray(correct, dtype=np.float64)[order]
+        if margins.shape[0] == 0:
+            return cls([0.0, 1.0], [0.0, 0.0])
+
+        # Blocks of equal margins, then merged while their mean is larger than the mean of the next block
+        values, starts = np.unique(margins, return_index=True)
+        sums = np.add.reduceat(correct, starts)
+        weights = np.diff(np.append(starts, margins.shape[0])).astype(np.float64)
+        blocks = [] # [sum, weight, first margin, last margin]
+        for value, total, weight in zip(values, sums, weights):
+            blocks.append([total, weight, value, value])
+            while len(blocks) > 1 and blocks[-2][0] / blocks[-2][1] >= blocks[-1][0] / blocks[-1][1]:
+                total, weight, _, last = blocks.pop()
+                blocks[-1][0] += total
+                blocks[-1][1] += weight
+                blocks[-1][3] = last
+
+        # Each block is a flat segment from its first to its last margin
+        points = []
+        probabilities = []
+        for total, weight, first, last in blocks:
+            points.extend([first, last] if last > first else [first])
+            probabilities.extend([total / weight] * (2 if last > first else 1))
+        return cls(points, probabilities)
+
+    def predict(self, margins):
+        """
+        Return the confidence of each margin, interpolated between the fitted points (constant outside of them).
+        """
+        return np.interp(margins, self.margins, self.probabilities)
+
+    def to_dict(self):
+        return {"margins": self.margins.round(6).tolist(), "probabilities": self.probabilities.round(6).tolist()}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["margins"], data["probabilities"])
@@ -0,0 +1,117 @@
+#!/usr/bin/python3
+
+# Usage: python3 -m factcheck.crossval <examples_file> [--folds FOLDS] [--output OUTPUT_FOLDER] [--policy POLICY] [--decision DECISION] [--min-margin MIN_MARGIN]
+
+"""
+Cross-validation of the semantic search on a control set, without building other control sets: every example is labelled from the other examples,
+as if it were a query and they were the control set.
+The control set is embedded once (or loaded from the embedding cache), and the top-K of its self-similarity matrix is computed in chunks of rows,
+with the examples of the same fold as the query masked out: its own row only for leave-one-out, or its whole fold for k-fold.
+The voting of every threshold and N is then evaluated at once against the labels of the control set, as in the sweep of a test set (see sweep.py),
+and the exact metrics-vs-threshold curves are computed from the same neighbours (see curves.py).
+"""
+
+import os, argparse
+import numpy as np
+from . import curves, metrics, results_store, search_index, sweep
+
+# SETTINGS
+CHUNK_SIZE = 4096 # Number of rows of the self-similarity matrix computed at once
+FOLD_SEED = 0 # Seed of the random assignment of the examples to the folds
+
+
+def assign_folds(size, folds=None, seed=FOLD_SEED):
+    """
+    Return the fold of every example: its own row for leave-one-out (folds is None), otherwise a random fold among the given number, of equal sizes.
+    """
+    if folds is None:
+        return np.arange(size)
+    return np.random.default_rng(seed).permutation(size) % folds
+
+
+def self_neighbours(embeddings, fold_ids, top_k, chunk_size=CHUNK_SIZE):
+    """
+    Return the scores and the indices of the top_k most similar examples of each example, among the examples of the other folds,
+    as matrices sorted by decreasing cosine similarity.
+    """
+    vectors = search_index.normalize(embeddings)
+    top_k = min(top_k, int(vectors.shape[0] - np.bincount(fold_ids).max()))
+    top_scores = []
+    top_indices = []
+    for start in range(0, vectors.shape[0], chunk_size):
+        scores = vectors[start:start + chunk_size] @ vectors.T
+        scores[fold_ids[start:start + chunk_size, None] == fold_ids[None, :]] = -np.inf
+        chunk_scores, chunk_indices = search_index.top_k_rows(scores, top_k)
+        top_scores.append(chunk_scores)
+        top_indices.append(chunk_indices)
+    return np.concatenate(top_scores), np.concatenate(top_indices)
+
+
+def cross_validate(labeler, top_scores, top_indices, fold_ids, thresholds, ns):
+    """
+    Label every example from its neighbours in the other folds, for every threshold and N, and evaluate them against the labels of the control set.
+    Return one dictionary per threshold and N with the metrics over all the examples and, for k-fold, the standard deviation of the accuracy and macro-F1 across the folds.
+    """
+    expected = metrics.encode_expected(labeler.corpus_labels)
+    configs = [(threshold, n) for threshold in thresholds for n in ns]
+    predicted = np.stack([metrics.encode_predicted(labeler.label_all(top_scores, top_indices, n, threshold)) for threshold, n in configs])
+    results = metrics.evaluate(expected, predicted)
+
+    records = []
+    folds = np.unique(fold_ids)
+    by_fold = [metrics.evaluate(expected[fold_ids == fold], predicted[:, fold_ids == fold]) for fold in folds] if folds.shape[0] < len(fold_ids) else None
+    for i, ((threshold, n), result) in enumerate(zip(configs, results)):
+        record = dict({"threshold": threshold, "n": n}, **result)
+        if by_fold is not None:
+            record["accuracy_std"] = round(float(np.std([fold_results[i]["accuracy"] for fold_results in by_fold])), 2)
+            record["macro_f1_std"] = round(float(np.std([fold_results[i]["macro_f1"] for fold_results in by_fold])), 2)
+        records.append(record)
+    return records
+
+
+def run_crossval(retriever, labeler, examples_file, folds=None, thresholds=sweep.THRESHOLDS, ns=sweep.NS, output=None):
+    """
+    Cross-validate the control set loaded in the retriever with the labeler (leave-one-out if folds is None, otherwise k-fold).
+    If output is given, the results are saved in <output>/results/results.jsonl, and the exact curves in <output>/results/curves.jsonl.
+    Return the records of the results table.
+    """
+    fold_ids = assign_folds(len(retriever.corpus), folds)
+    top_scores, top_indices = self_neighbours(retriever.corpus_embeddings, fold_ids, max(ns))
+    ns = [n for n in ns if n <= top_scores.shape[1]]
+    info = {"mode": "leave-one-out" if folds is None else str(folds) + "-fold", "test_set": os.path.basename(examples_file), "column": "claim", "model": "semantic_search",
+            "policy": labeler.policy, "decision": labeler.decision, "min_margin": labeler.min_margin}
+    records = [dict(info, **record) for record in cross_validate(labeler, top_scores, top_indices, fold_ids, thresholds, ns)]
+
+    if output is not None:
+        os.makedirs(os.path.join(output, "results"), exist_ok=True)
+        results_store.write_results(os.path.join(output, "results", results_store.RESULTS_FILE), records)
+        if sweep.THRESHOLD_CURVES:
+            points = curves.threshold_curves(labeler, top_scores, top_indices, metrics.encode_expected(labeler.corpus_labels), ns)
+            results_store.write_results(os.path.join(output, "results", results_store.CURVES_FILE), [dict(info, **point) for point in points])
+    return records
+
+
+if __name__ == "__main__":
+    from .retrieval import Retriever
+    from .labeling import Labeler, POLICIES, DEFAULT_POLICY, DEFAULT_DECISION
+    from .voting import DECISIONS
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("examples_file", help="Control set")
+    parser.add_argument("--folds", help="Number of folds (default: leave-one-out)", type=int, default=None)
+    parser.add_argument("--output", help="Output folder where to save the results table and the curves (default: none, only printed)", default=None)
+    parser.add_argument("--policy", help="Voting policy (default: " + DEFAULT_POLICY + ")", choices=list(POLICIES), default=DEFAULT_POLICY)
+    parser.add_argument("--decision", help="'majority' (one vote per example) or 'weighted' (each example votes with its score) (default: " + DEFAULT_DECISION + ")", choices=DECISIONS, default=DEFAULT_DECISION)
+    parser.add_argument("--min-margin", help="Abstain when the vote margin of the label is below this value, between 0 and 1 (default: 0)", type=float, default=0.0)
+    args = parser.parse_args()
+
+    retriever = Retriever().load_examples(args.examples_file)
+    labeler = Labeler.from_retriever(retriever, policy=args.policy, decision=args.decision, min_margin=args.min_margin)
+    records = run_crossval(retriever, labeler, args.examples_file, args.folds, output=args.output)
+
+    print(records[0]["mode"] + " on " + str(len(retriever.corpus)) + " examples of " + args.examples_file + "\n")
+    print("threshold\tn\taccuracy\tmacro-F1\tabstention rate\tpure error rate" + ("\taccuracy std\tmacro-F1 std" if "accuracy_std" in records[0] else ""))
+    for record in sorted(records, key=lambda record: (record["accuracy"], record["macro_f1"]), reverse=True)[:10]:
+        print("\t".join(str(record[key]) for key in ["threshold", "n", "accuracy", "macro_f1", "abstention_rate", "pure_error_rate", "accuracy_std", "macro_f1_std"] if key in record))
+    if args.output is not None:
+        print("\nResults are saved in " + os.path.join(args.output, "results"))
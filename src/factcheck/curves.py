@@ -0,0 +1,145 @@
+#!/usr/bin/python3
+
+# Usage: python3 -m factcheck.curves <run_folder> <test_set_file>
+
+"""
+Exact metrics-vs-threshold curves: the label of a query only changes when the threshold crosses the score of one of its first N retrieved examples,
+so the metrics of every threshold are those of one of the intervals between the distinct scores.
+For each N, the label of every query is computed for each number m of its first N examples above the threshold (0 to N, a prefix since the scores are sorted),
+and the scores of all the queries are swept once in decreasing order: each score moves its query from m to m + 1 examples above the threshold,
+which is a single update of the confusion counts (expected x predicted label). The metrics of every interval are computed from these counts,
+so the whole curve costs one sort and one cumulative sum, instead of a vote and an evaluation per threshold.
+Each point of a curve holds for the thresholds from its own one up to (excluded) the threshold of the previous point, the points being sorted by decreasing threshold.
+When run as a module (python3 -m factcheck.curves), it checks the curves of a run (from its neighbour table) against the sweep at the thresholds of the grid.
+"""
+
+import os, sys, argparse
+import numpy as np
+from . import metrics, voting
+
+LOWEST_THRESHOLD = -1.0 # Threshold of the last point of a curve, under every score (cosine similarity)
+
+EXPECTED_CODES = 4 # TRUE, FALSE, NONE, UNKNOWN_EXPECTED (see metrics.py)
+PREDICTED_CODES = 5 # TRUE, FALSE, NONE, (UNKNOWN_EXPECTED), UNKNOWN_PREDICTED
+
+
+def prefix_labels(labeler, top_scores, top_indices, n):
+    """
+    Return the matrix ((n + 1) x queries) of the label codes (see metrics.encode_predicted()) of every query when only its first m examples are above the threshold, for m = 0 ... n.
+    """
+    scores = top_scores[:, :n]
+    width = scores.shape[1]
+    if labeler.corpus_counts is not None: # one column per label code of each cluster (see voting.cluster_codes())
+        codes, counts = voting.cluster_codes(labeler.corpus_counts, top_scores, top_indices, n, -np.inf)
+        scores = np.repeat(scores, voting.CLUSTER_CODES, axis=1)
+        positions = np.arange(codes.shape[1]) // voting.CLUSTER_CODES
+        counts = np.tile(counts, (width + 1, 1))
+    else:
+        codes = voting.neighbour_codes(labeler.corpus_codes, top_scores, top_indices, n, -np.inf)
+        positions = np.arange(width)
+        counts = None
+    stacked = np.concatenate([np.where(positions < m, codes, voting.BELOW_THRESHOLD) for m in range(width + 1)]).astype(np.int8)
+    predicted, _ = labeler.vote(stacked, np.tile(scores, (width + 1, 1)), counts)
+    return metrics.encode_predicted(voting.decode(predicted)).reshape(width + 1, codes.shape[0])
+
+
+def confusion_curve(labeler, top_scores, top_indices, expected, n):
+    """
+    Return the thresholds (decreasing) of the curve of N = n, and the confusion counts (points x EXPECTED_CODES x PREDICTED_CODES) of each of them.
+    """
+    scores = top_scores[:, :n]
+    queries, width = scores.shape
+    predicted = prefix_labels(labeler, top_scores, top_indices, n)
+
+    # Every (query, position) is an event, sorted by decreasing score. The stable sort keeps the positions of a query in order for equal scores.
+    # The padding of the queries with fewer than n candidates (score -inf, see threshold_curves()) is under every threshold, so it is not an event
+    order = np.argsort(-scores.ravel(), kind="stable")
+    order = order[np.isfinite(scores.ravel()[order])]
+    sorted_scores = scores.ravel()[order]
+    query = order // width
+    position = order % width
+    deltas = np.zeros((order.shape[0] + 1, EXPECTED_CODES * PREDICTED_CODES), dtype=np.int64)
+    deltas[0] = np.bincount(expected * PREDICTED_CODES + predicted[0], minlength=EXPECTED_CODES * PREDICTED_CODES) # no example above the threshold
+    events = np.arange(1, order.shape[0] + 1)
+    deltas[events, expected[query] * PREDICTED_CODES + predicted[position, query]] -= 1
+    deltas[events, expected[query] * PREDICTED_CODES + predicted[position + 1, query]] += 1
+    counts = np.cumsum(deltas, axis=0)
+
+    # The counts after the last event of each group of equal scores hold down to the next distinct score
+    last = np.flatnonzero(np.append(sorted_scores[1:] != sorted_scores[:-1], True)) if order.shape[0] > 0 else np.zeros(0, dtype=np.int64)
+    thresholds = np.concatenate([sorted_scores[:1], sorted_scores[last[:-1] + 1], [LOWEST_THRESHOLD]]) if order.shape[0] > 0 else np.array([LOWEST_THRESHOLD])
+    counts = np.concatenate([counts[:1], counts[last + 1]]).reshape(-1, EXPECTED_CODES, PREDICTED_CODES)
+
+    # A point with the same counts as the next (lower) one is merged into it
+    keep = np.append((counts[:-1] != counts[1:]).any(axis=(1, 2)), True)
+    return thresholds[keep], counts[keep]
+
+
+def curve_metrics(counts, expected):
+    """
+    Return the metrics (see metrics.compute_rates()) of every confusion counts matrix.
+    """
+    total_true = int((expected == metrics.TRUE).sum())
+    total_false = int((expected == metrics.FALSE).sum())
+    correct_true = counts[:, metrics.TRUE, metrics.TRUE]
+    correct_false = counts[:, metrics.FALSE, metrics.FALSE]
+    correct = correct_true + correct_false + counts[:, metrics.NONE, metrics.NONE]
+    incorrect_true = counts[:, metrics.TRUE].sum(axis=1) - correct_true
+    incorrect_false = counts[:, metrics.FALSE].sum(axis=1) - correct_false
+    total_none = counts[:, :, metrics.NONE].sum(axis=1)
+    return [metrics.compute_rates(expected.shape[0], total_true, total_false, int(correct[i]), int(correct_true[i]), int(correct_false[i]),
+                                  int(incorrect_true[i]), int(incorrect_false[i]), int(total_none[i])) for i in range(counts.shape[0])]
+
+
+def threshold_curves(labeler, top_scores, top_indices, expected, ns):
+    """
+    Return the points of the exact curve of each N (n, threshold and metrics), with the voting policy, decision and minimum margin of the labeler.
+    The examples must have been retrieved with a top_k of at least max(ns), and expected are the codes of the test set (see metrics.load_test_set()).
+    """
+    top_indices = np.asarray(top_indices)
+    # Compared in double precision, as in voting.neighbour_codes(). The missing examples (index -1, e.g. IVF or live index with fewer than top_k candidates) are padding
+    top_scores = np.where(top_indices < 0, -np.inf, np.asarray(top_scores, dtype=np.float64))
+    top_scores[~np.isfinite(top_scores)] = -np.inf
+    expected = np.asarray(expected)
+    points = []
+    for n in ns:
+        thresholds, counts = confusion_curve(labeler, top_scores, top_indices, expected, n)
+        for threshold, result in zip(thresholds.tolist(), curve_metrics(counts, expected)):
+            points.append(dict({"n": n, "threshold": threshold}, **result))
+    return points
+
+
+def value_at(points, n, threshold):
+    """
+    Return the point of the curve of N = n that holds for the given threshold.
+    """
+    curve = [point for point in points if point["n"] == n]
+    return next(point for point in curve if point["threshold"] <= threshold)
+
+
+if __name__ == "__main__":
+    from .labeling import Labeler
+    from .neighbours import NeighbourTable, NEIGHBOURS_FOLDER
+    from .datasets import read_table
+    from .results_store import run_info
+    from .sweep import THRESHOLDS, NS
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("run_folder", help="Output folder of a run (<mode>/<test_set>/<column>), with its neighbour table")
+    parser.add_argument("test_set_file", help="Test set of the run")
+    args = parser.parse_args()
+
+    table = NeighbourTable.load(os.path.join(args.run_folder, NEIGHBOURS_FOLDER))
+    examples = read_table(table.info["examples"], ["claim", "label"])
+    labeler = Labeler(examples["claim"].tolist(), examples["label"].tolist())
+    evaluator = metrics.Evaluator(args.test_set_file, run_info(args.run_folder)[2])
+    ns = [n for n in NS if n <= table.k]
+
+    points = threshold_curves(labeler, table.scores, table.indices, evaluator.expected, ns)
+    configs = [(threshold, n) for threshold in THRESHOLDS for n in ns]
+    results = evaluator.evaluate_labels([labeler.label_all(table.scores, table.indices, n, threshold) for threshold, n in configs])
+    mismatches = [(threshold, n) for (threshold, n), result in zip(configs, results) if dict(value_at(points, n, threshold), n=None, threshold=None) != dict(result, n=None, threshold=None)]
+    for n in ns:
+        print("N = " + str(n) + ": " + str(sum(1 for point in points if point["n"] == n)) + " points")
+    print(str(len(configs)) + " thresholds and Ns of the grid checked, " + str(len(mismatches)) + " mismatches " + (str(mismatches) if mismatches else ""))
+    sys.exit(1 if mismatches else 0)
@@ -0,0 +1,185 @@
+#!/usr/bin/python3
+
+# Usage: python3 -m factcheck.datasets <tsv_file> [<tsv_file> ...]
+
+"""
+Reading of the control sets and test sets, and their compact columnar version.
+The TSV files have 17 or more columns (among which five long evidence snippets and five links), but only a few of them are used:
+read_table() only returns the requested columns. If the dataset has been converted (see convert()), they are read from the columnar version,
+where each column is stored separately and memory-mapped, so the other columns are never read nor parsed:
+- text columns: the UTF-8 bytes of all the values in data.bin, with their offsets and null mask (.npy)
+- category columns (CATEGORY_COLUMNS, e.g. the label): one small integer per row (.npy), and the list of categories
+The columnar version of <name>.tsv is the directory <name>.cols next to it. It is used instead of the TSV file as long as the TSV file is not modified,
+and it can also be passed directly wherever a TSV file is expected.
+When run as a module (python3 -m factcheck.datasets), it converts the given TSV files and compares their loading time.
+"""
+
+import os, sys, csv, json, shutil, time
+import numpy as np
+import pandas as pd
+
+# SETTINGS
+USE_COLUMNAR = True # If True, the columnar version of a TSV file is used when it is up to date
+CATEGORY_COLUMNS = ["label", "language", "site"] # Columns with few distinct values, stored as integer codes
+
+COLUMNAR_SUFFIX = ".cols"
+
+
+def columnar_path(tsv_path):
+    """
+    Return the path of the columnar version of a TSV file (<name>.cols).
+    """
+    return os.path.splitext(tsv_path)[0] + COLUMNAR_SUFFIX
+
+
+def source_info(tsv_path):
+    """
+    Return the size and modification time of a TSV file, used to check that its columnar version is up to date.
+    """
+    stat = os.stat(tsv_path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def convert(tsv_path, output_path=None):
+    """
+    Write the columnar version of a TSV file (by default next to it, see columnar_path()), and return its path.
+    Every column is stored as text (as read by pandas, empty values are nulls), except the CATEGORY_COLUMNS.
+    """
+    output_path = output_path if output_path is not None else columnar_path(tsv_path)
+    dataset = pd.read_csv(tsv_path, sep="\t", header=0, quoting=csv.QUOTE_NONE, dtype=str)
+
+    # Written to a temporary directory and then renamed, so a columnar dataset is never left half-written
+    tmp_path = output_path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    columns = {}
+    for i, name in enumerate(dataset.columns):
+        values = dataset[name]
+        prefix = os.path.join(tmp_path, str(i))
+        if name in CATEGORY_COLUMNS:
+            codes, categories = pd.factorize(values) # nulls are -1
+            np.save(prefix + ".codes.npy", codes.astype(np.int8 if len(categories) < 128 else np.int32))
+            columns[name] = {"file": str(i), "type": "category", "categories": categories.tolist()}
+        else:
+            nulls = values.isnull().to_numpy()
+            encoded = [value.encode("utf-8") if not null else b"" for value, null in zip(values.tolist(), nulls)]
+            offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum([len(value) for value in encoded])
+            with open(prefix + ".data.bin", "wb") as f:
+                f.write(b"".join(encoded))
+            np.save(prefix + ".offsets.npy", offsets)
+            np.save(prefix + ".nulls.npy", nulls)
+            columns[name] = {"file": str(i), "type": "text"}
+    with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+        json.dump({"rows": len(dataset), "columns": columns, "source": source_info(tsv_path)}, f, indent=4)
+    shutil.rmtree(output_path, ignore_errors=True)
+    os.replace(tmp_path, output_path)
+    return output_path
+
+
+class ColumnarTable:
+    """
+    Columnar dataset: only the metadata is read when it is opened, and each column is memory-mapped when it is requested.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), "r") as f:
+            meta = json.load(f)
+        self.rows = meta["rows"]
+        self.meta = meta["columns"]
+        self.source = meta["source"]
+
+    @property
+    def columns(self):
+        return list(self.meta)
+
+    def codes(self, name):
+        """
+        Return the integer codes (-1 for nulls) and the categories of a category column.
+        """
+        meta = self.meta[name]
+        return np.load(os.path.join(self.path, meta["file"] + ".codes.npy"), mmap_mode="r"), meta["categories"]
+
+    def column(self, name):
+        """
+        Return the values of a column as a pandas Series of strings, where the nulls are NaN (as read from the TSV file).
+        """
+        meta = self.meta[name]
+        if meta["type"] == "category":
+            codes, categories = self.codes(name)
+            values = np.array(categories + [np.nan], dtype=object)[np.where(codes < 0, len(categories), codes)]
+            return pd.Series(values, name=name, dtype=object)
+        prefix = os.path.join(self.path, meta["file"])
+        offsets = np.load(prefix + ".offsets.npy", mmap_mode="r").tolist()
+        nulls = np.load(prefix + ".nulls.npy", mmap_mode="r")
+        with open(prefix + ".data.bin", "rb") as f:
+            data = f.read(offsets[-1])
+        values = [data[start:end].decode("utf-8") for start, end in zip(offsets[:-1], offsets[1:])]
+        values = pd.Series(values, name=name, dtype=object)
+        values[np.asarray(nulls)] = np.nan
+        return values
+
+
+def is_columnar(path):
+    return os.path.isfile(os.path.join(path, "meta.json"))
+
+
+def open_columnar(path):
+    """
+    Return the ColumnarTable of a dataset path: the path itself if it is a columnar dataset, or the up-to-date columnar version of a TSV file.
+    Return None if there is none.
+    """
+    if is_columnar(path):
+        return ColumnarTable(path)
+    if USE_COLUMNAR and is_columnar(columnar_path(path)):
+        table = ColumnarTable(columnar_path(path))
+        if table.source == source_info(path):
+            return table
+    return None
+
+
+def table_columns(path):
+    """
+    Return the names of the columns of a dataset (TSV file or columnar dataset).
+    """
+    table = open_columnar(path)
+    if table is not None:
+        return table.columns
+    return pd.read_csv(path, sep="\t", header=0, quoting=csv.QUOTE_NONE, nrows=0).columns.tolist()
+
+
+def read_table(path, columns):
+    """
+    Return a DataFrame with only the given columns of a dataset (TSV file or columnar dataset), with the label as strings.
+    """
+    table = open_columnar(path)
+    if table is not None:
+        return pd.DataFrame({name: table.column(name) for name in columns})
+    return pd.read_csv(path, sep="\t", header=0, quoting=csv.QUOTE_NONE, usecols=columns, dtype={"label": str})[columns]
+
+
+def dataset_size(path):
+    """
+    Return the size in bytes of a TSV file, or of all the files of a columnar dataset.
+    """
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+    return os.path.getsize(path)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python3 -m factcheck.datasets <tsv_file> [<tsv_file> ...]")
+        sys.exit(1)
+
+    for tsv_path in sys.argv[1:]:
+        output_path = convert(tsv_path)
+        start = time.perf_counter()
+        pd.read_csv(tsv_path, sep="\t", header=0, quoting=csv.QUOTE_NONE, dtype={"label": str})
+        tsv_time = time.perf_counter() - start
+        start = time.perf_counter()
+        read_table(output_path, ["claim", "label"])
+        columnar_time = time.perf_counter() - start
+        print(tsv_path + " -> " + output_path + ": " + str(dataset_size(output_path) // 1024) + " KB (TSV: " + str(dataset_size(tsv_path) // 1024) + " KB), "
+              + "claim and label loaded in {:.1f} ms (whole TSV: {:.1f} ms)".format(columnar_time * 1000, tsv_time * 1000))
@@ -0,0 +1,192 @@
+#!/usr/bin/python3
+
+# Usage: python3 -m factcheck.dedup <examples_file> <test_set_file> <column> [--thresholds THRESHOLD [THRESHOLD ...]]
+
+"""
+Collapsing of the near-duplicate claims of a control set: the fact-check archives contain many near-identical claims (same statement, another site or date),
+which make the index larger and count several times in the top-N of a query.
+The claims are clustered when their cosine similarity with the representative of a cluster is at least the dedup threshold (greedy clustering, in the order of the control set:
+a claim joins the most similar representative above the threshold, or becomes the representative of a new cluster).
+Only the representatives are indexed, with the label counts of the members of their cluster, and the vote of a retrieved representative counts its members
+(see voting.cluster_codes()). It is enabled with a dedup threshold in the Retriever (see retrieval.DEDUP_THRESHOLD).
+The clustering is computed once and saved in INDEX_DIR, keyed by the hash of the embeddings and the threshold (see load_collapsed()):
+the rows and the embeddings of the representatives, and the cluster of every example, from which the label counts are computed at load
+(so a relabelled control set with the same claims reuses it).
+When run as a module (python3 -m factcheck.dedup), it compares the raw control set with the collapsed ones on a test set column:
+index size, retrieval throughput, accuracy and macro-F1 of the best threshold/N of the sweep and of the default arguments, and the predictions that change.
+"""
+
+import os, time, shutil, argparse
+import numpy as np
+from . import voting
+from .search_index import INDEX_DIR, embeddings_hash, index_path, normalize
+
+# SETTINGS
+CHUNK_SIZE = 4096 # Number of claims compared at once with the representatives, and number of representatives per block
+
+
+def cluster(embeddings, threshold, chunk_size=CHUNK_SIZE):
+    """
+    Return the rows of the representatives of the clusters, and the cluster of every row of the embeddings.
+    The claims of a chunk are compared at once with the representatives of the previous chunks, stored in blocks of chunk_size rows
+    (so the score matrix is at most chunk_size x chunk_size), and the new representatives of the chunk are found with new_representatives().
+    """
+    vectors = normalize(embeddings)
+    assignment = np.empty(vectors.shape[0], dtype=np.int64)
+    blocks = [] # representatives of the previous chunks, chunk_size per block (the last one can be partial)
+    count = 0 # number of representatives
+    rows = []
+    for start in range(0, vectors.shape[0], chunk_size):
+        chunk = vectors[start:start + chunk_size]
+        best = np.zeros(chunk.shape[0], dtype=np.int64)
+        best_scores = np.full(chunk.shape[0], -np.inf, dtype=np.float32)
+        for b, block in enumerate(blocks):
+            scores = chunk @ block.T
+            block_best = scores.argmax(axis=1)
+            block_scores = scores[np.arange(chunk.shape[0]), block_best]
+            better = block_scores > best_scores # the first most similar representative, as with a single argmax
+            best[better] = b * chunk_size + block_best[better]
+            best_scores[better] = block_scores[better]
+
+        similarities = chunk @ chunk.T
+        new = new_representatives(similarities, best_scores, threshold)
+        # A claim joins a representative of the chunk that precedes it if it is more similar than the best previous one
+        new_scores = np.where(np.arange(chunk.shape[0])[:, None] > new[None, :], similarities[:, new], -np.inf)
+        cluster_ids, scores = best, best_scores
+        if new.shape[0] > 0:
+            j = new_scores.argmax(axis=1)
+            closer = new_scores[np.arange(chunk.shape[0]), j] > best_scores
+            cluster_ids = np.where(closer, count + j, best)
+        assignment[start:start + chunk.shape[0]] = cluster_ids
+        assignment[start + new] = count + np.arange(new.shape[0])
+
+        pending = chunk[new]
+        while pending.shape[0] > 0:
+            if len(blocks) == 0 or blocks[-1].shape[0] == chunk_size:
+                blocks.append(np.zeros((0, vectors.shape[1]), dtype=np.float32))
+            space = chunk_size - blocks[-1].shape[0]
+            blocks[-1] = np.concatenate([blocks[-1], pending[:space]])
+            pending = pending[space:]
+        count += new.shape[0]
+        rows.extend(start + new)
+    return np.array(rows, dtype=np.int64), assignment
+
+
+def new_representatives(similarities, best_scores, threshold):
+    """
+    Return the rows of a chunk (sorted) that are new representatives: the claims under the threshold with every previous representative
+    and with every new representative that precedes them in the chunk (as in the greedy clustering, one claim at a time).
+    They are found in rounds: a candidate with a preceding new representative above the threshold is a member,
+    and a candidate whose preceding candidates above the threshold are all members is a representative.
+    """
+    candidates = np.flatnonzero(best_scores < threshold)
+    edges = np.tril(similarities[np.ix_(candidates, candidates)] >= threshold, -1) # edges[i, j]: candidate j precedes i and is above the threshold
+    state = np.zeros(candidates.shape[0], dtype=np.int8) # 0: undecided, 1: representative, 2: member
+    state[~edges.any(axis=1)] = 1
+    undecided = np.flatnonzero(state == 0)
+    while undecided.shape[0] > 0:
+        state[undecided[edges[np.ix_(undecided, np.flatnonzero(state == 1))].any(axis=1)]] = 2
+        undecided = np.flatnonzero(state == 0)
+        state[undecided[~edges[np.ix_(undecided, undecided)].any(axis=1)]] = 1
+        undecided = np.flatnonzero(state == 0)
+    return candidates[state == 1]
+
+
+def label_counts(corpus_labels, assignment, clusters):
+    """
+    Return the matrix (clusters x voting.CLUSTER_CODES) of the number of members of each cluster with each label code.
+    """
+    codes = voting.encode_labels(corpus_labels).astype(np.int64)
+    codes[codes == voting.BELOW_THRESHOLD] = voting.UNKNOWN # missing labels
+    return np.bincount(assignment * voting.CLUSTER_CODES + codes, minlength=clusters * voting.CLUSTER_CODES).reshape(clusters, voting.CLUSTER_CODES)
+
+
+def collapse(embeddings, corpus_labels, threshold):
+    """
+    Return the rows of the representatives of the near-duplicate clusters of a control set, and the label counts of each cluster (see label_counts()).
+    """
+    representatives, assignment = cluster(embeddings, threshold)
+    return representatives, label_counts(corpus_labels, assignment, representatives.shape[0])
+
+
+def load_collapsed(embeddings, corpus_labels, threshold, index_dir=INDEX_DIR):
+    """
+    Return the rows and the unit-length embeddings (memory-mapped) of the representatives of the near-duplicate clusters of a control set, and the label counts of each cluster.
+    The clustering is loaded from index_dir if it was already computed for the same embeddings and threshold, otherwise it is computed and saved.
+    """
+    path = index_path(embeddings_hash(embeddings) + "-" + str(threshold), "dedup", index_dir)
+    if not os.path.isfile(os.path.join(path, "embeddings.npy")):
+        representatives, assignment = cluster(embeddings, threshold)
+        # Written to a temporary directory and then renamed, so a clustering is never left half-written
+        tmp_path = path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        np.save(os.path.join(tmp_path, "representatives.npy"), representatives)
+        np.save(os.path.join(tmp_path, "assignment.npy"), assignment)
+        np.save(os.path.join(tmp_path, "embeddings.npy"), np.asarray(normalize(embeddings[representatives]), dtype=np.float32))
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+    representatives, assignment, representative_embeddings = [np.load(os.path.join(path, name + ".npy"), mmap_mode="r")
+                                                               for name in ["representatives", "assignment", "embeddings"]]
+    return np.asarray(representatives), representative_embeddings, label_counts(corpus_labels, np.asarray(assignment), representatives.shape[0])
+
+
+def benchmark(examples_file, test_set_file, column, thresholds, default_threshold=0.5, default_n=3):
+    """
+    Run the sweep of the test set column on the raw control set and on the control set collapsed at each dedup threshold, sharing one model.
+    Return one dictionary per dedup threshold (None for the raw control set): number of examples, index size, load and retrieval time,
+    metrics of the best and of the default arguments, and the predictions of the default arguments that differ from the raw control set.
+    """
+    from sentence_transformers import SentenceTransformer
+    from .retrieval import Retriever, MODEL_NAME, preprocess_query
+    from .inputs import InputBuilder
+    from .labeling import Labeler
+    from .metrics import Evaluator, encode_predicted
+    from .sweep import THRESHOLDS, NS
+
+    queries = [preprocess_query(query) for query in InputBuilder(test_set_file).queries(column)]
+    evaluator = Evaluator(test_set_file, column)
+    embedder = SentenceTransformer(MODEL_NAME)
+    configs = [(threshold, n) for threshold in THRESHOLDS for n in NS]
+    default = configs.index((default_threshold, default_n))
+    rows = []
+    raw_predicted = None
+    for dedup_threshold in [None] + list(thresholds):
+        start = time.perf_counter()
+        retriever = Retriever(embedder=embedder, dedup_threshold=dedup_threshold).load_examples(examples_file)
+        load_time = time.perf_counter() - start
+        start = time.perf_counter()
+        top_scores, top_indices = retriever.retrieve(queries, max(NS))
+        retrieval_time = time.perf_counter() - start
+
+        labeler = Labeler.from_retriever(retriever)
+        labels = [labeler.label_all(top_scores, top_indices, n, threshold) for threshold, n in configs]
+        results = evaluator.evaluate_labels(labels)
+        best = max(range(len(configs)), key=lambda i: (results[i]["accuracy"], results[i]["macro_f1"]))
+        predicted = encode_predicted(labels[default])
+        if raw_predicted is None:
+            raw_predicted = predicted
+        changed = predicted != raw_predicted
+        rows.append({"dedup_threshold": dedup_threshold, "examples": len(retriever.corpus), "index_mb": len(retriever.corpus) * retriever.corpus_embeddings.shape[1] * 4 / 1024 / 1024,
+                     "load_s": load_time, "retrieval_s": retrieval_time, "queries_per_s": len(queries) / retrieval_time,
+                     "best": configs[best], "best_accuracy": results[best]["accuracy"], "best_macro_f1": results[best]["macro_f1"],
+                     "default_accuracy": results[default]["accuracy"], "default_macro_f1": results[default]["macro_f1"],
+                     "changed": int(changed.sum()), "now_correct": int((changed & (predicted == evaluator.expected)).sum()),
+                     "now_wrong": int((changed & (raw_predicted == evaluator.expected)).sum())})
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("examples_file", help="Control set")
+    parser.add_argument("test_set_file", help="Test set")
+    parser.add_argument("column", help="Input column of the test set (claim, news-like or social-like)")
+    parser.add_argument("--thresholds", help="Dedup thresholds to compare with the raw control set (default: 0.98 0.95 0.9)", type=float, nargs="+", default=[0.98, 0.95, 0.9])
+    args = parser.parse_args()
+
+    rows = benchmark(args.examples_file, args.test_set_file, args.column, args.thresholds)
+    print("dedup threshold\texamples\tindex (MB)\tload (s)\tretrieval (s)\tqueries/s\tbest (threshold, N)\tbest accuracy\tbest macro-F1\taccuracy (0.5, 3)\tmacro-F1 (0.5, 3)\tchanged\tnow correct\tnow wrong")
+    for row in rows:
+        print("{}\t{}\t{:.2f}\t{:.2f}\t{:.3f}\t{:.1f}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}".format("raw" if row["dedup_threshold"] is None else row["dedup_threshold"], row["examples"],
+              row["index_mb"], row["load_s"], row["retrieval_s"], row["queries_per_s"], row["best"], row["best_accuracy"], row["best_macro_f1"],
+              row["default_accuracy"], row["default_macro_f1"], row["changed"], row["now_correct"], row["now_wrong"]))
@@ -0,0 +1,181 @@
+"""
+On-disk cache of the control set embeddings.
+Each cached control set is stored as a .npy matrix (loaded memory-mapped) and a .json index with the hash of each claim.
+The cache key depends on the model name, the normalization setting and the hash of every claim, so it is invalidated automatically when the TSV or the model changes.
+When a control set is not cached, the claims already embedded in other entries (e.g. train_dev.tsv for train_dev_ood.tsv) are reused, and only the new claims are encoded.
+When the cache directory grows over MAX_CACHE_SIZE_MB, the least recently used entries are evicted.
+"""
+
+import os, json, hashlib, time
+import numpy as np
+
+# SETTINGS
+CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "embedding_cache") # Where the cached embeddings are saved
+MAX_CACHE_SIZE_MB = 512 # Maximum size of the cache directory, the least recently used entries are deleted above it
+
+
+def text_hash(text):
+    """
+    Return the hash of a claim text.
+    """
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def cache_key(model_name, normalize, hashes):
+    """
+    Return the key of a cache entry, from the model name, the normalization setting and the hashes of the claims.
+    """
+    key = hashlib.sha1()
+    key.update((model_name + "\t" + str(normalize) + "\n").encode("utf-8"))
+    for h in hashes:
+        key.update(h.encode("utf-8"))
+    return key.hexdigest()
+
+
+def encode_corpus(embedder, corpus, model_name, normalize=False, cache_dir=CACHE_DIR):
+    """
+    Return the embeddings of the corpus as a float32 numpy array, loading them from the cache if available.
+    Otherwise compute them with the embedder, and save them in the cache.
+    """
+    hashes = [text_hash(claim) for claim in corpus]
+    key = cache_key(model_name, normalize, hashes)
+    embeddings_path = os.path.join(cache_dir, key + ".npy")
+    index_path = os.path.join(cache_dir, key + ".json")
+
+    embeddings = load_entry(embeddings_path, index_path, hashes)
+    if embeddings is not None:
+        return embeddings
+
+    embeddings = encode_delta(embedder, corpus, hashes, model_name, normalize, cache_dir)
+    save_entry(embeddings_path, index_path, embeddings, {"model": model_name, "normalize": normalize, "claims": hashes})
+    evict(cache_dir)
+    return embeddings
+
+
+def encode_delta(embedder, corpus, hashes, model_name, normalize, cache_dir=CACHE_DIR):
+    """
+    Return the embeddings of the corpus, copying the rows of the claims found in the other cache entries of the same model and encoding only the remaining ones.
+    """
+    cached = find_cached_claims(cache_dir, model_name, normalize, set(hashes))
+    missing = [i for i, h in enumerate(hashes) if h not in cached]
+
+    dimension = embedder.get_sentence_embedding_dimension()
+    embeddings = np.empty((len(corpus), dimension), dtype=np.float32)
+    if len(missing) > 0:
+        new_embeddings = embedder.encode([corpus[i] for i in missing], convert_to_numpy=True, normalize_embeddings=normalize)
+        embeddings[missing] = np.asarray(new_embeddings, dtype=np.float32)
+
+    # Copy the cached rows, grouped by entry so that each file is opened once
+    rows_by_entry = {}
+    for i, h in enumerate(hashes):
+        if h in cached:
+            embeddings_path, row = cached[h]
+            rows_by_entry.setdefault(embeddings_path, ([], []))
+            rows_by_entry[embeddings_path][0].append(i)
+            rows_by_entry[embeddings_path][1].append(row)
+    for embeddings_path, (rows, cached_rows) in rows_by_entry.items():
+        try:
+            embeddings[rows] = np.load(embeddings_path, mmap_mode="r")[cached_rows]
+        except (OSError, ValueError, IndexError):
+            # Entry evicted, or rewritten, since its index was read: its claims are encoded again
+            embeddings[rows] = np.asarray(embedder.encode([corpus[i] for i in rows], convert_to_numpy=True, normalize_embeddings=normalize), dtype=np.float32)
+    return embeddings
+
+
+def find_cached_claims(cache_dir, model_name, normalize, hashes):
+    """
+    Return a dictionary mapping each of the given claim hashes already in the cache (for the same model and normalization) to its embeddings file and row.
+    """
+    cached = {}
+    if not os.path.isdir(cache_dir):
+        return cached
+    for file in os.listdir(cache_dir):
+        if not file.endswith(".json") or ".tmp" in file:
+            continue
+        embeddings_path = os.path.join(cache_dir, os.path.splitext(file)[0] + ".npy")
+        try:
+            with open(os.path.join(cache_dir, file), "r") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if index.get("model") != model_name or index.get("normalize") != normalize or not os.path.isfile(embeddings_path):
+            continue
+        for row, h in enumerate(index["claims"]):
+            if h in hashes and h not in cached:
+                cached[h] = (embeddings_path, row)
+        if len(cached) == len(hashes):
+            break
+    return cached
+
+
+def load_entry(embeddings_path, index_path, hashes):
+    """
+    Return the cached embeddings (memory-mapped), or None if the entry is missing or does not match the claims.
+    """
+    if not os.path.isfile(embeddings_path) or not os.path.isfile(index_path):
+        return None
+    try:
+        with open(index_path, "r") as f:
+            index = json.load(f)
+        embeddings = np.load(embeddings_path, mmap_mode="r")
+    except (OSError, ValueError):
+        return None
+    if index.get("claims") != hashes or embeddings.shape[0] != len(hashes):
+        return None
+    # Mark the entry as recently used
+    now = time.time()
+    os.utime(embeddings_path, (now, now))
+    os.utime(index_path, (now, now))
+    return embeddings
+
+
+def save_entry(embeddings_path, index_path, embeddings, index):
+    """
+    Save the embeddings and their index. Files are written to a temporary path and then renamed, so a cache entry is never left half-written.
+    """
+    os.makedirs(os.path.dirname(embeddings_path), exist_ok=True)
+    tmp_embeddings_path = embeddings_path + ".tmp.npy"
+    tmp_index_path = index_path + ".tmp"
+    np.save(tmp_embeddings_path, embeddings)
+    with open(tmp_index_path, "w") as f:
+        json.dump(index, f)
+    os.replace(tmp_embeddings_path, embeddings_path)
+    os.replace(tmp_index_path, index_path)
+
+
+def evict(cache_dir=CACHE_DIR, max_size_mb=MAX_CACHE_SIZE_MB, target_size_mb=None):
+    """
+    Delete the least recently used entries until the cache directory is smaller than max_size_mb
+    (or than target_size_mb once it is larger than max_size_mb, so that the entries are not deleted one at a time).
+    Return the paths of the embeddings files of the deleted entries.
+    """
+    if not os.path.isdir(cache_dir):
+        return []
+    entries = {}
+    for file in os.listdir(cache_dir):
+        if not (file.endswith(".npy") or file.endswith(".json")) or ".tmp" in file:
+            continue
+        path = os.path.join(cache_dir, file)
+        key = os.path.splitext(file)[0]
+        size, last_used = entries.get(key, (0, 0))
+        try:
+            entries[key] = (size + os.path.getsize(path), max(last_used, os.path.getmtime(path)))
+        except OSError: # deleted by another process
+            continue
+
+    total_size = sum(size for size, _ in entries.values())
+    if total_size <= max_size_mb * 1024 * 1024:
+        return []
+    limit = (target_size_mb if target_size_mb is not None else max_size_mb) * 1024 * 1024
+    removed = []
+    for key, (size, _) in sorted(entries.items(), key=lambda entry: entry[1][1]):
+        if total_size <= limit:
+            break
+        for extension in [".npy", ".json"]:
+            try:
+                os.remove(os.path.join(cache_dir, key + extension))
+            except FileNotFoundError: # already evicted by another process sharing the cache
+                pass
+        removed.append(os.path.join(cache_dir, key + ".npy"))
+        total_size -= size
+    return removed
@@ -0,0 +1,80 @@
+#!/usr/bin/python3
+
+# Usage: python3 -m factcheck.evidence <examples_file> <test_set_file> <column> [--weights WEIGHT [WEIGHT ...]]
+
+"""
+Evidence-aware retrieval: the control sets have up to five evidence snippets per example (evidence_1 ... evidence_5),
+which are embedded once (and cached, like the claims, see embedding_cache.py) and searched together with the claims (see search_index.EvidenceIndex).
+It is enabled with a positive evidence weight in the Retriever (see retrieval.EVIDENCE_WEIGHT), so it runs in the same sweep engine as the claim-only retrieval.
+When run as a module (python3 -m factcheck.evidence), it compares the claim-only retrieval (weight 0) with the evidence-aware one on a test set column:
+retrieval throughput, and accuracy and macro-F1 of the best threshold/N of the sweep and of the default arguments.
+"""
+
+import time, argparse
+
+EVIDENCE_COLUMNS = ["evidence_1", "evidence_2", "evidence_3", "evidence_4", "evidence_5"]
+
+
+def evidence_passages(dataset):
+    """
+    Return the non-empty evidence snippets of a control set (DataFrame with the EVIDENCE_COLUMNS), and the row of the example of each of them.
+    The snippets are sorted by example.
+    """
+    passages = []
+    owners = []
+    for row, snippets in enumerate(zip(*[dataset[column].tolist() for column in EVIDENCE_COLUMNS])):
+        for snippet in snippets:
+            if isinstance(snippet, str) and snippet.strip() != "":
+                passages.append(snippet)
+                owners.append(row)
+    return passages, owners
+
+
+def benchmark(examples_file, test_set_file, column, weights, default_threshold=0.5, default_n=3):
+    """
+    Run the sweep of the test set column with each evidence weight, sharing one model.
+    Return one dictionary per weight: load and retrieval time, queries per second, and the metrics of the best and of the default arguments.
+    """
+    from sentence_transformers import SentenceTransformer
+    from .retrieval import Retriever, MODEL_NAME, preprocess_query
+    from .inputs import InputBuilder
+    from .labeling import Labeler
+    from .metrics import Evaluator
+    from .sweep import THRESHOLDS, NS
+
+    queries = [preprocess_query(query) for query in InputBuilder(test_set_file).queries(column)]
+    evaluator = Evaluator(test_set_file, column)
+    embedder = SentenceTransformer(MODEL_NAME)
+    rows = []
+    for weight in weights:
+        start = time.perf_counter()
+        retriever = Retriever(embedder=embedder, evidence_weight=weight).load_examples(examples_file)
+        load_time = time.perf_counter() - start
+        start = time.perf_counter()
+        top_scores, top_indices = retriever.retrieve(queries, max(NS))
+        retrieval_time = time.perf_counter() - start
+
+        labeler = Labeler.from_retriever(retriever)
+        configs = [(threshold, n) for threshold in THRESHOLDS for n in NS]
+        results = evaluator.evaluate_labels([labeler.label_all(top_scores, top_indices, n, threshold) for threshold, n in configs])
+        best = max(range(len(configs)), key=lambda i: (results[i]["accuracy"], results[i]["macro_f1"]))
+        default = configs.index((default_threshold, default_n))
+        rows.append({"weight": weight, "examples": len(retriever.corpus), "evidence": len(retriever.evidence), "load_s": load_time, "retrieval_s": retrieval_time,
+                     "queries_per_s": len(queries) / retrieval_time, "best": configs[best], "best_accuracy": results[best]["accuracy"],
+                     "best_macro_f1": results[best]["macro_f1"], "default_accuracy": results[default]["accuracy"], "default_macro_f1": results[default]["macro_f1"]})
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("examples_file", help="Control set")
+    parser.add_argument("test_set_file", help="Test set")
+    parser.add_argument("column", help="Input column of the test set (claim, news-like or social-like)")
+    parser.add_argument("--weights", help="Evidence weights to compare (default: 0 0.25 0.5 0.75)", type=float, nargs="+", default=[0.0, 0.25, 0.5, 0.75])
+    args = parser.parse_args()
+
+    rows = benchmark(args.examples_file, args.test_set_file, args.column, args.weights)
+    print("weight\texamples\tsnippets\tload (s)\tretrieval (s)\tqueries/s\tbest (threshold, N)\tbest accuracy\tbest macro-F1\taccuracy (0.5, 3)\tmacro-F1 (0.5, 3)")
+    for row in rows:
+        print("{}\t{}\t{}\t{:.2f}\t{:.3f}\t{:.1f}\t{}\t{}\t{}\t{}\t{}".format(row["weight"], row["examples"], row["evidence"], row["load_s"], row["retrieval_s"], row["queries_per_s"],
+              row["best"], row["best_accuracy"], row["best_macro_f1"], row["default_accuracy"], row["default_macro_f1"]))
@@ -0,0 +1,84 @@
+"""
+Creation of the model input from a test set: the claims of one column (claim, news-like or social-like), one per line.
+All the lines where the news-like column is empty are removed, since this means the claim is ambiguous.
+The queries are preprocessed (see preprocess_query()) here, so that they can be loaded without the model.
+"""
+
+import os
+from . import datasets
+from .metrics import trues, falses, nones
+
+
+def preprocess_query(query):
+    """
+    Remove tabs and newlines from the query.
+    """
+    query = query.replace("\t", " ") # Replace tabs with spaces
+    query = query.replace("\n", "") # Remove newlines
+    return query
+
+
+def load_queries(input_type, input):
+    """
+    Return the list of preprocessed queries, either from a single string or from a file (one claim per line, empty lines are skipped).
+    """
+    if input_type == "string":
+        queries = [preprocess_query(input)]
+    elif input_type == "file":
+        with open(input, 'r') as f:
+            queries = f.readlines()
+            queries = [query for query in queries if query.strip() != '']
+            queries = [preprocess_query(query) for query in queries]
+    return queries
+
+
+class InputBuilder:
+    """
+    Test set loaded once, from which the input of any column is built.
+    Only the label and news-like columns are loaded at first, and each input column the first time it is requested (see datasets.read_table()).
+    """
+
+    def __init__(self, test_set_path):
+        self.test_set_path = test_set_path
+        self.columns = datasets.table_columns(test_set_path)
+        self.dataset = datasets.read_table(test_set_path, ["label", "news-like"])
+        # We want to keep only the lines where the news-like column is not empty, since this means the claim has no ambiguity
+        self.dataset = self.dataset[self.dataset["news-like"].notnull()]
+
+    def label_distribution(self):
+        """
+        Return the number of true, false and none labels. Raise ValueError if some labels are not recognized.
+        """
+        labels = self.dataset["label"].str.lower()
+        trues_n = int(labels.isin(trues).sum())
+        falses_n = int(labels.isin(falses).sum())
+        nones_n = int(labels.isin(nones).sum())
+        total_n = trues_n + falses_n + nones_n
+        if total_n != len(self.dataset):
+            raise ValueError("the number of lines (" + str(len(self.dataset)) + ") does not match the number of labels (" + str(total_n) + ")")
+        return trues_n, falses_n, nones_n
+
+    def queries(self, column):
+        """
+        Return the claims of the column.
+        """
+        # Check that the column exists
+        if column not in self.columns:
+            raise ValueError("the column " + column + " does not exist in the dataset")
+
+        if column != "claim" and column != "news-like" and column != "social-like":
+            print("\033[93m" + "Warning: the column " + column + " is not supposed to be used as input" + "\033[0m")
+        if column not in self.dataset.columns:
+            # The values are aligned with the kept lines by their index
+            self.dataset = self.dataset.assign(**{column: datasets.read_table(self.test_set_path, [column])[column]})
+        return self.dataset[column].tolist()
+
+    def write(self, column, output_path):
+        """
+        Save output_path/input.txt with the claims of the column, and return its path.
+        NOTE: the input file is named INPUT because it is the input of the model
+        """
+        self.queries(column)
+        input_path = os.path.join(output_path, "input.txt")
+        self.dataset[[column]].to_csv(input_path, index=False, header=False, sep="\t")
+        return input_path
@@ -0,0 +1,213 @@
+"""
+Labelling of the queries with the majority label of their nearest examples (see output_label()), and writing of the inference files.
+The rules of the vote can be changed with a voting policy (see POLICIES), e.g. to relabel a saved neighbour table (see neighbours.py and relabel.py).
+Labeler.label_all() labels all the queries at once with the vectorized version of output_label() (see voting.py),
+optionally with score-weighted votes and abstention below a vote margin.
+"""
+
+import logging
+import numpy as np
+from . import voting
+
+# SETTINGS
+INFERENCE_FORMAT = "compact" # "compact": the nearest examples are written as their row in the control set and their score; "full": as the list of [claim, label, score]
+
+# Voting policies: keyword arguments of output_label()
+POLICIES = {
+    "default": {}, # the original rules
+    "half-true": {"half_true_as_false": False}, # HALF-TRUE is a label of its own
+    "abstain-on-tie": {"ties": "abstain"}, # a tie gives no label
+    "abstain-below-threshold": {"below_threshold_as_none": True}, # the examples under the threshold count as none labels, so no label is given when they are the majority
+}
+DEFAULT_POLICY = "default"
+DEFAULT_DECISION = "majority" # see voting.DECISIONS
+
+logger = logging.getLogger(__name__)
+
+
+def output_label(labels, half_true_as_false=True, ties="logic", below_threshold_as_none=False):
+    """
+    Return the most frequent label in the list of labels.
+    If there is a tie, return the label according to a logic criteria (ties="logic"), or None (ties="abstain"):
+    - TRUE==FALSE -> HALF-TRUE
+    - TRUE==HALF-TRUE -> TRUE
+    - FALSE==HALF-TRUE -> FALSE
+    If half_true_as_false, HALF-TRUE labels are considered as FALSE.
+    If all labels are None, return None.
+    If below_threshold_as_none, the None labels (examples under the threshold) count as NONE labels.
+    """
+    # Count occurrences of each label
+    labels=[label.lower() if label!=None else label for label in labels]
+    trues = labels.count('true')
+    falses = labels.count('false')
+    half_trues = labels.count('half-true')
+    nones = labels.count('none')
+    logger.debug("%d %d %d %d", trues, falses, half_trues, nones)
+    if trues+falses+half_trues+nones+labels.count(None)!=len(labels):
+        logger.warning("\033[93mWARNING: Some labels not recognized:\033[0m %s", set(labels))
+    if below_threshold_as_none:
+        nones += labels.count(None)
+    if half_true_as_false:
+        falses += half_trues
+        half_trues = 0
+
+    # If all labels are None, return None
+    if trues == 0 and falses == 0 and half_trues == 0:
+        return None
+    
+    # if the number of None labels is greater than the number of other labels, return None
+    if nones > trues+falses+half_trues:
+        return None
+    
+    # Label the query with the most frequent label
+    if trues > falses and trues > half_trues:
+        output_label = "true"
+    elif falses > trues and falses > half_trues:
+        output_label = "false"
+    elif half_trues > trues and half_trues > falses:
+        output_label = "half-true"
+    elif ties == "abstain":
+        output_label = None
+    elif trues == falses and trues > half_trues:
+        output_label = "half-true"
+    elif trues == half_trues and trues > falses:
+        output_label = "true"
+    elif falses == half_trues and falses > trues:
+        output_label = "false"
+    else:
+        output_label = None
+    
+    return output_label
+
+
+def label_query(scores, indices, corpus_labels, n, threshold, policy=DEFAULT_POLICY):
+    """
+    Label a query from its retrieved examples, keeping only the first n ones with a score above the threshold.
+    The examples under the threshold count as None labels, to keep the same number of labels.
+    """
+    labels = [corpus_labels[idx] if score > threshold else None for score, idx in zip(scores[:n], indices[:n])]
+    # Label the query with the most frequent label of the retrieved sentences
+    return output_label(labels, **POLICIES[policy])
+
+
+def similar_claims(scores, indices, corpus, corpus_labels, n, threshold):
+    """
+    Return the list of [claim, label, score] of the first n retrieved examples, where the examples under the threshold are [None, None, NaN].
+    """
+    similar_claims = []
+    for score, idx in zip(scores[:n], indices[:n]):
+        if score > threshold:
+            similar_claims.append([corpus[idx], corpus_labels[idx], float(score)])
+        else:
+            # Append [None, NaN] element to keep the same number of elements in the list
+            similar_claims.append([None, None, float('nan')])
+    return similar_claims
+
+
+class Labeler:
+    """
+    Label the queries of a control set from their retrieved examples (see Retriever.retrieve()), and write the inference files.
+    If the near-duplicate examples of the control set were collapsed (see dedup.py), corpus_counts are the label counts of the cluster of each example,
+    and each retrieved example votes with the labels of its members.
+    """
+
+    def __init__(self, corpus, corpus_labels, inference_format=INFERENCE_FORMAT, policy=DEFAULT_POLICY, decision=DEFAULT_DECISION, min_margin=0.0, corpus_counts=None):
+        if policy not in POLICIES:
+            raise ValueError("voting policy " + policy + " not recognized (expected one of " + ", ".join(POLICIES) + ")")
+        if decision not in voting.DECISIONS:
+            raise ValueError("decision " + decision + " not recognized (expected one of " + ", ".join(voting.DECISIONS) + ")")
+        self.corpus = corpus
+        self.corpus_labels = corpus_labels
+        self.corpus_codes = voting.encode_labels(corpus_labels)
+        self.corpus_counts = corpus_counts
+        self.inference_format = inference_format
+        self.policy = policy
+        self.decision = decision
+        self.min_margin = min_margin
+        if (self.corpus_codes == voting.UNKNOWN).any():
+            unknown = set(label for label, code in zip(corpus_labels, self.corpus_codes) if code == voting.UNKNOWN)
+            logger.warning("\033[93mWARNING: Some labels not recognized:\033[0m %s", unknown)
+
+    @classmethod
+    def from_retriever(cls, retriever, inference_format=INFERENCE_FORMAT, policy=DEFAULT_POLICY, decision=DEFAULT_DECISION, min_margin=0.0):
+        return cls(retriever.corpus, retriever.corpus_labels, inference_format, policy, decision, min_margin, retriever.corpus_counts)
+
+    def label(self, scores, indices, n, threshold):
+        """
+        Return the label of a query (see label_all()).
+        """
+        return self.label_all([scores], [indices], n, threshold)[0]
+
+    def decide(self, top_scores, top_indices, n, threshold):
+        """
+        Return the output codes (see voting.py) and the vote margins of every query, computed at once from their first n retrieved examples.
+        top_scores and top_indices are the lists or matrices (queries x top_k) returned by Retriever.retrieve().
+        With the "weighted" decision, each example votes with its score. The predictions whose margin is below min_margin are NONE (abstention).
+        """
+        if self.corpus_counts is not None:
+            codes, counts = voting.cluster_codes(self.corpus_counts, top_scores, top_indices, n, threshold)
+            return self.vote(codes, np.repeat(np.asarray(top_scores, dtype=np.float64)[:, :n], voting.CLUSTER_CODES, axis=1), counts)
+        codes = voting.neighbour_codes(self.corpus_codes, top_scores, top_indices, n, threshold)
+        if logger.isEnabledFor(logging.DEBUG):
+            for counts in zip(*voting.count_labels(codes)[:4]):
+                logger.debug("%d %d %d %d", *counts)
+        return self.vote(codes, np.asarray(top_scores, dtype=np.float64)[:, :n])
+
+    def vote(self, codes, scores, counts=None):
+        """
+        Return the output codes and the vote margins of a matrix of neighbour label codes (see voting.neighbour_codes()) and of their scores,
+        with the voting policy, decision and minimum margin of the labeler. counts are the member counts of the codes of clusters (see voting.cluster_codes()).
+        """
+        # The padding of the queries with fewer than top_k candidates (score -inf, e.g. IVF or live index) has no weight
+        weights = np.where(np.isfinite(scores), scores, 0) if self.decision == "weighted" else None
+        if counts is not None:
+            weights = counts if weights is None else np.where(counts > 0, weights * counts, 0)
+        predicted, margins = voting.vote(codes, weights=weights, return_margins=True, **POLICIES[self.policy])
+        predicted[margins < self.min_margin] = voting.NONE
+        return predicted, margins
+
+    def label_all(self, top_scores, top_indices, n, threshold):
+        """
+        Return the list of labels of every query (see decide()). With the default decision, they are the labels of output_label().
+        """
+        if len(top_scores) == 0:
+            return []
+        return voting.decode(self.decide(top_scores, top_indices, n, threshold)[0])
+
+    def confidences(self, top_scores, top_indices, n, threshold, calibration=None):
+        """
+        Return the confidence of the label of every query: its vote margin, or the probability that it is correct if a Calibration is given (see calibration.py).
+        """
+        margins = self.decide(top_scores, top_indices, n, threshold)[1]
+        return calibration.predict(margins) if calibration is not None else margins
+
+    def similar_claims(self, scores, indices, n, threshold):
+        """
+        Return the list of [claim, label, score] of the nearest examples of a query (see similar_claims()).
+        """
+        return similar_claims(scores, indices, self.corpus, self.corpus_labels, n, threshold)
+
+    def inference_header(self):
+        if self.inference_format == "full":
+            return "output_label\tquery\tmost_similar_examples\n"
+        return "output_label\tquery\texample_ids\texample_scores\n"
+
+    def inference_row(self, query, label, scores, indices, n, threshold):
+        """
+        Return the line of the inference file of a query: the output label, the query and its nearest examples.
+        In the compact format, these are the comma-separated rows in the control set and scores of the first n retrieved examples
+        (only those with a score above the threshold are used for the label).
+        """
+        if self.inference_format == "full":
+            return "{}\t{}\t{}\n".format(label, query, self.similar_claims(scores, indices, n, threshold))
+        return "{}\t{}\t{}\t{}\n".format(label, query, ",".join(str(idx) for idx in indices[:n]), ",".join("{:.6f}".format(score) for score in scores[:n]))
+
+    def write_inference(self, output_path, queries, labels, top_scores, top_indices, n, threshold):
+        """
+        Write the inference file: one line per query (see inference_row()).
+        """
+        with open(output_path, 'w') as f:
+            f.write(self.inference_header())
+            for query, label, scores, indices in zip(queries, labels, top_scores, top_indices):
+                f.write(self.inference_row(query, label, scores, indices, n, threshold))
+            f.close()
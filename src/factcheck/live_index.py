@@ -0,0 +1,325 @@
+#!/usr/bin/python3
+
+# Usage: python3 -m factcheck.live_index create <index_dir> <examples_file>
+#        python3 -m factcheck.live_index append <index_dir> <tsv_file>
+#        python3 -m factcheck.live_index delete <index_dir> <tsv_file>
+#        python3 -m factcheck.live_index compact <index_dir>
+#        python3 -m factcheck.live_index info <index_dir>
+
+"""
+Control set index that can be updated while it is in use, without encoding again the claims it already contains.
+It is a directory with the normalized embeddings of the examples in segments (.npy, memory-mapped, and .jsonl with the id, claim and label of each row),
+and a log of the operations applied to them, in order:
+- segment: new examples appended (only the new claims are encoded)
+- label: examples relabelled, without encoding them again
+- delete: examples retracted, they are tombstoned and never retrieved again
+An example is identified by the hash of its claim (see embedding_cache.text_hash()), so appending a claim already in the index relabels it.
+The processes using the index (e.g. serve.py) read the new lines of the log with refresh(), and see the updates within seconds.
+Compaction rewrites the live examples in a single segment, without the tombstones, as a new generation of the index: the processes using it reload it.
+Only one process should update the index at a time.
+"""
+
+import os, sys, copy, json, shutil, time, argparse
+import numpy as np
+from . import datasets, embedding_cache, voting
+from .search_index import normalize, top_k_rows
+from .shards import merge_top_k
+
+META_FILE = "meta.json"
+LOG_FILE = "log.jsonl"
+
+
+def write_json(path, data):
+    """
+    Write a JSON file to a temporary path and then rename it, so it is never left half-written.
+    """
+    with open(path + ".tmp", "w") as f:
+        json.dump(data, f)
+    os.replace(path + ".tmp", path)
+
+
+class LiveIndex:
+    """
+    Updatable exact index of a control set, with its claims and labels (see the module docstring).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.load()
+
+    @classmethod
+    def create(cls, path, embeddings, claims, labels, model_name):
+        """
+        Create the index of a control set, from its embeddings (e.g. loaded from the embedding cache by a Retriever), claims and labels.
+        """
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.makedirs(os.path.join(path, "0"))
+        write_json(os.path.join(path, META_FILE), {"model": model_name, "generation": 0, "dimension": int(np.asarray(normalize(embeddings[:1])).shape[1])})
+        open(os.path.join(path, "0", LOG_FILE), "w").close()
+        index = cls(path)
+        index.write_segment(normalize(embeddings), [embedding_cache.text_hash(claim) for claim in claims], claims, labels)
+        index.refresh()
+        return index
+
+    def load(self):
+        """
+        Read the current generation of the index from the beginning of its log.
+        """
+        with open(os.path.join(self.path, META_FILE), "r") as f:
+            self.meta = json.load(f)
+        self.generation_path = os.path.join(self.path, str(self.meta["generation"]))
+        self.log_offset = 0
+        self.segments = [] # (first row, memory-mapped embeddings)
+        self.ids = []
+        self.claims = []
+        self.labels = []
+        self.rows = {} # id -> row
+        self.codes = np.zeros(0, dtype=np.int8) # label code of every row (see voting.encode_labels()), with spare capacity for the appended rows
+        self.alive = np.zeros(0, dtype=bool)
+        self.size = 0
+        self.refresh()
+
+    @property
+    def model_name(self):
+        return self.meta["model"]
+
+    def __len__(self):
+        return self.size
+
+    def live_count(self):
+        return int(self.alive[:self.size].sum())
+
+    def refresh(self):
+        """
+        Apply the operations appended to the log since the last refresh (or reload the index if it was compacted). Return True if anything changed.
+        """
+        with open(os.path.join(self.path, META_FILE), "r") as f:
+            generation = json.load(f)["generation"]
+        if generation != self.meta["generation"]:
+            self.load()
+            return True
+        try:
+            with open(os.path.join(self.generation_path, LOG_FILE), "rb") as f:
+                f.seek(self.log_offset)
+                data = f.read()
+        except FileNotFoundError: # compacted in the meantime
+            self.load()
+            return True
+        end = data.rfind(b"\n") + 1 # a line being written is read on the next refresh
+        for line in data[:end].decode("utf-8").splitlines():
+            self.apply(json.loads(line))
+        self.log_offset += end
+        return end > 0
+
+    def apply(self, operation):
+        if operation["op"] == "segment":
+            name = os.path.join(self.generation_path, operation["name"])
+            embeddings = np.load(name + ".npy", mmap_mode="r")
+            with open(name + ".jsonl", "r") as f:
+                rows = [json.loads(line) for line in f]
+            self.segments.append((self.size, embeddings))
+            self.reserve(self.size + len(rows))
+            codes = voting.encode_labels([row["label"] for row in rows])
+            for i, row in enumerate(rows):
+                if row["id"] in self.rows: # an id has a single live row, the previous one is replaced
+                    self.alive[self.rows[row["id"]]] = False
+                self.rows[row["id"]] = self.size + i
+                self.ids.append(row["id"])
+                self.claims.append(row["claim"])
+                self.labels.append(row["label"])
+            self.codes[self.size:self.size + len(rows)] = codes
+            self.alive[self.size:self.size + len(rows)] = True
+            self.size += len(rows)
+        elif operation["op"] == "label":
+            for id, label in zip(operation["ids"], operation["labels"]):
+                row = self.rows.get(id)
+                if row is None: # deleted in the meantime
+                    continue
+                self.labels[row] = label
+                self.codes[row] = voting.encode_labels([label])[0]
+        elif operation["op"] == "delete":
+            for id in operation["ids"]:
+                row = self.rows.pop(id, None)
+                if row is not None: # already deleted, or never appended
+                    self.alive[row] = False
+
+    def reserve(self, size):
+        """
+        Grow the label code and tombstone arrays to at least size rows (doubling their capacity).
+        """
+        if size <= self.codes.shape[0]:
+            return
+        capacity = max(size, 2 * self.codes.shape[0])
+        codes = np.full(capacity, voting.UNKNOWN, dtype=np.int8)
+        alive = np.zeros(capacity, dtype=bool)
+        codes[:self.size] = self.codes[:self.size]
+        alive[:self.size] = self.alive[:self.size]
+        self.codes, self.alive = codes, alive
+
+    def search(self, query_embeddings, top_k):
+        """
+        Return the scores and the rows of the top_k live examples of each query, as numpy arrays sorted by decreasing similarity.
+        If there are fewer than top_k live examples, the missing entries have score -inf and index -1 (as in search_index.IVFIndex).
+        """
+        queries = normalize(query_embeddings)
+        results = []
+        for start, embeddings in self.segments:
+            if embeddings.shape[0] == 0:
+                continue
+            scores = queries @ np.asarray(embeddings).T
+            scores[:, ~self.alive[start:start + embeddings.shape[0]]] = -np.inf
+            chunk_scores, chunk_indices = top_k_rows(scores, min(top_k, embeddings.shape[0]))
+            results.append((chunk_scores, chunk_indices + start))
+        if len(results) == 0:
+            return np.zeros((queries.shape[0], 0), dtype=np.float32), np.zeros((queries.shape[0], 0), dtype=np.int64)
+        top_scores, top_indices = merge_top_k(results, top_k)
+        return top_scores, np.where(np.isfinite(top_scores), top_indices, -1) # the tombstoned rows are never returned
+
+    def labeler(self, template):
+        """
+        Return a copy of the labeler (see labeling.Labeler) using the current claims and labels of the index.
+        It is a snapshot: the labels and their codes are copied (the updates relabel the examples in place, see apply()),
+        and the appended claims are after its rows, so a labeler given to a batch is not modified by the later updates.
+        """
+        labeler = copy.copy(template)
+        labeler.corpus = self.claims
+        labeler.corpus_labels = list(self.labels)
+        labeler.corpus_codes = self.codes[:self.size].copy()
+        return labeler
+
+    # Updates (only one process should update the index at a time)
+
+    def log(self, operation):
+        with open(os.path.join(self.generation_path, LOG_FILE), "a") as f:
+            f.write(json.dumps(operation) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def write_segment(self, embeddings, ids, claims, labels):
+        """
+        Write new examples in a segment of the current generation, and log it.
+        A repeated id (the same claim more than once) is written once, with its last label, so that it can still be relabelled and deleted.
+        """
+        first = {}
+        for i, id in enumerate(ids):
+            first.setdefault(id, i)
+        if len(first) < len(ids):
+            last_labels = dict(zip(ids, labels))
+            rows = list(first.values())
+            embeddings = np.asarray(embeddings)[rows]
+            ids, claims, labels = [ids[i] for i in rows], [claims[i] for i in rows], [last_labels[ids[i]] for i in rows]
+        self.write_blocks([embeddings], ids, claims, labels)
+
+    def write_blocks(self, blocks, ids, claims, labels):
+        """
+        Write a segment whose embeddings are the concatenation of the blocks (e.g. the live rows of each segment, see compact()), and log it.
+        The blocks are written one at a time to the memory-mapped file of the segment, so they are never all in memory.
+        """
+        name = "segment-" + str(int(time.time() * 1000)) + "-" + str(len(self.segments))
+        prefix = os.path.join(self.generation_path, name)
+        with open(prefix + ".jsonl.tmp", "w") as f:
+            for id, claim, label in zip(ids, claims, labels):
+                f.write(json.dumps({"id": id, "claim": claim, "label": label}) + "\n")
+        embeddings = np.lib.format.open_memmap(prefix + ".tmp.npy", mode="w+", dtype=np.float32, shape=(len(ids), self.meta["dimension"]))
+        position = 0
+        for block in blocks:
+            embeddings[position:position + len(block)] = np.asarray(block, dtype=np.float32)
+            position += len(block)
+        embeddings.flush()
+        del embeddings
+        os.replace(prefix + ".jsonl.tmp", prefix + ".jsonl")
+        os.replace(prefix + ".tmp.npy", prefix + ".npy")
+        self.log({"op": "segment", "name": name})
+
+    def append(self, embedder, claims, labels, normalize_embeddings=False):
+        """
+        Append labelled claims: the new ones are encoded and written in a new segment, and the ones already in the index are relabelled.
+        Return the number of appended and relabelled examples.
+        """
+        self.refresh()
+        new = {}
+        relabelled = {}
+        for claim, label in zip(claims, labels):
+            id = embedding_cache.text_hash(claim)
+            if id in self.rows:
+                if self.labels[self.rows[id]] != label:
+                    relabelled[id] = label
+            else:
+                new[id] = (claim, label)
+        if len(new) > 0:
+            embeddings = embedder.encode([claim for claim, _ in new.values()], convert_to_numpy=True, normalize_embeddings=normalize_embeddings)
+            self.write_segment(normalize(embeddings), list(new), [claim for claim, _ in new.values()], [label for _, label in new.values()])
+        if len(relabelled) > 0:
+            self.log({"op": "label", "ids": list(relabelled), "labels": list(relabelled.values())})
+        self.refresh()
+        return len(new), len(relabelled)
+
+    def delete(self, claims):
+        """
+        Tombstone the examples of the given claims. Return the number of deleted examples.
+        """
+        self.refresh()
+        ids = [id for id in dict.fromkeys(embedding_cache.text_hash(claim) for claim in claims) if id in self.rows]
+        if len(ids) > 0:
+            self.log({"op": "delete", "ids": ids})
+        self.refresh()
+        return len(ids)
+
+    def compact(self):
+        """
+        Write the live examples in a single segment of a new generation, and switch the index to it. The previous generation is deleted.
+        The live rows are copied segment by segment, so the embeddings of the index are never all in memory.
+        """
+        self.refresh()
+        live = np.flatnonzero(self.alive[:self.size])
+        segments = self.segments
+        blocks = (embeddings[np.flatnonzero(self.alive[start:start + embeddings.shape[0]])] for start, embeddings in segments)
+        previous_path = self.generation_path
+        generation = self.meta["generation"] + 1
+        self.generation_path = os.path.join(self.path, str(generation))
+        shutil.rmtree(self.generation_path, ignore_errors=True)
+        os.makedirs(self.generation_path)
+        open(os.path.join(self.generation_path, LOG_FILE), "w").close()
+        self.segments = []
+        self.write_blocks(blocks, [self.ids[row] for row in live], [self.claims[row] for row in live], [self.labels[row] for row in live])
+        write_json(os.path.join(self.path, META_FILE), dict(self.meta, generation=generation))
+        shutil.rmtree(previous_path, ignore_errors=True)
+        self.load()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["create", "append", "delete", "compact", "info"])
+    parser.add_argument("index", help="Index directory")
+    parser.add_argument("dataset", help="Control set (create), or dataset with the claims (and labels) to append or delete", nargs="?", default=None)
+    args = parser.parse_args()
+
+    if args.command in ["create", "append", "delete"] and args.dataset is None:
+        print("Error: " + args.command + " requires a dataset")
+        sys.exit(1)
+
+    if args.command == "create":
+        from .retrieval import Retriever
+        retriever = Retriever().load_examples(args.dataset)
+        index = LiveIndex.create(args.index, retriever.corpus_embeddings, retriever.corpus, retriever.corpus_labels, retriever.cache_model_name)
+    elif args.command == "append":
+        from .retrieval import Retriever
+        index = LiveIndex(args.index)
+        retriever = Retriever()
+        if retriever.cache_model_name != index.model_name:
+            print("Error: the index was built with the model " + index.model_name + ", not " + retriever.cache_model_name)
+            sys.exit(1)
+        dataset = datasets.read_table(args.dataset, ["claim", "label"])
+        appended, relabelled = index.append(retriever.embedder, dataset["claim"].tolist(), dataset["label"].tolist(), retriever.normalize)
+        print(str(appended) + " examples appended, " + str(relabelled) + " relabelled")
+    elif args.command == "delete":
+        index = LiveIndex(args.index)
+        print(str(index.delete(datasets.read_table(args.dataset, ["claim"])["claim"].tolist())) + " examples deleted")
+    elif args.command == "compact":
+        index = LiveIndex(args.index)
+        index.compact()
+    else:
+        index = LiveIndex(args.index)
+    print(args.index + ": generation " + str(index.meta["generation"]) + ", " + str(len(index.segments)) + " segments, "
+          + str(index.live_count()) + " live examples (" + str(len(index) - index.live_count()) + " deleted), model " + index.model_name)
@@ -0,0 +1,236 @@
+"""
+Metrics of the inferred labels against a test set, computed with NumPy.
+Labels are encoded as small integers, so that the predictions of many configurations can be stacked in a matrix (one row per configuration) and evaluated at once against a test set loaded only once.
+NOTE: there are three possible labels: true, false, and half-true. We consider half-true as false.
+"""
+
+import os, csv
+import numpy as np
+import pandas as pd
+from . import datasets
+
+HALFTRUE_AS_NONE = False # If True, the half-true examples will be considered as none. Otherwise, they will be considered as false
+
+trues = ["true", "mostly true"]
+if HALFTRUE_AS_NONE:
+    falses = ["false"]
+    nones = ["partly true/misleading", "complicated/hard to categorise", "half-true"]
+else:
+    falses = ["false", "partly true/misleading", "half-true"]
+    nones = ["complicated/hard to categorise"]
+
+# Label codes
+TRUE = 0
+FALSE = 1
+NONE = 2
+UNKNOWN_EXPECTED = 3 # Expected label not recognized (never correct)
+UNKNOWN_PREDICTED = 4 # Predicted label not recognized (never correct)
+
+METRICS = ["accuracy", "macro_f1", "accuracy_true", "accuracy_false", "percentage_none", "percentage_pure_errors", "abstention_rate", "pure_error_rate"]
+
+
+def encode_expected(labels):
+    """
+    Return the codes of the test set labels: trues, falses and nones are mapped to TRUE, FALSE and NONE.
+    """
+    codes = np.full(len(labels), UNKNOWN_EXPECTED, dtype=np.int8)
+    labels = pd.Series(labels, dtype=object).str.lower()
+    codes[labels.isin(trues).to_numpy()] = TRUE
+    codes[labels.isin(falses).to_numpy()] = FALSE
+    codes[labels.isin(nones).to_numpy()] = NONE
+    return codes
+
+
+def encode_predicted(labels):
+    """
+    Return the codes of the inferred labels: half-true is considered as false, and a missing label as none.
+    """
+    codes = np.full(len(labels), UNKNOWN_PREDICTED, dtype=np.int8)
+    labels = pd.Series(labels, dtype=object)
+    missing = labels.isnull().to_numpy()
+    labels = labels.str.lower()
+    codes[(labels == "true").to_numpy()] = TRUE
+    codes[labels.isin(["false", "half-true"]).to_numpy()] = FALSE
+    codes[(labels == "none").to_numpy() | missing] = NONE
+    return codes
+
+
+def filter_column(column):
+    """
+    Return the column whose empty lines are removed from the test set, for the given input column.
+    """
+    if column == "claim":
+        return "news-like" # We want to keep only the lines where the news-like column is not empty, since this means the claim has no ambiguity
+    elif column in ["news-like", "social-like"]:
+        return column
+    raise ValueError("the column must be either 'claim', 'news-like' or 'social-like'")
+
+
+def load_test_set(test_set_file_path, column):
+    """
+    Load the test set, keep the lines used as input for the given column, and return the codes of their labels.
+    """
+    test_set = datasets.read_table(test_set_file_path, ["label", filter_column(column)])
+    test_set = test_set[test_set[filter_column(column)].notnull()]
+    return encode_expected(test_set["label"].tolist())
+
+
+def load_inference(inference_file_path):
+    """
+    Return the codes of the labels of an inference file.
+    """
+    inference = pd.read_csv(inference_file_path, sep="\t", header=0, quoting=csv.QUOTE_NONE, dtype={'output_label': str}, usecols=["output_label"])
+    return encode_predicted(inference["output_label"].tolist())
+
+
+def evaluate(expected, predicted):
+    """
+    Compute the metrics of one prediction vector, or of a stack of prediction vectors (one row per configuration), against the expected codes.
+    Return a list with the dictionary of metrics of each row.
+    """
+    predicted = np.atleast_2d(predicted)
+    if predicted.shape[1] != expected.shape[0]:
+        raise ValueError("the number of lines in the test set (" + str(expected.shape[0]) + ") is different from the number of lines in the inference (" + str(predicted.shape[1]) + ")")
+
+    # Count, for every row at once
+    is_correct = predicted == expected
+    is_true = expected == TRUE
+    is_false = expected == FALSE
+    correct = is_correct.sum(axis=1)
+    correct_true = (is_correct & is_true).sum(axis=1) # TRUE POSITIVE
+    correct_false = (is_correct & is_false).sum(axis=1) # TRUE NEGATIVE
+    incorrect_true = (~is_correct & is_true).sum(axis=1) # FALSE NEGATIVE (the 'none' output is considered as incorrect in any case)
+    incorrect_false = (~is_correct & is_false).sum(axis=1) # FALSE POSITIVE
+    total_none = (predicted == NONE).sum(axis=1)
+    total_true = int(is_true.sum())
+    total_false = int(is_false.sum())
+    queries_n = expected.shape[0]
+
+    results = []
+    for i in range(predicted.shape[0]):
+        results.append(compute_rates(queries_n, total_true, total_false, int(correct[i]), int(correct_true[i]), int(correct_false[i]), int(incorrect_true[i]), int(incorrect_false[i]), int(total_none[i])))
+    return results
+
+
+def compute_rates(queries_n, total_true, total_false, correct, correct_true, correct_false, incorrect_true, incorrect_false, total_none):
+    """
+    Compute the metrics (rounded as in the reports) from the counts of a configuration.
+    """
+    # Compute accuracies
+    accuracy = round(correct / queries_n * 100, 2)
+    accuracy_true = round(correct_true / total_true * 100, 2) if total_true > 0 else 0
+    accuracy_false = round(correct_false / total_false * 100, 2) if total_false > 0 else 0
+
+    # Compute macro-averaged F1 score
+    if correct_true == 0:
+        f1_true = 0
+    else:
+        precision_true = correct_true / (correct_true + incorrect_false)
+        recall_true = correct_true / (correct_true + incorrect_true)
+        f1_true = 2 * ((precision_true * recall_true) / (precision_true + recall_true))
+
+    if correct_false == 0:
+        f1_false = 0
+    else:
+        precision_false = correct_false / (correct_false + incorrect_true)
+        recall_false = correct_false / (correct_false + incorrect_false)
+        f1_false = 2 * ((precision_false * recall_false) / (precision_false + recall_false))
+
+    macro_f1 = round((f1_true + f1_false) / 2, 2)
+
+    # Percentage of NONE, over the number of incorrect predictions
+    wrong_predictions = queries_n - correct
+    if wrong_predictions == 0:
+        percentage_none = 0
+        percentage_pure_errors = 0
+    else:
+        percentage_none = round((total_none / wrong_predictions) * 100, 2)
+        percentage_pure_errors = round(((wrong_predictions - total_none) / wrong_predictions) * 100, 2)
+
+    # Abstention rate (i.e. NONE over the total number of predictions)
+    abstention_rate = round((total_none / queries_n) * 100, 2)
+
+    # Pure error rate (i.e. the number of pure errors over the total number of predictions)
+    pure_error_rate = round(((wrong_predictions - total_none) / queries_n) * 100, 2)
+
+    return {
+        "queries": queries_n,
+        "accuracy": accuracy,
+        "macro_f1": macro_f1,
+        "accuracy_true": accuracy_true,
+        "accuracy_false": accuracy_false,
+        "percentage_none": percentage_none,
+        "percentage_pure_errors": percentage_pure_errors,
+        "abstention_rate": abstention_rate,
+        "pure_error_rate": pure_error_rate,
+    }
+
+
+def evaluate_directory(inference_directory, expected):
+    """
+    Evaluate every inference file of an inference directory (i.e. <inference_directory>/<configuration>/inference.tsv) against the expected codes.
+    Return a dictionary mapping each configuration name to its metrics.
+    """
+    names = sorted(name for name in os.listdir(inference_directory) if os.path.isfile(os.path.join(inference_directory, name, "inference.tsv")))
+    if len(names) == 0:
+        return {}
+    predicted = np.stack([load_inference(os.path.join(inference_directory, name, "inference.tsv")) for name in names])
+    return dict(zip(names, evaluate(expected, predicted)))
+
+
+def format_report(script_name, test_set_file_path, metrics):
+    """
+    Return the text of the evaluation report of a configuration.
+    """
+    return ("EVALUATION RESULTS\n\n"
+            "Script name: " + script_name + "\n"
+            "Test set file: " + os.path.basename(test_set_file_path) + "\n"
+            "Number of queries: " + str(metrics["queries"]) + "\n"
+            "Accuracy: " + str(metrics["accuracy"]) + "%\n"
+            "Macro F1 score: " + str(metrics["macro_f1"]) + "\n"
+            "\n"
+            "Accuracy on TRUE: " + str(metrics["accuracy_true"]) + "%\n"
+            "Accuracy on FALSE: " + str(metrics["accuracy_false"]) + "%\n"
+            "Percentage of NONE (over the number of incorrect predictions): " + str(metrics["percentage_none"]) + "%\n"
+            "Percentage of pure errors (over the number of incorrect predictions): " + str(metrics["percentage_pure_errors"]) + "%\n"
+            "Abstention rate (NONE over the total number of predictions): " + str(metrics["abstention_rate"]) + "%\n"
+            "Pure error rate (the number of pure errors over the total number of predictions): " + str(metrics["pure_error_rate"]) + "%\n"
+            "\n")
+
+
+def write_report(output_file_path, script_name, test_set_file_path, metrics):
+    with open(output_file_path, "w") as f:
+        f.write(format_report(script_name, test_set_file_path, metrics))
+        f.close()
+
+
+class Evaluator:
+    """
+    Test set loaded once, against which any number of inferences are evaluated.
+    """
+
+    def __init__(self, test_set_file_path, column):
+        self.test_set_file_path = test_set_file_path
+        self.column = column
+        self.expected = load_test_set(test_set_file_path, column)
+
+    def evaluate(self, predicted):
+        """
+        Return the metrics of a vector of label codes, or of a stack of them (one row per configuration).
+        """
+        return evaluate(self.expected, predicted)
+
+    def evaluate_labels(self, labels_list):
+        """
+        Return the metrics of each list of inferred labels (e.g. "true", "false", "half-true" or None).
+        """
+        return evaluate(self.expected, np.stack([encode_predicted(labels) for labels in labels_list]))
+
+    def evaluate_file(self, inference_file_path):
+        return evaluate(self.expected, load_inference(inference_file_path))[0]
+
+    def evaluate_directory(self, inference_directory):
+        return evaluate_directory(inference_directory, self.expected)
+
+    def report(self, script_name, metrics):
+        return format_report(script_name, self.test_set_file_path, metrics)
@@ -0,0 +1,71 @@
+"""
+Neighbour table of a retrieval run: for each query, the corpus indices and the scores of its top K examples.
+The table is saved once, after the retrieval, and can then be labelled again for any threshold, N <= K and voting policy (see relabel.py),
+without loading the model nor the control set embeddings.
+A table is a directory with:
+- scores.npy: float32 matrix (queries x K), sorted by decreasing similarity
+- indices.npy: int32 matrix (queries x K), rows of the control set (-1 if fewer than K examples were found)
+- queries.txt: the preprocessed queries, one per line
+- info.json: the model, the control set and its number of examples, the evidence weight, the dedup threshold (see dedup.py), K and the number of queries
+"""
+
+import os, json, shutil
+import numpy as np
+
+NEIGHBOURS_FOLDER = "neighbours" # Name of the table directory in the output folder of a run
+
+
+class NeighbourTable:
+    """
+    Scores and indices of the top K examples of every query.
+    """
+
+    def __init__(self, scores, indices, queries, info):
+        self.scores = scores
+        self.indices = indices
+        self.queries = queries
+        self.info = info
+
+    @classmethod
+    def from_retrieval(cls, retriever, queries, top_scores, top_indices):
+        """
+        Build the table of the output of retriever.retrieve(queries, top_k).
+        """
+        scores = np.asarray(top_scores, dtype=np.float32).reshape(len(queries), -1)
+        indices = np.asarray(top_indices, dtype=np.int32).reshape(len(queries), -1)
+        info = {"model": retriever.model_name, "examples": os.path.abspath(retriever.examples_path), "examples_count": len(retriever.corpus),
+                "evidence_weight": retriever.evidence_weight, "dedup_threshold": retriever.dedup_threshold, "k": int(scores.shape[1]), "queries": len(queries)}
+        return cls(scores, indices, list(queries), info)
+
+    @property
+    def k(self):
+        return self.scores.shape[1]
+
+    def save(self, path):
+        """
+        Save the table in the path directory. It is written to a temporary directory and then renamed, so a table is never left half-written.
+        """
+        tmp_path = path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        np.save(os.path.join(tmp_path, "scores.npy"), self.scores)
+        np.save(os.path.join(tmp_path, "indices.npy"), self.indices)
+        with open(os.path.join(tmp_path, "queries.txt"), "w") as f:
+            f.writelines(query + "\n" for query in self.queries)
+        with open(os.path.join(tmp_path, "info.json"), "w") as f:
+            json.dump(self.info, f, indent=4)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a table saved with save(). The score and index matrices are memory-mapped.
+        """
+        scores = np.load(os.path.join(path, "scores.npy"), mmap_mode="r")
+        indices = np.load(os.path.join(path, "indices.npy"), mmap_mode="r")
+        with open(os.path.join(path, "queries.txt"), "r") as f:
+            queries = [line.rstrip("\n") for line in f]
+        with open(os.path.join(path, "info.json"), "r") as f:
+            info = json.load(f)
+        return cls(scores, indices, queries, info)
@@ -0,0 +1,97 @@
+#!/usr/bin/python3
+
+# Usage: python3 -m factcheck.quantization <examples_file> <test_set_folder> [--columns COLUMN [COLUMN ...]]
+
+"""
+Reduced precision for CPU inference:
+- the index of the control set embeddings can be stored in float16 or int8 (see search_index.QuantizedIndex and retrieval.INDEX_PRECISION)
+- the encoder can run with dynamic int8 quantization of its linear layers (see quantize_encoder() and retrieval.QUANTIZE_ENCODER)
+When run as a module (python3 -m factcheck.quantization), it runs the sweep of every test set of the folder (in_domain.tsv, out_of_domain.tsv)
+with each combination, and reports the agreement of the predictions with the float32 ones, the index memory and the retrieval time.
+"""
+
+import os, time, argparse
+import numpy as np
+
+# Combinations compared by the report: (index precision, quantized encoder)
+VARIANTS = [("float32", False), ("float16", False), ("int8", False), ("float32", True), ("int8", True)]
+TEST_SETS = ["in_domain.tsv", "out_of_domain.tsv"]
+COLUMNS = ["claim", "news-like", "social-like"]
+
+
+def quantize_encoder(embedder):
+    """
+    Return a copy of the sentence transformer whose linear layers are quantized to int8 (weights once, activations on the fly), for CPU inference.
+    """
+    import torch
+    return torch.quantization.quantize_dynamic(embedder, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def index_size(retriever):
+    """
+    Return the memory of the index of a retriever, in bytes.
+    """
+    if hasattr(retriever.index, "nbytes"):
+        return retriever.index.nbytes
+    return retriever.corpus_embeddings.shape[0] * retriever.corpus_embeddings.shape[1] * 4
+
+
+def report(examples_file, test_set_folder, columns=COLUMNS, variants=VARIANTS):
+    """
+    Run the sweep of each test set and column with every variant, sharing one model, without the embedding and query caches.
+    Return one dictionary per variant: index memory, retrieval time, and for each test set the agreement with the float32 predictions
+    (over all the thresholds and Ns of the sweep) and the overlap of the retrieved examples.
+    """
+    from sentence_transformers import SentenceTransformer
+    from .retrieval import Retriever, MODEL_NAME, preprocess_query
+    from .inputs import InputBuilder
+    from .labeling import Labeler
+    from .sweep import THRESHOLDS, NS
+
+    embedder = SentenceTransformer(MODEL_NAME)
+    inputs = {}
+    for test_set in TEST_SETS:
+        builder = InputBuilder(os.path.join(test_set_folder, test_set))
+        inputs[test_set] = {column: [preprocess_query(query) for query in builder.queries(column)] for column in columns}
+
+    rows = []
+    baseline = {}
+    for precision, quantized in variants:
+        # Without the caches, so that the retrieval time is that of the encoder and of the index of the variant, not of reading the cached embeddings
+        retriever = Retriever(embedder=embedder, index_precision=precision, quantize_encoder=quantized, use_cache=False, query_cache=False).load_examples(examples_file)
+        labeler = Labeler.from_retriever(retriever)
+        row = {"precision": precision, "quantized_encoder": quantized, "index_bytes": index_size(retriever), "retrieval_s": 0.0}
+        for test_set in TEST_SETS:
+            agreements = []
+            overlaps = []
+            for column in columns:
+                start = time.perf_counter()
+                top_scores, top_indices = retriever.retrieve(inputs[test_set][column], max(NS))
+                row["retrieval_s"] += time.perf_counter() - start
+                labels = np.array([labeler.label_all(top_scores, top_indices, n, threshold) for threshold in THRESHOLDS for n in NS], dtype=object)
+                key = (test_set, column)
+                if key not in baseline:
+                    baseline[key] = (labels, np.asarray(top_indices))
+                agreements.append(labels == baseline[key][0])
+                overlaps.append([len(set(a) & set(b)) / len(b) for a, b in zip(np.asarray(top_indices).tolist(), baseline[key][1].tolist())])
+            row[test_set + " agreement"] = float(np.concatenate([a.ravel() for a in agreements]).mean() * 100)
+            row[test_set + " overlap"] = float(np.mean(np.concatenate(overlaps)) * 100)
+        rows.append(row)
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("examples_file", help="Control set")
+    parser.add_argument("test_set_folder", help="Folder of the test sets (" + ", ".join(TEST_SETS) + ")")
+    parser.add_argument("--columns", help="Input columns (default: all)", nargs="+", default=COLUMNS)
+    args = parser.parse_args()
+
+    from .sweep import NS
+    rows = report(args.examples_file, args.test_set_folder, args.columns)
+    print("The agreement is the percentage of predictions equal to the float32 ones, over every threshold and N of the sweep;")
+    print("the overlap is the percentage of the top " + str(max(NS)) + " examples also retrieved in float32.\n")
+    print("index\tencoder\tindex (KB)\tretrieval (s)\t" + "\t".join(test_set + " agreement (%)\t" + test_set + " overlap (%)" for test_set in TEST_SETS))
+    for row in rows:
+        print(row["precision"] + "\t" + ("int8" if row["quantized_encoder"] else "float32") + "\t" + str(row["index_bytes"] // 1024) + "\t" + "{:.2f}".format(row["retrieval_s"]) + "\t"
+              + "\t".join("{:.2f}\t{:.2f}".format(row[test_set + " agreement"], row[test_set + " overlap"]) for test_set in TEST_SETS))
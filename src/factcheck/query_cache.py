@@ -0,0 +1,220 @@
+"""
+Cache of the query embeddings: the embedding of a query does not depend on the control set, so the same test set columns (or the same claims
+received by the server) are encoded only once, whatever the control set, threshold and N.
+The queries are looked up by the hash of their normalized text (see normalize_text()), for a given model:
+- in memory, in a least recently used dictionary of at most QUERY_CACHE_SIZE embeddings
+- on disk, in QUERY_CACHE_DIR: immutable segments in the format of the control set embedding cache (see embedding_cache.py), loaded memory-mapped
+The new embeddings are written in a new segment once there are MIN_SEGMENT_SIZE of them (and when the process exits), so that several processes
+(e.g. the workers of experiments.py) can share the cache without locks. When there are more than MAX_SEGMENTS of them, the smallest half are merged
+(when the cache is opened, and after each write), and the least recently used ones are deleted when the directory grows over MAX_QUERY_CACHE_SIZE_MB,
+down to EVICTED_SIZE_MB. The index of the rows on disk only holds the segments still on disk, so the memory of a long run (e.g. a streaming inference)
+is bounded by the size of the cache, not by the number of queries.
+"""
+
+import os, json, atexit, hashlib, logging, uuid
+from collections import OrderedDict
+import numpy as np
+from . import embedding_cache
+
+# SETTINGS
+QUERY_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "query_cache") # Where the query embeddings are saved
+QUERY_CACHE_SIZE = 50000 # Maximum number of embeddings kept in memory
+MAX_QUERY_CACHE_SIZE_MB = 512 # Maximum size of the cache directory, the least recently used segments are deleted above it
+EVICTED_SIZE_MB = 448 # Size of the cache directory after the least recently used segments are deleted
+MIN_SEGMENT_SIZE = 64 # Number of new embeddings written together in a segment
+MAX_SEGMENTS = 64 # Above this number of segments, the smallest half of them are merged into one
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text):
+    """
+    Return the text used as key of a query: the whitespace is collapsed and stripped, which does not change the tokens of the model.
+    """
+    return " ".join(text.split())
+
+
+class QueryCache:
+    """
+    Query embeddings of one model, in memory and on disk.
+    """
+
+    def __init__(self, model_name, capacity=QUERY_CACHE_SIZE, cache_dir=QUERY_CACHE_DIR, persist=True):
+        self.model_name = model_name
+        self.capacity = capacity
+        self.cache_dir = os.path.join(cache_dir, hashlib.sha1(model_name.encode("utf-8")).hexdigest()[:16])
+        self.persist = persist
+        self.memory = OrderedDict() # hash -> embedding, from the least to the most recently used
+        self.disk = {} # hash -> (segment path, row)
+        self.segments = {} # segment path -> memory-mapped embeddings
+        self.pending = OrderedDict() # hash -> embedding, not yet written to disk
+        self.hits = 0
+        self.misses = 0
+        if persist:
+            self.load_segments()
+            atexit.register(self.flush)
+
+    def load_segments(self):
+        """
+        Index the rows of the segments on disk, merging them first if there are too many.
+        """
+        self.compact()
+        self.disk = {}
+        self.segments = {}
+        for embeddings_path in self.segment_paths():
+            try:
+                with open(os.path.splitext(embeddings_path)[0] + ".json", "r") as f:
+                    index = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if index.get("model") != self.model_name:
+                continue
+            for row, h in enumerate(index["claims"]):
+                self.disk.setdefault(h, (embeddings_path, row))
+
+    def segment_paths(self):
+        if not os.path.isdir(self.cache_dir):
+            return []
+        return sorted(os.path.join(self.cache_dir, file) for file in os.listdir(self.cache_dir) if file.endswith(".npy") and ".tmp" not in file)
+
+    def compact(self):
+        """
+        Merge the smallest half of the segments if there are more than MAX_SEGMENTS of them.
+        """
+        paths = self.segment_paths()
+        if len(paths) <= MAX_SEGMENTS:
+            return
+        sizes = {}
+        for path in paths:
+            try:
+                sizes[path] = os.path.getsize(path)
+            except OSError: # deleted by another process
+                continue
+        self.merge(sorted(sizes, key=sizes.get)[:len(paths) // 2])
+
+    def merge(self, paths):
+        """
+        Write the rows of the given segments (without duplicates) in a single segment, and delete them.
+        The rows of the index on disk that were in these segments point to the new one.
+        """
+        hashes = []
+        rows = []
+        seen = set()
+        for embeddings_path in paths:
+            try:
+                with open(os.path.splitext(embeddings_path)[0] + ".json", "r") as f:
+                    index = json.load(f)
+                embeddings = np.load(embeddings_path, mmap_mode="r")
+            except (OSError, ValueError):
+                continue # deleted by another process, or not fully written
+            if index.get("model") != self.model_name:
+                continue
+            keep = [row for row, h in enumerate(index["claims"]) if h not in seen]
+            seen.update(index["claims"])
+            hashes.extend(index["claims"][row] for row in keep)
+            rows.append(np.asarray(embeddings[keep], dtype=np.float32))
+        if len(rows) > 0:
+            self.write_segment(hashes, np.concatenate(rows), replaced=set(paths))
+        for embeddings_path in paths:
+            self.segments.pop(embeddings_path, None)
+            for path in [embeddings_path, os.path.splitext(embeddings_path)[0] + ".json"]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def write_segment(self, hashes, embeddings, replaced=()):
+        """
+        Write a new segment, and index its rows: the hashes not indexed yet, or indexed in one of the replaced segments.
+        """
+        name = os.path.join(self.cache_dir, uuid.uuid4().hex)
+        embedding_cache.save_entry(name + ".npy", name + ".json", embeddings, {"model": self.model_name, "normalize": False, "claims": hashes})
+        for row, h in enumerate(hashes):
+            if h not in self.disk or self.disk[h][0] in replaced:
+                self.disk[h] = (name + ".npy", row)
+
+    def forget(self, removed):
+        """
+        Remove the rows of the deleted segments from the index on disk.
+        """
+        removed = set(removed)
+        if len(removed) == 0:
+            return
+        self.disk = {h: location for h, location in self.disk.items() if location[0] not in removed}
+        for embeddings_path in removed:
+            self.segments.pop(embeddings_path, None)
+
+    def lookup(self, h):
+        """
+        Return the embedding of a hash, from memory or from disk, or None if it is not cached.
+        """
+        if h in self.memory:
+            self.memory.move_to_end(h)
+            return self.memory[h]
+        if h in self.pending:
+            return self.pending[h]
+        if h not in self.disk:
+            return None
+        embeddings_path, row = self.disk[h]
+        try:
+            if embeddings_path not in self.segments:
+                self.segments[embeddings_path] = np.load(embeddings_path, mmap_mode="r")
+                os.utime(embeddings_path) # mark the segment as recently used
+            embedding = np.array(self.segments[embeddings_path][row], dtype=np.float32)
+        except (OSError, ValueError, IndexError):
+            del self.disk[h] # the segment was evicted or merged by another process
+            return None
+        self.remember(h, embedding)
+        return embedding
+
+    def remember(self, h, embedding):
+        self.memory[h] = embedding
+        self.memory.move_to_end(h)
+        while len(self.memory) > self.capacity:
+            self.memory.popitem(last=False)
+
+    def encode(self, embedder, queries, batch_size=32):
+        """
+        Return the embeddings of the queries as a float32 numpy array, encoding with the embedder only the normalized texts that are not cached.
+        """
+        texts = [normalize_text(query) for query in queries]
+        hashes = [embedding_cache.text_hash(text) for text in texts]
+        found = {}
+        missing = OrderedDict() # hash -> text, each distinct text once
+        for h, text in zip(hashes, texts):
+            if h in found or h in missing:
+                continue
+            embedding = self.lookup(h)
+            if embedding is None:
+                missing[h] = text
+            else:
+                found[h] = embedding
+        self.hits += len(found)
+        self.misses += len(missing)
+        logger.debug("Query cache: %d cached, %d encoded", len(found), len(missing))
+
+        if len(missing) > 0:
+            new_embeddings = np.asarray(embedder.encode(list(missing.values()), batch_size=batch_size, convert_to_numpy=True), dtype=np.float32)
+            for h, embedding in zip(missing, new_embeddings):
+                found[h] = embedding
+                self.remember(h, embedding)
+                if self.persist:
+                    self.pending[h] = embedding
+            if len(self.pending) >= MIN_SEGMENT_SIZE:
+                self.flush()
+
+        if len(hashes) == 0:
+            return np.zeros((0, embedder.get_sentence_embedding_dimension()), dtype=np.float32)
+        return np.stack([found[h] for h in hashes])
+
+    def flush(self):
+        """
+        Write the new embeddings in a segment, merge the segments if there are too many,
+        and evict the least recently used segments if the cache is too large.
+        """
+        if len(self.pending) == 0:
+            return
+        self.write_segment(list(self.pending), np.stack(list(self.pending.values())))
+        self.pending = OrderedDict()
+        self.compact()
+        self.forget(embedding_cache.evict(self.cache_dir, MAX_QUERY_CACHE_SIZE_MB, EVICTED_SIZE_MB))
@@ -0,0 +1,43 @@
+"""
+Machine-readable store of the evaluation results.
+The results of a run (one test set and one column, all the thresholds and Ns) are saved as a single JSON Lines table, results/results.jsonl,
+with one row per configuration: mode, test set, column, model, voting policy, decision, minimum vote margin, threshold, n and every metric of metrics.py.
+"""
+
+import os, json
+
+RESULTS_FILE = "results.jsonl"
+TRADEOFF_FILE = "tradeoff.jsonl" # Accuracy/abstention trade-off curves of the decisions (see sweep.tradeoff_curves())
+CURVES_FILE = "curves.jsonl" # Exact metrics-vs-threshold curves of each N (see curves.py)
+CALIBRATION_FILE = "calibration.json" # Calibration of the vote margins of each configuration and decision (see calibration.py)
+
+
+def run_info(output):
+    """
+    Return the mode, the test set and the column of a run, from its output folder (<mode>/<test_set>/<column>, as created by experiments.sh).
+    """
+    output = os.path.abspath(output)
+    column = os.path.basename(output)
+    test_set = os.path.basename(os.path.dirname(output))
+    mode = os.path.basename(os.path.dirname(os.path.dirname(output)))
+    return mode, test_set, column
+
+
+def write_results(path, records):
+    """
+    Write the records (list of dictionaries) as a JSON Lines table, replacing the previous one.
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+        f.close()
+    os.replace(tmp_path, path)
+
+
+def read_results(path):
+    """
+    Return the records of a JSON Lines table.
+    """
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip() != ""]
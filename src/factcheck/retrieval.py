@@ -0,0 +1,189 @@
+"""
+Retrieval of the nearest control set examples ('examples') of the input claims ('queries'), by cosine similarity of their sentence embeddings.
+"""
+
+import os
+import numpy as np
+import torch
+from sentence_transformers import SentenceTransformer
+from . import datasets, dedup, embedding_cache, quantization, search_index
+from .query_cache import QueryCache
+from .live_index import LiveIndex
+from .evidence import EVIDENCE_COLUMNS, evidence_passages
+from .inputs import preprocess_query, load_queries # defined with the inputs, so that they can be used without loading the model
+
+# SETTINGS
+USE_EMBEDDING_CACHE = True # if True, the control set embeddings are saved on disk and reused while the control set and the model do not change
+USE_QUERY_CACHE = True # if True, the query embeddings are kept in memory and on disk, and each distinct query is encoded once (see query_cache.py)
+NORMALIZE_EMBEDDINGS = False # if True, the embeddings are normalized to unit length when encoded
+
+QUERY_BATCH_SIZE = 64 # number of queries encoded together by the model
+QUERY_CHUNK_SIZE = 4096 # number of queries whose similarity with the whole control set is computed at once (bounds the memory of the score matrix)
+
+INDEX_BACKEND = "exact" # "exact" to compare each query with every example, "ivf" for the approximate search of large control sets,
+                        # "sharded" for the exact search of large control sets by several processes (see search_index.py and shards.py)
+INDEX_PRECISION = "float32" # precision of the embeddings stored in the exact index: "float32", "float16" or "int8" (see search_index.QuantizedIndex)
+QUANTIZE_ENCODER = False # if True, the model runs with dynamic int8 quantization of its linear layers (CPU only, see quantization.py)
+DEDUP_THRESHOLD = None # if set, the near-duplicate claims of the control set (cosine similarity >= this value) are collapsed into one example
+                       # that votes with the labels of its cluster (see dedup.py). Not used with the evidence weight
+EVIDENCE_WEIGHT = 0.0 # if > 0, the examples are also scored by their most similar evidence snippet, with this weight (see evidence.py). Always an exact search
+
+MODEL_NAME = 'all-MiniLM-L6-v2'
+
+
+class Retriever:
+    """
+    Sentence transformer and index of the control set examples.
+    The model is loaded once, and can be shared by any number of control sets (load_examples() replaces the current one) and queries.
+    """
+
+    def __init__(self, model_name=MODEL_NAME, embedder=None, index_backend=INDEX_BACKEND, use_cache=USE_EMBEDDING_CACHE, normalize=NORMALIZE_EMBEDDINGS,
+                 batch_size=QUERY_BATCH_SIZE, chunk_size=QUERY_CHUNK_SIZE, evidence_weight=EVIDENCE_WEIGHT, index_precision=INDEX_PRECISION, quantize_encoder=QUANTIZE_ENCODER,
+                 query_cache=USE_QUERY_CACHE, dedup_threshold=DEDUP_THRESHOLD):
+        # The settings are checked before the model is loaded and the control set is encoded
+        if dedup_threshold is not None and evidence_weight > 0:
+            raise ValueError("the near-duplicate claims cannot be collapsed with a positive evidence weight")
+        self.model_name = model_name
+        self.embedder = embedder if embedder is not None else SentenceTransformer(model_name)
+        if quantize_encoder:
+            self.embedder = quantization.quantize_encoder(self.embedder)
+        self.quantized_encoder = quantize_encoder
+        self.cache_model_name = model_name + ("+int8" if quantize_encoder else "") # the embeddings of the quantized model are cached separately
+        self.query_cache = QueryCache(self.cache_model_name) if query_cache else None
+        self.index_backend = index_backend
+        self.index_precision = index_precision
+        self.evidence_weight = evidence_weight
+        self.dedup_threshold = dedup_threshold
+        self.use_cache = use_cache
+        self.normalize = normalize
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.examples_path = None
+        self.corpus = None # Claims of the control set
+        self.corpus_labels = None # Labels of the control set
+        self.corpus_embeddings = None
+        self.corpus_counts = None # Label counts of the near-duplicate cluster of each example, if the control set is collapsed (see dedup.py)
+        self.evidence = [] # Evidence snippets of the control set, if the evidence weight is positive
+        self.index = None
+
+    def load_examples(self, dataset_path):
+        """
+        Load the control set, compute the embeddings of its claims (or load them from the embedding cache), and build its index.
+        With a positive evidence weight, the embeddings of the evidence snippets are computed (or loaded) too.
+        With a dedup threshold, only the representatives of the near-duplicate claims are kept, with the label counts of their clusters.
+        With the sharded backend, the existing shards are opened without loading the embeddings (see load_shards()).
+        Nothing is done if the control set is already loaded. The index of the previous control set is closed (see close()).
+        """
+        if dataset_path == self.examples_path:
+            return self
+        self.close()
+        dataset = datasets.read_table(dataset_path, ["claim", "label"] + (EVIDENCE_COLUMNS if self.evidence_weight > 0 else []))
+        self.corpus = dataset['claim'].tolist()
+        self.corpus_labels = dataset['label'].tolist()
+        self.corpus_counts = None
+        if self.index_backend == "sharded" and self.use_cache and self.evidence_weight == 0 and self.dedup_threshold is None:
+            self.index, self.corpus_embeddings = self.load_shards()
+            self.examples_path = dataset_path
+            return self
+        self.corpus_embeddings = self.encode_corpus(self.corpus)
+        if self.dedup_threshold is not None:
+            representatives, embeddings, self.corpus_counts = dedup.load_collapsed(self.corpus_embeddings, self.corpus_labels, self.dedup_threshold)
+            self.corpus = [self.corpus[row] for row in representatives]
+            self.corpus_labels = [self.corpus_labels[row] for row in representatives]
+            self.corpus_embeddings = torch.from_numpy(np.array(embeddings)).to(self.embedder.device)
+        if self.evidence_weight > 0:
+            self.evidence, owners = evidence_passages(dataset)
+            evidence_embeddings = self.encode_corpus(self.evidence) if len(self.evidence) > 0 else np.zeros((0, self.corpus_embeddings.shape[1]), dtype=np.float32)
+            self.index = search_index.EvidenceIndex(self.corpus_embeddings, evidence_embeddings, owners, self.evidence_weight)
+        else:
+            self.index = search_index.load_index(self.corpus_embeddings, self.index_backend, precision=self.index_precision)
+        self.examples_path = dataset_path
+        return self
+
+    def load_shards(self):
+        """
+        Return the sharded index of the control set (see shards.py), and its embeddings memory-mapped from the embedding cache (None if they are not cached).
+        The shards are named after the key of the embedding cache entry of the claims, so the existing ones are opened without reading the embeddings,
+        and the embeddings are only encoded (or loaded) to build the missing ones.
+        """
+        hashes = [embedding_cache.text_hash(claim) for claim in self.corpus]
+        key = embedding_cache.cache_key(self.cache_model_name, self.normalize, hashes)
+        embeddings = embedding_cache.load_entry(os.path.join(embedding_cache.CACHE_DIR, key + ".npy"), os.path.join(embedding_cache.CACHE_DIR, key + ".json"), hashes)
+        if embeddings is None and not os.path.isdir(search_index.index_path(key, "sharded")):
+            embeddings = embedding_cache.encode_corpus(self.embedder, self.corpus, self.cache_model_name, normalize=self.normalize)
+        return search_index.load_index(embeddings, "sharded", precision=self.index_precision, key=key), embeddings
+
+    def load_live_index(self, path):
+        """
+        Load an updatable index of a control set (see live_index.py) instead of a control set file: its claims, labels and embeddings are those of the index,
+        and refresh() applies its updates.
+        """
+        index = LiveIndex(path)
+        if index.model_name != self.cache_model_name:
+            raise ValueError("the live index " + path + " was built with the model " + index.model_name + ", not " + self.cache_model_name)
+        self.close()
+        self.index = index
+        self.corpus = index.claims
+        self.corpus_labels = index.labels
+        self.corpus_embeddings = None
+        self.corpus_counts = None
+        self.examples_path = path
+        return self
+
+    def refresh(self):
+        """
+        Apply the updates of the live index, if one is loaded. Return True if the control set changed.
+        """
+        if not isinstance(self.index, LiveIndex) or not self.index.refresh():
+            return False
+        self.corpus = self.index.claims # new lists after a compaction
+        self.corpus_labels = self.index.labels
+        return True
+
+    def encode_corpus(self, corpus):
+        """
+        Return the embeddings tensor of the claims of a control set.
+        """
+        if self.use_cache:
+            embeddings = embedding_cache.encode_corpus(self.embedder, corpus, self.cache_model_name, normalize=self.normalize)
+            return torch.from_numpy(np.array(embeddings)).to(self.embedder.device)
+        return self.embedder.encode(corpus, convert_to_tensor=True, normalize_embeddings=self.normalize)
+
+    def encode_queries(self, queries):
+        """
+        Return the embeddings tensor of the queries, from the query cache if enabled.
+        """
+        if self.query_cache is not None:
+            embeddings = self.query_cache.encode(self.embedder, queries, batch_size=self.batch_size)
+            return torch.from_numpy(embeddings).to(self.embedder.device)
+        return self.embedder.encode(queries, batch_size=self.batch_size, convert_to_tensor=True)
+
+    def retrieve(self, queries, top_k):
+        """
+        Return the scores and the corpus indices of the top_k most similar examples of each query, sorted by decreasing cosine similarity.
+        The first n entries of the top_k are the top n, so a single retrieval with the largest N serves every smaller N.
+        Queries are encoded in batches, and searched in the index (see search_index.py) in chunks, so that the score matrix stays bounded.
+        """
+        top_k = min(top_k, len(self.corpus))
+        top_scores = []
+        top_indices = []
+        for start in range(0, len(queries), self.chunk_size):
+            query_embeddings = self.encode_queries(queries[start:start + self.chunk_size])
+            scores, indices = self.index.search(query_embeddings, top_k)
+            top_scores.extend(scores.tolist())
+            top_indices.extend(indices.tolist())
+        return top_scores, top_indices
+
+    def close(self):
+        """
+        Release the resources of the index (the worker processes of the sharded index, see shards.ShardedIndex.close()).
+        The retriever can also be used in a with block, which closes it at the end.
+        """
+        if hasattr(self.index, "close"):
+            self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
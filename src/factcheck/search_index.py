@@ -0,0 +1,328 @@
+#!/usr/bin/python3
+
+# Usage: python3 -m factcheck.search_index <examples_file> <input_file> [--k K] [--nprobe NPROBE]
+
+"""
+Indexes used to retrieve the nearest examples of the queries, by cosine similarity.
+- ExactIndex: brute-force search against the whole control set (the original behaviour).
+- IVFIndex: approximate search. The examples are clustered with k-means, and a query is only compared with the examples of its NPROBE closest clusters.
+  The index is built once and saved in INDEX_DIR, keyed by the hash of the embeddings.
+- QuantizedIndex: brute-force search on the embeddings stored in float16 or int8 (with a scale factor per example), with half or a quarter of the memory.
+- ShardedIndex (shards.py): exact search on shards of the control set, memory-mapped and searched in parallel by several processes or shard servers.
+  The shards are saved once in INDEX_DIR, keyed by the embedding cache key of the claims (see Retriever.load_shards()), so they are opened without the embeddings.
+- EvidenceIndex: exact search where the score of an example also takes into account the similarity with its evidence snippets.
+When run as a module (python3 -m factcheck.search_index), it builds both indexes for a control set and reports the recall@k of the approximate search against the exact one.
+"""
+
+import os, shutil, hashlib, time, argparse
+import numpy as np
+import torch
+
+# SETTINGS
+INDEX_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "index_cache") # Where the approximate indexes are saved
+IVF_NPROBE = 8 # Number of clusters searched for each query
+IVF_ITERATIONS = 20 # Number of k-means iterations
+IVF_TRAINING_SIZE = 65536 # Maximum number of examples used to train k-means (at least one per cluster)
+CHUNK_SIZE = 4096 # Number of rows processed at once when assigning examples to clusters, or converted back to float32 by the quantized index
+PRECISIONS = ["float32", "float16", "int8"] # Precisions of the embeddings stored in the exact index
+
+
+def normalize(embeddings):
+    """
+    Return the embeddings (torch tensor or numpy array) as a float32 numpy array of unit-length rows.
+    """
+    if torch.is_tensor(embeddings):
+        embeddings = embeddings.cpu().numpy()
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+
+class ExactIndex:
+    """
+    Brute-force search: the queries are compared with every example.
+    """
+
+    def __init__(self, embeddings):
+        self.embeddings = torch.nn.functional.normalize(torch.as_tensor(embeddings), p=2, dim=1)
+
+    def __len__(self):
+        return self.embeddings.shape[0]
+
+    def search(self, query_embeddings, top_k):
+        """
+        Return the scores and the indices of the top_k examples of each query, as numpy arrays sorted by decreasing similarity.
+        """
+        query_embeddings = torch.as_tensor(query_embeddings).to(self.embeddings.device)
+        query_embeddings = torch.nn.functional.normalize(query_embeddings, p=2, dim=1)
+        cos_scores = torch.mm(query_embeddings, self.embeddings.transpose(0, 1))
+        top_results = torch.topk(cos_scores, k=top_k, dim=1)
+        return top_results[0].cpu().numpy(), top_results[1].cpu().numpy()
+
+
+class QuantizedIndex:
+    """
+    Brute-force search on embeddings stored in reduced precision: "float16", or "int8" with one scale factor per example (its largest absolute value / 127).
+    The stored examples are converted back to float32 CHUNK_SIZE rows at a time, so the memory of the index stays that of the reduced precision.
+    """
+
+    def __init__(self, embeddings, precision):
+        vectors = normalize(embeddings)
+        self.precision = precision
+        if precision == "float16":
+            self.vectors = vectors.astype(np.float16)
+            self.scales = None
+        elif precision == "int8":
+            self.scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127
+            self.vectors = np.round(vectors / self.scales[:, None]).astype(np.int8)
+            self.scales = self.scales.astype(np.float32)
+        else:
+            raise ValueError("index precision " + precision + " not recognized (expected one of " + ", ".join(PRECISIONS) + ")")
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    @property
+    def nbytes(self):
+        return self.vectors.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def search(self, query_embeddings, top_k):
+        """
+        Return the scores and the indices of the top_k examples of each query, as numpy arrays sorted by decreasing similarity.
+        """
+        queries = normalize(query_embeddings)
+        scores = np.empty((queries.shape[0], self.vectors.shape[0]), dtype=np.float32)
+        for start in range(0, self.vectors.shape[0], CHUNK_SIZE):
+            block = queries @ self.vectors[start:start + CHUNK_SIZE].astype(np.float32).T
+            if self.scales is not None:
+                block *= self.scales[start:start + CHUNK_SIZE]
+            scores[:, start:start + CHUNK_SIZE] = block
+        return top_k_rows(scores, top_k)
+
+
+class IVFIndex:
+    """
+    Inverted file index: the examples are grouped by their closest k-means centroid, and stored contiguously cluster by cluster.
+    A query is compared with the centroids first, and then only with the examples of the nprobe closest clusters.
+    """
+
+    def __init__(self, centroids, offsets, ids, vectors, nprobe=IVF_NPROBE):
+        self.centroids = centroids # (n_clusters, dimension)
+        self.offsets = offsets # (n_clusters + 1), the examples of cluster c are vectors[offsets[c]:offsets[c+1]]
+        self.ids = ids # (n_examples), the row in the control set of each stored vector
+        self.vectors = vectors # (n_examples, dimension), normalized and sorted by cluster
+        self.nprobe = nprobe
+
+    def __len__(self):
+        return self.ids.shape[0]
+
+    @classmethod
+    def build(cls, embeddings, n_clusters=None, nprobe=IVF_NPROBE, seed=0):
+        """
+        Cluster the embeddings with spherical k-means (on a sample of at most IVF_TRAINING_SIZE examples) and build the inverted lists.
+        """
+        vectors = normalize(embeddings)
+        n_examples = vectors.shape[0]
+        if n_clusters is None:
+            n_clusters = max(1, int(4 * np.sqrt(n_examples)))
+        n_clusters = min(n_clusters, n_examples)
+
+        rng = np.random.default_rng(seed)
+        sample = vectors[np.sort(rng.choice(n_examples, size=min(n_examples, max(n_clusters, IVF_TRAINING_SIZE)), replace=False))]
+        centroids = sample[rng.choice(sample.shape[0], size=n_clusters, replace=False)].copy()
+        for _ in range(IVF_ITERATIONS):
+            assignments = assign(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            counts = np.bincount(assignments, minlength=n_clusters)
+            # Empty clusters keep their previous centroid
+            centroids[counts > 0] = normalize(sums[counts > 0])
+
+        assignments = assign(vectors, centroids)
+        ids = np.argsort(assignments, kind="stable")
+        offsets = np.zeros(n_clusters + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(assignments, minlength=n_clusters))
+        return cls(centroids, offsets, ids, vectors[ids], nprobe)
+
+    def save(self, path):
+        """
+        Save the index arrays in the path directory. They are written to a temporary directory and then renamed, so an index is never left half-written.
+        """
+        tmp_path = path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for name in ["centroids", "offsets", "ids", "vectors"]:
+            np.save(os.path.join(tmp_path, name + ".npy"), getattr(self, name))
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, nprobe=IVF_NPROBE):
+        arrays = [np.load(os.path.join(path, name + ".npy"), mmap_mode="r") for name in ["centroids", "offsets", "ids", "vectors"]]
+        return cls(*arrays, nprobe=nprobe)
+
+    def search(self, query_embeddings, top_k):
+        """
+        Return the scores and the indices of the top_k examples of each query, as numpy arrays sorted by decreasing similarity.
+        If fewer than top_k examples are found in the probed clusters, the missing entries have score -inf and index -1.
+        The probed clusters are searched one at a time, each compared at once with all the queries that probe it, and the top_k of every probe are merged.
+        """
+        queries = normalize(query_embeddings)
+        nprobe = min(self.nprobe, self.centroids.shape[0])
+        probes = np.argsort(-(queries @ self.centroids.T), axis=1)[:, :nprobe]
+        # Candidates of each query: top_k columns per probe, in the order of the probes
+        candidate_scores = np.full((queries.shape[0], nprobe * top_k), -np.inf, dtype=np.float32)
+        candidate_rows = np.full((queries.shape[0], nprobe * top_k), -1, dtype=np.int64)
+        pairs = np.argsort(probes.ravel(), kind="stable")
+        clusters, starts = np.unique(probes.ravel()[pairs], return_index=True)
+        for c, pair_group in zip(clusters, np.split(pairs, starts[1:])):
+            start, end = self.offsets[c], self.offsets[c + 1]
+            if end == start:
+                continue
+            query_ids, probe_ranks = pair_group // nprobe, pair_group % nprobe
+            k = min(top_k, end - start)
+            scores, columns = top_k_rows(queries[query_ids] @ np.asarray(self.vectors[start:end]).T, k)
+            slots = probe_ranks[:, None] * top_k + np.arange(k)
+            candidate_scores[query_ids[:, None], slots] = scores
+            candidate_rows[query_ids[:, None], slots] = start + columns
+        top_scores, columns = top_k_rows(candidate_scores, min(top_k, candidate_scores.shape[1]))
+        rows = np.take_along_axis(candidate_rows, columns, axis=1)
+        top_indices = np.where(rows >= 0, self.ids[np.maximum(rows, 0)], -1)
+        return top_scores, top_indices
+
+
+class EvidenceIndex:
+    """
+    Exact search on the claims and the evidence snippets of the examples (see evidence.py).
+    The score of an example is (1 - weight) * its claim similarity + weight * the largest similarity of its evidence snippets,
+    or its claim similarity alone if it has no evidence.
+    """
+
+    def __init__(self, embeddings, evidence_embeddings, evidence_owners, weight):
+        self.vectors = normalize(embeddings)
+        self.evidence = normalize(evidence_embeddings) # one row per snippet, sorted by example (evidence_owners)
+        # The snippets are sorted by example, so the best snippet of each example is a reduction over a contiguous slice
+        self.owners, self.starts = np.unique(np.asarray(evidence_owners, dtype=np.int64), return_index=True)
+        self.weight = weight
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    def search(self, query_embeddings, top_k):
+        """
+        Return the scores and the indices of the top_k examples of each query, as numpy arrays sorted by decreasing score.
+        """
+        queries = normalize(query_embeddings)
+        scores = queries @ self.vectors.T
+        if self.owners.shape[0] > 0:
+            best_evidence = np.maximum.reduceat(queries @ self.evidence.T, self.starts, axis=1)
+            scores[:, self.owners] = (1 - self.weight) * scores[:, self.owners] + self.weight * best_evidence
+        return top_k_rows(scores, top_k)
+
+
+def assign(vectors, centroids):
+    """
+    Return the closest centroid of each vector, comparing CHUNK_SIZE vectors at a time with the centroids (bounds the memory of the score matrix).
+    """
+    return np.concatenate([np.argmax(vectors[start:start + CHUNK_SIZE] @ centroids.T, axis=1) for start in range(0, vectors.shape[0], CHUNK_SIZE)])
+
+
+def top_k_rows(scores, top_k):
+    """
+    Return the top_k scores of each row of the score matrix and their columns, sorted by decreasing score.
+    """
+    top_indices = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k] if top_k < scores.shape[1] else np.tile(np.arange(scores.shape[1]), (scores.shape[0], 1))
+    top_scores = np.take_along_axis(scores, top_indices, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind="stable")
+    return np.take_along_axis(top_scores, order, axis=1), np.take_along_axis(top_indices, order, axis=1)
+
+
+def embeddings_hash(embeddings):
+    """
+    Return the hash of the embeddings, used as the key of the saved indexes.
+    """
+    if torch.is_tensor(embeddings):
+        embeddings = embeddings.cpu().numpy()
+    return hashlib.sha1(np.ascontiguousarray(embeddings, dtype=np.float32).tobytes()).hexdigest()
+
+
+def index_path(key, backend, index_dir=INDEX_DIR):
+    """
+    Return the path of the saved index of the given backend ("ivf" or "sharded", or "dedup" for the collapsed control sets, see dedup.load_collapsed())
+    for the embeddings of the given key.
+    """
+    if backend == "sharded":
+        from .shards import SHARD_SIZE
+        return os.path.join(index_dir, key + "-" + str(SHARD_SIZE) + ".shards")
+    return os.path.join(index_dir, key + "." + backend)
+
+
+def load_index(embeddings, backend="exact", index_dir=INDEX_DIR, precision="float32", key=None):
+    """
+    Return the index of the given backend ("exact", "ivf" or "sharded") over the embeddings, stored with the given precision (exact index only, see PRECISIONS).
+    The approximate index and the shards are loaded from index_dir if they were already built for the same embeddings, otherwise they are built and saved.
+    They are found by the key of the embeddings (by default their hash): with another key, e.g. the embedding cache key of the claims,
+    the embeddings can be None if the index was already built.
+    """
+    if backend in ["ivf", "sharded"] and key is None:
+        key = embeddings_hash(embeddings)
+    if backend == "exact":
+        return ExactIndex(embeddings) if precision == "float32" else QuantizedIndex(embeddings, precision)
+    elif precision != "float32":
+        raise ValueError("the index precision " + precision + " is only available with the exact backend")
+    elif backend == "ivf":
+        path = index_path(key, "ivf", index_dir)
+        if os.path.isfile(os.path.join(path, "vectors.npy")):
+            return IVFIndex.load(path)
+        index = IVFIndex.build(embeddings)
+        index.save(path)
+        return index
+    elif backend == "sharded":
+        from .shards import ShardedIndex, build_shards
+        path = index_path(key, "sharded", index_dir)
+        if not os.path.isdir(path):
+            build_shards(embeddings, path)
+        return ShardedIndex(path)
+    else:
+        raise ValueError("index backend " + backend + " not recognized")
+
+
+def recall_at_k(approximate_indices, exact_indices):
+    """
+    Return the fraction of the exact top-k examples that are also found by the approximate search.
+    """
+    found = 0
+    for approximate, exact in zip(approximate_indices, exact_indices):
+        found += len(set(approximate.tolist()) & set(exact.tolist()))
+    return found / exact_indices.size
+
+
+if __name__ == "__main__":
+    from .retrieval import Retriever, load_queries
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("examples", help="Examples dataset") # Examples: tsv file
+    parser.add_argument("input", help="File containing claims") # Input: one claim per line
+    parser.add_argument("--k", help="Number of neighbours compared (default: 5)", type=int, default=5)
+    parser.add_argument("--nprobe", help="Number of clusters searched per query (default: " + str(IVF_NPROBE) + ")", type=int, default=IVF_NPROBE)
+    args = parser.parse_args()
+
+    retriever = Retriever(index_backend="exact").load_examples(args.examples)
+    queries = load_queries("file", args.input)
+    query_embeddings = retriever.embedder.encode(queries, convert_to_tensor=True)
+    top_k = min(args.k, len(retriever.corpus))
+
+    start = time.perf_counter()
+    index = load_index(retriever.corpus_embeddings, "ivf")
+    index.nprobe = args.nprobe
+    print("IVF index ready in {:.3f}s ({} clusters, nprobe {})".format(time.perf_counter() - start, index.centroids.shape[0], index.nprobe))
+
+    start = time.perf_counter()
+    _, exact_indices = retriever.index.search(query_embeddings, top_k)
+    exact_time = time.perf_counter() - start
+    start = time.perf_counter()
+    _, approximate_indices = index.search(query_embeddings, top_k)
+    approximate_time = time.perf_counter() - start
+
+    print("Exact search: {:.3f}s, IVF search: {:.3f}s".format(exact_time, approximate_time))
+    print("Recall@" + str(top_k) + ": " + str(round(recall_at_k(approximate_indices, exact_indices) * 100, 2)) + "%")
@@ -0,0 +1,301 @@
+#!/usr/bin/python3
+
+# Usage: python3 -m factcheck.shards serve <shards_dir> --port PORT [--node NODE --nodes NODES]
+#        python3 -m factcheck.shards check <examples_file> <input_file> [--shard-size SHARD_SIZE] [--workers WORKERS] [--nodes NODES]
+
+"""
+Sharded exact search, for control sets too large to be searched comfortably by one process:
+the normalized embeddings are split by row ranges into shards of SHARD_SIZE examples, saved as .npy files (see build_shards())
+and memory-mapped by the processes that search them, so no process needs the whole control set in memory.
+The queries are compared with every shard in parallel, and the top-k of each shard are merged into the global top-k (see merge_top_k()):
+- by a pool of SHARD_WORKERS local processes (ShardedIndex)
+- or by shard servers listening on sockets (SHARD_NODES), each one holding a part of the shards, to simulate several nodes:
+  python3 -m factcheck.shards serve <shards_dir> --port 9001 --node 0 --nodes 2
+The results are the same as the exact search (up to the order of examples with equal scores).
+When run as a module with "check", it compares the sharded search (local pool, or local shard servers) with the exact one on a control set.
+"""
+
+import os, sys, json, time, shutil, socket, struct, argparse, subprocess, socketserver
+import concurrent.futures, multiprocessing
+import numpy as np
+from .search_index import normalize, top_k_rows
+
+# SETTINGS
+SHARD_SIZE = 100000 # Number of examples of each shard
+SHARD_WORKERS = os.cpu_count() # Number of processes searching the shards in parallel
+SHARD_NODES = [] # Addresses ("host:port") of the shard servers; if empty, the shards are searched by the local pool
+MAX_HEADER_SIZE = 64 * 1024 # Maximum size of the JSON header of a message, in bytes
+MAX_QUERIES_SIZE = 256 * 1024 * 1024 # Maximum size of the queries of a request to a shard server, in bytes
+NODE_START_TIMEOUT = 60 # Seconds to wait for a local shard server to accept connections
+
+_mapped = {} # Memory-mapped shards of the current process, by path
+
+
+def build_shards(embeddings, path, shard_size=SHARD_SIZE):
+    """
+    Save the normalized embeddings in shards of shard_size rows in the path directory, with their row ranges in meta.json.
+    They are written to a temporary directory and then renamed, so the shards are never left half-written.
+    """
+    rows, dimension = int(embeddings.shape[0]), int(embeddings.shape[1])
+    tmp_path = path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    shards = []
+    for i, start in enumerate(range(0, rows, shard_size)):
+        # Normalized shard by shard, so that memory-mapped embeddings are never loaded whole
+        np.save(os.path.join(tmp_path, str(i) + ".npy"), normalize(embeddings[start:start + shard_size]))
+        shards.append({"file": str(i) + ".npy", "start": start, "rows": int(min(shard_size, rows - start))})
+    with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+        json.dump({"rows": rows, "dimension": dimension, "shards": shards}, f)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_meta(path):
+    with open(os.path.join(path, "meta.json"), "r") as f:
+        return json.load(f)
+
+
+def search_shard(shard_path, start, queries, top_k):
+    """
+    Return the top_k scores of the queries (normalized) in one shard, and the rows of these examples in the whole control set.
+    """
+    if shard_path not in _mapped:
+        _mapped[shard_path] = np.load(shard_path, mmap_mode="r")
+    vectors = _mapped[shard_path]
+    scores, indices = top_k_rows(queries @ vectors.T, min(top_k, vectors.shape[0]))
+    return scores, indices + start
+
+
+def merge_top_k(results, top_k):
+    """
+    Return the global top_k of the (scores, indices) of several shards, sorted by decreasing score.
+    """
+    scores = np.concatenate([result[0] for result in results], axis=1)
+    indices = np.concatenate([result[1] for result in results], axis=1)
+    order = np.argsort(-scores, axis=1, kind="stable")[:, :top_k]
+    return np.take_along_axis(scores, order, axis=1), np.take_along_axis(indices, order, axis=1)
+
+
+def send_message(sock, header, *arrays):
+    """
+    Send a message: the length and the JSON of the header, then the bytes of the arrays.
+    """
+    data = json.dumps(header).encode("utf-8")
+    sock.sendall(struct.pack(">I", len(data)) + data + b"".join(np.ascontiguousarray(array).tobytes() for array in arrays))
+
+
+def receive_exactly(stream, size):
+    data = b""
+    while len(data) < size:
+        chunk = stream.recv(size - len(data)) if hasattr(stream, "recv") else stream.read(size - len(data))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        data += chunk
+    return data
+
+
+def receive_message(stream):
+    """
+    Return the header of a message (see send_message()). The arrays are read by the caller, from the shapes of the header.
+    """
+    size = struct.unpack(">I", receive_exactly(stream, 4))[0]
+    if size > MAX_HEADER_SIZE:
+        raise ValueError("message header of " + str(size) + " bytes (at most " + str(MAX_HEADER_SIZE) + ")")
+    header = json.loads(receive_exactly(stream, size).decode("utf-8"))
+    if not isinstance(header, dict):
+        raise ValueError("the message header must be a JSON object")
+    return header
+
+
+def check_size(header, key, low, high):
+    """
+    Return the integer of the header key, if it is between low and high (included). The sizes of a message are checked before its arrays are read.
+    """
+    value = header[key]
+    if not isinstance(value, int) or isinstance(value, bool) or value < low or value > high:
+        raise ValueError("'" + key + "' must be an integer between " + str(low) + " and " + str(high))
+    return value
+
+
+def search_node(address, queries, top_k):
+    """
+    Return the top_k scores and indices of the queries in the shards of a shard server.
+    """
+    host, port = address.rsplit(":", 1)
+    with socket.create_connection((host, int(port))) as sock:
+        send_message(sock, {"rows": queries.shape[0], "dimension": queries.shape[1], "top_k": top_k}, queries.astype(np.float32))
+        header = receive_message(sock)
+        if "error" in header:
+            raise RuntimeError("shard server " + address + ": " + header["error"])
+        rows, k = check_size(header, "rows", queries.shape[0], queries.shape[0]), check_size(header, "k", 0, top_k)
+        scores = np.frombuffer(receive_exactly(sock, rows * k * 4), dtype=np.float32).reshape(rows, k)
+        indices = np.frombuffer(receive_exactly(sock, rows * k * 8), dtype=np.int64).reshape(rows, k)
+    return scores, indices
+
+
+class ShardedIndex:
+    """
+    Exact search on the shards of a control set, by a pool of local processes or by shard servers.
+    The pool is started on the first search, and shut down by close() (or at the end of a with block).
+    """
+
+    def __init__(self, path, workers=SHARD_WORKERS, nodes=SHARD_NODES):
+        self.path = path
+        self.meta = load_meta(path)
+        self.workers = max(1, min(workers or 1, len(self.meta["shards"])))
+        self.nodes = list(nodes)
+        self.executor = None
+
+    def __len__(self):
+        return self.meta["rows"]
+
+    def search(self, query_embeddings, top_k):
+        """
+        Return the scores and the indices of the top_k examples of each query, as numpy arrays sorted by decreasing similarity.
+        """
+        queries = normalize(query_embeddings)
+        if len(self.nodes) > 0:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(self.nodes)) as executor:
+                results = list(executor.map(lambda address: search_node(address, queries, top_k), self.nodes))
+        else:
+            tasks = [(os.path.join(self.path, shard["file"]), shard["start"]) for shard in self.meta["shards"]]
+            if self.workers == 1:
+                results = [search_shard(shard_path, start, queries, top_k) for shard_path, start in tasks]
+            else:
+                if self.executor is None:
+                    self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+                futures = [self.executor.submit(search_shard, shard_path, start, queries, top_k) for shard_path, start in tasks]
+                results = [future.result() for future in futures]
+        return merge_top_k(results, top_k)
+
+    def close(self):
+        """
+        Shut down the pool of local processes, if it was started. The index can still be searched (the pool is started again).
+        """
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ShardServer(socketserver.ThreadingTCPServer):
+    """
+    Shard server: searches the queries it receives in its shards (the shards i of the directory with i % nodes == node).
+    """
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, path, node=0, nodes=1):
+        meta = load_meta(path)
+        self.dimension = meta["dimension"]
+        self.shards = [(os.path.join(path, shard["file"]), shard["start"]) for i, shard in enumerate(meta["shards"]) if i % nodes == node]
+        super().__init__(address, ShardRequestHandler)
+
+
+class ShardRequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        try:
+            header = receive_message(self.rfile)
+            dimension = check_size(header, "dimension", self.server.dimension, self.server.dimension)
+            rows = check_size(header, "rows", 1, MAX_QUERIES_SIZE // (dimension * 4))
+            top_k = check_size(header, "top_k", 1, MAX_QUERIES_SIZE // (rows * 12)) # the scores and indices sent back
+            queries = np.frombuffer(receive_exactly(self.rfile, rows * dimension * 4), dtype=np.float32).reshape(rows, dimension)
+            if len(self.server.shards) == 0:
+                scores, indices = np.zeros((rows, 0), dtype=np.float32), np.zeros((rows, 0), dtype=np.int64)
+            else:
+                scores, indices = merge_top_k([search_shard(shard_path, start, queries, top_k) for shard_path, start in self.server.shards], top_k)
+            send_message(self.connection, {"rows": rows, "k": int(scores.shape[1])}, scores.astype(np.float32), indices.astype(np.int64))
+        except (ValueError, KeyError) as e:
+            send_message(self.connection, {"error": str(e)})
+        except ConnectionError:
+            pass
+
+
+def start_local_nodes(path, nodes, base_port):
+    """
+    Start the given number of shard servers as local processes, on consecutive ports. Return their addresses and processes once they accept connections.
+    Raise RuntimeError (after stopping them) if a server exits or does not accept connections within NODE_START_TIMEOUT seconds.
+    """
+    processes = []
+    addresses = []
+    src = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    for node in range(nodes):
+        port = base_port + node
+        processes.append(subprocess.Popen([sys.executable, "-m", "factcheck.shards", "serve", path, "--port", str(port), "--node", str(node), "--nodes", str(nodes)], cwd=src))
+        addresses.append("127.0.0.1:" + str(port))
+    deadline = time.monotonic() + NODE_START_TIMEOUT
+    for address, process in zip(addresses, processes):
+        host, port = address.rsplit(":", 1)
+        while True:
+            try:
+                socket.create_connection((host, int(port))).close()
+                break
+            except OSError:
+                if process.poll() is not None or time.monotonic() > deadline:
+                    for started in processes:
+                        started.terminate()
+                    raise RuntimeError("the shard server " + address + " did not start" + (" (exit code " + str(process.returncode) + ")" if process.returncode is not None else ""))
+                time.sleep(0.1)
+    return addresses, processes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    serve_parser = subparsers.add_parser("serve", help="Serve the shards of a node")
+    serve_parser.add_argument("shards", help="Shards directory (see build_shards())")
+    serve_parser.add_argument("--host", help="Host to listen on (default: 127.0.0.1)", default="127.0.0.1")
+    serve_parser.add_argument("--port", help="Port to listen on", type=int, required=True)
+    serve_parser.add_argument("--node", help="Number of this node (default: 0)", type=int, default=0)
+    serve_parser.add_argument("--nodes", help="Number of nodes (default: 1)", type=int, default=1)
+    check_parser = subparsers.add_parser("check", help="Compare the sharded search with the exact one")
+    check_parser.add_argument("examples", help="Examples dataset")
+    check_parser.add_argument("input", help="File containing claims")
+    check_parser.add_argument("--k", help="Number of neighbours compared (default: 5)", type=int, default=5)
+    check_parser.add_argument("--shard-size", help="Number of examples of each shard (default: " + str(SHARD_SIZE) + ")", type=int, default=SHARD_SIZE)
+    check_parser.add_argument("--workers", help="Number of local processes (default: " + str(SHARD_WORKERS) + ")", type=int, default=SHARD_WORKERS)
+    check_parser.add_argument("--nodes", help="Number of local shard servers, instead of the local pool (default: 0)", type=int, default=0)
+    check_parser.add_argument("--port", help="First port of the shard servers (default: 9001)", type=int, default=9001)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        with ShardServer((args.host, args.port), args.shards, args.node, args.nodes) as server:
+            print("Serving " + str(len(server.shards)) + " shards on " + args.host + ":" + str(args.port))
+            server.serve_forever()
+        sys.exit(0)
+
+    from .retrieval import Retriever, load_queries
+    from .search_index import INDEX_DIR, embeddings_hash
+    retriever = Retriever(index_backend="exact").load_examples(args.examples)
+    queries = load_queries("file", args.input)
+    query_embeddings = retriever.encode_queries(queries)
+    top_k = min(args.k, len(retriever.corpus))
+
+    path = build_shards(retriever.corpus_embeddings, os.path.join(INDEX_DIR, embeddings_hash(retriever.corpus_embeddings) + "-" + str(args.shard_size) + ".shards"), args.shard_size)
+    addresses, processes = start_local_nodes(path, args.nodes, args.port) if args.nodes > 0 else ([], [])
+    index = ShardedIndex(path, workers=args.workers, nodes=addresses)
+    try:
+        index.search(query_embeddings[:1], top_k) # start the workers
+        start = time.perf_counter()
+        exact_scores, exact_indices = retriever.index.search(query_embeddings, top_k)
+        exact_time = time.perf_counter() - start
+        start = time.perf_counter()
+        sharded_scores, sharded_indices = index.search(query_embeddings, top_k)
+        sharded_time = time.perf_counter() - start
+    finally:
+        index.close()
+        for process in processes:
+            process.terminate()
+
+    print(str(len(index.meta["shards"])) + " shards of up to " + str(args.shard_size) + " examples, " + (str(args.nodes) + " shard servers" if args.nodes > 0 else str(index.workers) + " local processes"))
+    print("Exact search: {:.3f}s, sharded search: {:.3f}s".format(exact_time, sharded_time))
+    print("Same scores: " + str(np.allclose(exact_scores, sharded_scores, atol=1e-5)) + ", same examples: "
+          + str(round(float(np.mean([len(set(a) & set(b)) / len(a) for a, b in zip(exact_indices.tolist(), sharded_indices.tolist())])) * 100, 2)) + "%")
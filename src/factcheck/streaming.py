@@ -0,0 +1,83 @@
+"""
+Streaming inference over claim files of any size, with bounded memory.
+The claims are read lazily from a file (or stdin), retrieved and labelled in chunks of STREAM_CHUNK_SIZE,
+and the rows of the inference file are written and flushed after each chunk.
+An interrupted run can be resumed: the rows already written are kept, and the corresponding claims are skipped.
+"""
+
+import os, sys, itertools
+from .inputs import preprocess_query
+
+# SETTINGS
+STREAM_CHUNK_SIZE = 1024 # number of claims retrieved and labelled together
+
+
+def read_queries(input_path, skip=0):
+    """
+    Yield the preprocessed claims of a file (one per line, empty lines are skipped), or of stdin if input_path is "-".
+    The first skip claims are not yielded.
+    """
+    f = sys.stdin if input_path == "-" else open(input_path, "r")
+    try:
+        queries = (preprocess_query(line) for line in f if line.strip() != "")
+        yield from itertools.islice(queries, skip, None)
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def chunks(iterable, size):
+    """
+    Yield lists of (at most) size consecutive elements of the iterable.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+
+def written_rows(output_path):
+    """
+    Return the number of complete rows of an inference file (excluding the header), and truncate a partially written last row.
+    Return 0 if the file does not exist or has no complete header.
+    """
+    if not os.path.isfile(output_path):
+        return 0
+    rows = -1 # The header is not a row
+    complete_size = 0
+    with open(output_path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            rows += 1
+            complete_size += len(line)
+    if rows < 0:
+        return 0
+    if complete_size != os.path.getsize(output_path):
+        with open(output_path, "r+b") as f:
+            f.truncate(complete_size)
+    return rows
+
+
+def stream_inference(retriever, labeler, input_path, output_path, n, threshold, chunk_size=STREAM_CHUNK_SIZE, resume=False):
+    """
+    Label the claims of input_path chunk by chunk, appending each chunk to the inference file as soon as it is labelled.
+    If resume is True, the rows already in the inference file are kept and their claims are not labelled again.
+    Return the number of rows of the inference file.
+    """
+    skip = written_rows(output_path) if resume else 0
+    with open(output_path, "a" if skip > 0 else "w") as f:
+        if skip == 0:
+            f.write(labeler.inference_header())
+        rows = skip
+        for queries in chunks(read_queries(input_path, skip), chunk_size):
+            top_scores, top_indices = retriever.retrieve(queries, n)
+            labels = labeler.label_all(top_scores, top_indices, n, threshold)
+            for query, label, scores, indices in zip(queries, labels, top_scores, top_indices):
+                f.write(labeler.inference_row(query, label, scores, indices, n, threshold))
+            rows += len(queries)
+            f.flush()
+        f.close()
+    return rows
@@ -0,0 +1,143 @@
+"""
+Threshold x N sweep of the semantic search.
+The queries are retrieved once with the largest N, every threshold/N combination is labelled from the same scores with output_label(),
+and all the combinations are evaluated at once against the test set. The results are saved in results/results.jsonl (see results_store.py).
+The scores and indices of the retrieved examples are also saved in the neighbour table of the run (see neighbours.py),
+from which label_sweep() can run the sweep again with another voting policy, without the model (see relabel.py).
+The same scores also give the accuracy/abstention trade-off curves of every decision (majority or score-weighted vote), when abstaining below a vote margin,
+saved in results/tradeoff.jsonl with the calibrated confidence of each margin (see tradeoff_curves() and calibration.py),
+and the exact metrics of every threshold (not only those of the grid) for each N, saved in results/curves.jsonl (see curves.py).
+"""
+
+import os, json
+import numpy as np
+from . import curves, metrics, results_store, voting
+from .calibration import Calibration
+from .inputs import load_queries
+from .labeling import Labeler, DEFAULT_POLICY
+from .neighbours import NeighbourTable, NEIGHBOURS_FOLDER
+
+# SETTINGS
+SAVE_NEIGHBOURS = True # If True, the neighbour table of each run is saved in <output>/neighbours
+TRADEOFF_CURVES = True # If True, the trade-off curves of every decision are saved in results/tradeoff.jsonl, and their calibrations in results/calibration.json
+THRESHOLD_CURVES = True # If True, the exact metrics-vs-threshold curves of every N are saved in results/curves.jsonl
+
+# Arguments of the sweep
+THRESHOLDS = [0.3, 0.35, 0.4, 0.45, 0.5, 0.55, 0.6, 0.65, 0.7, 0.75, 0.8, 0.85]
+NS = [1, 2, 3, 4, 5]
+MARGINS = [0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0] # Vote margins below which the trade-off curves abstain
+
+
+def config_args(threshold, n):
+    """
+    Return the command line arguments of the model script for a threshold and an N (e.g. "--threshold 0.3 --n 1").
+    """
+    return "--threshold " + str(threshold) + " --n " + str(n)
+
+
+def config_name(threshold, n):
+    """
+    Return the name of the inference folder and of the text report of a threshold and an N (e.g. "semantic_search-threshold-0.3-n-1").
+    """
+    return "semantic_search-" + config_args(threshold, n).replace("--", "").replace(" ", "-")
+
+
+def run_sweep(retriever, input_path, output, test_set_file, examples_file, thresholds=THRESHOLDS, ns=NS, save_inference=True, write_text_reports=False, verbose=False, policy=DEFAULT_POLICY):
+    """
+    Run the whole sweep for an input file, in the output folder of a run (<mode>/<test_set>/<column>).
+    retriever is a Retriever (see retrieval.py), whose model is shared by all the sweeps it runs.
+    Return the records saved in the results table.
+    """
+    # Retrieve the top max(N) examples of every query once
+    retriever.load_examples(examples_file)
+    queries = load_queries("file", input_path)
+    top_scores, top_indices = retriever.retrieve(queries, max(ns))
+    if SAVE_NEIGHBOURS:
+        table = NeighbourTable.from_retrieval(retriever, queries, top_scores, top_indices)
+        table.save(os.path.join(output, NEIGHBOURS_FOLDER))
+
+    labeler = Labeler.from_retriever(retriever, policy=policy)
+    return label_sweep(labeler, queries, top_scores, top_indices, output, test_set_file, thresholds, ns, save_inference, write_text_reports, verbose)
+
+
+def label_sweep(labeler, queries, top_scores, top_indices, output, test_set_file, thresholds=THRESHOLDS, ns=NS, save_inference=True, write_text_reports=False, verbose=False):
+    """
+    Label the queries from their retrieved examples for every threshold/N combination, with the voting policy of the labeler,
+    and evaluate them at once against the test set. The examples must have been retrieved with a top_k of at least max(ns).
+    Return the records saved in the results table.
+    """
+    # Load the test set once: the column is the name of the output folder ("claim", "news-like" or "social-like")
+    mode, test_set, column = results_store.run_info(output)
+    evaluator = metrics.Evaluator(test_set_file, column)
+
+    # Label the queries for each set of arguments, from the score and index matrices converted once
+    top_scores = np.asarray(top_scores, dtype=np.float64)
+    top_indices = np.asarray(top_indices)
+    configs = [(threshold, n) for threshold in thresholds for n in ns]
+    predicted = []
+    for threshold, n in configs:
+        if verbose:
+            print("\033[92m" + "Evaluating semantic_search with args: " + config_args(threshold, n) + "\033[0m")
+        labels = labeler.label_all(top_scores, top_indices, n, threshold)
+        if save_inference:
+            output_path = os.path.join(output, "inference", config_name(threshold, n))
+            os.makedirs(output_path, exist_ok=True)
+            labeler.write_inference(os.path.join(output_path, "inference.tsv"), queries, labels, top_scores, top_indices, n, threshold)
+        predicted.append(metrics.encode_predicted(labels))
+
+    # Compute the metrics of every set of arguments at once
+    results = evaluator.evaluate(np.stack(predicted))
+
+    records = []
+    os.makedirs(os.path.join(output, "results"), exist_ok=True)
+    for (threshold, n), result in zip(configs, results):
+        records.append(dict({"mode": mode, "test_set": test_set, "column": column, "model": "semantic_search", "policy": labeler.policy,
+                             "decision": labeler.decision, "min_margin": labeler.min_margin, "threshold": threshold, "n": n}, **result))
+        if write_text_reports:
+            metrics.write_report(os.path.join(output, "results", config_name(threshold, n) + ".txt"), "semantic_search", test_set_file, result)
+        if verbose:
+            print(evaluator.report("semantic_search", result))
+    results_store.write_results(os.path.join(output, "results", results_store.RESULTS_FILE), records)
+
+    if THRESHOLD_CURVES:
+        points = curves.threshold_curves(labeler, top_scores, top_indices, evaluator.expected, ns)
+        points = [dict({"mode": mode, "test_set": test_set, "column": column, "model": "semantic_search", "policy": labeler.policy,
+                        "decision": labeler.decision, "min_margin": labeler.min_margin}, **point) for point in points]
+        results_store.write_results(os.path.join(output, "results", results_store.CURVES_FILE), points)
+
+    if TRADEOFF_CURVES:
+        tradeoff, calibrations = tradeoff_curves(labeler, top_scores, top_indices, evaluator, thresholds, ns)
+        tradeoff = [dict({"mode": mode, "test_set": test_set, "column": column, "model": "semantic_search"}, **point) for point in tradeoff]
+        results_store.write_results(os.path.join(output, "results", results_store.TRADEOFF_FILE), tradeoff)
+        with open(os.path.join(output, "results", results_store.CALIBRATION_FILE), "w") as f:
+            json.dump(calibrations, f)
+    return records
+
+
+def tradeoff_curves(labeler, top_scores, top_indices, evaluator, thresholds=THRESHOLDS, ns=NS, margins=MARGINS):
+    """
+    For every decision (see voting.DECISIONS), threshold and N, evaluate the predictions when the ones whose vote margin is below each of the margins are NONE.
+    The calibration of the margins (see calibration.py) is fitted on the labelled predictions of each configuration, and gives the confidence of each margin:
+    it describes the test set of the evaluator, so an operating point chosen with it should be checked on another test set.
+    Return the list of curve points (decision, threshold, n, min_margin, confidence and metrics), and the dictionary of calibrations by configuration.
+    """
+    points = []
+    predicted = []
+    calibrations = {}
+    for decision in voting.DECISIONS:
+        decider = Labeler(labeler.corpus, labeler.corpus_labels, policy=labeler.policy, decision=decision, corpus_counts=labeler.corpus_counts)
+        for threshold in thresholds:
+            for n in ns:
+                codes, vote_margins = decider.decide(top_scores, top_indices, n, threshold)
+                labels = metrics.encode_predicted(voting.decode(codes))
+                labelled = labels != metrics.NONE
+                calibration = Calibration.fit(vote_margins[labelled], (labels == evaluator.expected)[labelled])
+                calibrations[config_name(threshold, n) + "-" + decision] = calibration.to_dict()
+                for min_margin in margins:
+                    points.append({"policy": labeler.policy, "decision": decision, "threshold": threshold, "n": n, "min_margin": min_margin,
+                                   "confidence": round(float(calibration.predict(min_margin)), 4)})
+                    predicted.append(np.where(vote_margins < min_margin, metrics.NONE, labels))
+
+    # Compute the metrics of every point at once
+    results = evaluator.evaluate(np.stack(predicted))
+    return [dict(point, **result) for point, result in zip(points, results)], calibrations
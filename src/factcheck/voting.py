@@ -0,0 +1,180 @@
+#!/usr/bin/python3
+
+# Usage: python3 -m factcheck.voting [--max-n MAX_N]
+
+"""
+Vectorized majority vote: the rules of output_label() (see labeling.py), applied with NumPy to all the queries at once.
+The labels of the control set are encoded once as small integers, so that the labels of the first n retrieved examples of every query
+form a matrix (queries x n), with the examples under the threshold masked as BELOW_THRESHOLD. The label counts of all the queries
+are computed at once, and the cascade of rules of output_label() becomes a single np.select().
+The same rules also apply to score-weighted votes, and the vote margin of each prediction can be used to abstain (see margins()).
+When run as a module (python3 -m factcheck.voting), it checks that vote() gives the same label as output_label() for every combination
+of label counts of up to MAX_N examples, and for every voting policy.
+"""
+
+import sys, itertools, argparse
+import numpy as np
+
+DECISIONS = ["majority", "weighted"] # "majority": each example above the threshold has one vote; "weighted": its vote is its score
+
+# Label codes
+TRUE = 0
+FALSE = 1
+HALF_TRUE = 2
+NONE = 3
+UNKNOWN = 4 # Label of the control set not recognized (not counted, as in output_label())
+BELOW_THRESHOLD = 5 # Example under the threshold (None label)
+CLUSTER_CODES = 5 # Label codes counted in the clusters of near-duplicate examples: TRUE, FALSE, HALF_TRUE, NONE and UNKNOWN (see dedup.py)
+
+LABELS = ["true", "false", "half-true", "none"] # Labels of the codes TRUE, FALSE, HALF_TRUE and NONE
+OUTPUT_LABELS = np.array(["true", "false", "half-true", None], dtype=object) # Output labels of the codes TRUE, FALSE, HALF_TRUE and NONE (no label)
+
+
+def encode_labels(labels):
+    """
+    Return the codes of the labels of the control set (case insensitive). None is encoded as BELOW_THRESHOLD, and any other label as UNKNOWN.
+    """
+    codes = np.full(len(labels), UNKNOWN, dtype=np.int8)
+    for i, label in enumerate(labels):
+        if label is None:
+            codes[i] = BELOW_THRESHOLD
+        elif isinstance(label, str) and label.lower() in LABELS:
+            codes[i] = LABELS.index(label.lower())
+    return codes
+
+
+def neighbour_codes(corpus_codes, top_scores, top_indices, n, threshold):
+    """
+    Return the matrix (queries x n) of the label codes of the first n retrieved examples of every query, where the examples under the threshold are BELOW_THRESHOLD.
+    """
+    scores = np.asarray(top_scores, dtype=np.float64)[:, :n] # compared in double precision, as the Python floats of label_query()
+    indices = np.asarray(top_indices)[:, :n]
+    return np.where(scores > threshold, corpus_codes[indices], BELOW_THRESHOLD).astype(np.int8)
+
+
+def cluster_codes(corpus_counts, top_scores, top_indices, n, threshold):
+    """
+    Return the matrices (queries x n * CLUSTER_CODES) of the label codes and of the member counts of the first n retrieved clusters of every query,
+    from the label counts of the clusters (clusters x CLUSTER_CODES, see dedup.label_counts()): each cluster has one column per label code,
+    whose weight is its number of members with this label, and whose code is BELOW_THRESHOLD if the cluster is under the threshold.
+    With these counts as weights, vote() counts the members of the clusters as examples.
+    """
+    scores = np.asarray(top_scores, dtype=np.float64)[:, :n]
+    indices = np.asarray(top_indices)[:, :n]
+    codes = np.where((scores > threshold)[:, :, None], np.arange(CLUSTER_CODES, dtype=np.int8), BELOW_THRESHOLD).astype(np.int8)
+    return codes.reshape(scores.shape[0], -1), corpus_counts[indices].reshape(scores.shape[0], -1)
+
+
+def count_labels(codes, weights=None):
+    """
+    Return the counts of the TRUE, FALSE, HALF_TRUE, NONE and BELOW_THRESHOLD codes of every row of the matrix, as five arrays.
+    If weights (matrix of the same shape, e.g. the scores) is given, return the sums of the weights of each code instead.
+    """
+    if weights is None:
+        return [np.count_nonzero(codes == code, axis=1) for code in [TRUE, FALSE, HALF_TRUE, NONE, BELOW_THRESHOLD]]
+    return [np.where(codes == code, weights, 0).sum(axis=1) for code in [TRUE, FALSE, HALF_TRUE, NONE, BELOW_THRESHOLD]]
+
+
+def tally(codes, weights=None, half_true_as_false=True, below_threshold_as_none=False):
+    """
+    Return the support of the TRUE, FALSE, HALF_TRUE and NONE labels of every row (see count_labels()), as four arrays,
+    where HALF_TRUE is merged into FALSE and BELOW_THRESHOLD into NONE if specified, as in output_label().
+    """
+    trues, falses, half_trues, nones, below = count_labels(codes, weights)
+    if below_threshold_as_none:
+        nones = nones + below
+    if half_true_as_false:
+        falses = falses + half_trues
+        half_trues = np.zeros_like(half_trues)
+    return trues, falses, half_trues, nones
+
+
+def resolve(support, ties="logic"):
+    """
+    Return the output codes (TRUE, FALSE, HALF_TRUE, or NONE for no label) of the support of the labels (see tally()),
+    with the same rules as output_label().
+    """
+    trues, falses, half_trues, nones = support
+    conditions = [
+        (trues == 0) & (falses == 0) & (half_trues == 0), # all labels are None
+        nones > trues + falses + half_trues, # more NONE labels than the others
+        (trues > falses) & (trues > half_trues),
+        (falses > trues) & (falses > half_trues),
+        (half_trues > trues) & (half_trues > falses),
+        np.full(trues.shape[0], ties == "abstain"),
+        (trues == falses) & (trues > half_trues),
+        (trues == half_trues) & (trues > falses),
+        (falses == half_trues) & (falses > trues),
+    ]
+    choices = [NONE, NONE, TRUE, FALSE, HALF_TRUE, NONE, HALF_TRUE, TRUE, FALSE]
+    return np.select(conditions, choices, default=NONE).astype(np.int8)
+
+
+def vote(codes, half_true_as_false=True, ties="logic", below_threshold_as_none=False, weights=None, return_margins=False):
+    """
+    Return the output codes of the rows of the matrix of label codes, with the same rules as output_label().
+    If weights is given (the scores of the examples), each example votes with its weight instead of 1.
+    If return_margins, also return the vote margin of every prediction (see margins()).
+    """
+    support = tally(codes, weights, half_true_as_false, below_threshold_as_none)
+    predicted = resolve(support, ties)
+    if return_margins:
+        return predicted, margins(support, predicted)
+    return predicted
+
+
+def margins(support, predicted):
+    """
+    Return the vote margin of every prediction: the support of the output label minus the largest support of another label,
+    over the total support of the labels, between 0 (tie, or no label) and 1 (unanimous vote).
+    """
+    support = np.stack(support, axis=1).astype(np.float64)
+    total = support.sum(axis=1)
+    rows = np.arange(support.shape[0])
+    labelled = (predicted != NONE) & (total > 0)
+    winner = support[rows, np.where(labelled, predicted, 0)]
+    others = support.copy()
+    others[rows, np.where(labelled, predicted, 0)] = -np.inf
+    margin = (winner - others.max(axis=1)) / np.maximum(total, 1e-12)
+    return np.where(labelled, np.clip(margin, 0, 1), 0)
+
+
+def decode(codes):
+    """
+    Return the list of output labels of the output codes ("true", "false", "half-true" or None).
+    """
+    return OUTPUT_LABELS[codes].tolist()
+
+
+def check_equivalence(max_n):
+    """
+    Compare vote() with output_label() on every combination of counts of TRUE, FALSE, HALF_TRUE, NONE and BELOW_THRESHOLD labels,
+    for 1 to max_n examples and every voting policy. Return the number of combinations and the list of mismatches.
+    """
+    from .labeling import output_label, POLICIES
+    rows = [counts for n in range(1, max_n + 1) for counts in itertools.product(range(n + 1), repeat=5) if sum(counts) == n]
+    # One row of codes per combination of counts, padded to max_n with UNKNOWN labels (not counted)
+    codes = np.full((len(rows), max_n), UNKNOWN, dtype=np.int8)
+    for i, counts in enumerate(rows):
+        row = [code for code, count in zip([TRUE, FALSE, HALF_TRUE, NONE, BELOW_THRESHOLD], counts) for _ in range(count)]
+        codes[i, :len(row)] = row
+    mismatches = []
+    for policy, options in POLICIES.items():
+        # output_label() receives the labels of the first n examples only, as label_query() does
+        labels = [[None if code == BELOW_THRESHOLD else LABELS[code] for code in row[:sum(counts)]] for row, counts in zip(codes, rows)]
+        expected = [output_label(row, **options) for row in labels]
+        predicted = decode(vote(codes, **options))
+        mismatches.extend((policy, counts, e, p) for counts, e, p in zip(rows, expected, predicted) if e != p)
+    return len(rows) * len(POLICIES), mismatches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max-n", help="Largest number of examples (default: 10)", type=int, default=10)
+    args = parser.parse_args()
+
+    combinations, mismatches = check_equivalence(args.max_n)
+    for policy, counts, expected, predicted in mismatches[:20]:
+        print("Policy " + policy + ", counts (true, false, half-true, none, under threshold) " + str(counts) + ": output_label() " + str(expected) + ", vote() " + str(predicted))
+    print(str(combinations) + " combinations checked, " + str(len(mismatches)) + " mismatches")
+    sys.exit(1 if mismatches else 0)
@@ -4,12 +4,70 @@
 
 """
 This script has to get the stats from the specified directory.
-Each file in directory/results is supposed to be a result file, named <model>-<args>.txt. E.g. semantic_search-threshold-0.35-n-6.txt
-The script has to get the accuracy percentage from each file, and print it in a table.
+The results of each test are read from directory/<test>/results/results.jsonl (see factcheck/results_store.py), one row per threshold and n.
+For older runs without it, each file in directory/<test>/results is supposed to be a result file, named <model>-<args>.txt. E.g. semantic_search-threshold-0.35-n-6.txt
+The script has to get the accuracy percentage (and the other metrics) of each threshold and n, and print them in a table.
+If the test has the exact curves of every threshold (directory/<test>/results/curves.jsonl, see factcheck/curves.py), they are also written in <test>_curves.tsv,
+with the best threshold of each n.
 """
 
 import os, sys, shutil
 import numpy as np
+from factcheck import results_store
+
+# Metrics reported, with the line prefix used in the text reports
+REPORT_LINES = {
+    "accuracy": "Accuracy:",
+    "macro_f1": "Macro F1 score:",
+    "percentage_none": "Percentage of NONE (over the number of incorrect predictions):",
+    "percentage_pure_errors": "Percentage of pure errors (over the number of incorrect predictions):",
+    "abstention_rate": "Abstention rate (NONE over the total number of predictions):",
+    "pure_error_rate": "Pure error rate (the number of pure errors over the total number of predictions):",
+}
+
+# Metrics written in the TSV file of the exact curves
+CURVE_METRICS = ["accuracy", "macro_f1", "percentage_none", "percentage_pure_errors", "abstention_rate", "pure_error_rate"]
+
+
+def parse_report(path):
+    """
+    Return the metrics of a text report, written by compute_metrics.py.
+    """
+    record = {}
+    with open(path, "r") as f:
+        for line in f:
+            for metric, prefix in REPORT_LINES.items():
+                if line.startswith(prefix):
+                    record[metric] = float(line.split(":")[1].split("%")[0]) # be aware there is a space after the colon, and the F1 score has no percentage sign
+    return record
+
+
+def load_records(results_directory):
+    """
+    Return the results of a test, from the results table if present, otherwise from the text reports.
+    """
+    results_path = os.path.join(results_directory, results_store.RESULTS_FILE)
+    if os.path.isfile(results_path):
+        return results_store.read_results(results_path)
+
+    records = []
+    for file in os.listdir(results_directory):
+        # Keep only the files that end with .txt
+        if not file.endswith(".txt"):
+            continue
+        args = file.split("-")
+        model = args[0]
+        if model != "semantic_search":
+            print("Model not recognized:")
+            print(file, model)
+            continue
+        record = parse_report(os.path.join(results_directory, file))
+        record["model"] = model
+        record["threshold"] = float(args[2])
+        record["n"] = int(args[4].split(".")[0])
+        records.append(record)
+    return records
+
 
 # Read the parameters
 if len(sys.argv) != 3:
@@ -38,104 +96,27 @@ for test in tests:
     if not os.path.isdir(directory):
         print("Directory not found: " + directory)
         sys.exit(1)
-    
-    # if not os.path.isdir(os.path.join(output_folder)):
-    #     os.makedirs(os.path.join(output_folder))
 
-    # Get the list of files in the directory
-    files = os.listdir(results_directory)
+    records = [record for record in load_records(results_directory) if record["model"] == "semantic_search"]
 
-    # Keep only the files that end with .txt
-    files = [file for file in files if file.endswith(".txt")]
+    # Matrices of semantic_search results, rows are ns, columns are thresholds. Each cell is a list of values (averaged in the tables)
+    semantic_search_thresholds = sorted(set(float(record["threshold"]) for record in records))
+    semantic_search_ns = sorted(set(int(record["n"]) for record in records))
 
-    # Get the list of models
-    models = ["semantic_search"]
+    def results_matrix(metric):
+        matrix = [[[] for threshold in semantic_search_thresholds] for n in semantic_search_ns]
+        for record in records:
+            idx_n = semantic_search_ns.index(int(record["n"]))
+            idx_threshold = semantic_search_thresholds.index(float(record["threshold"]))
+            matrix[idx_n][idx_threshold].append(float(record[metric]))
+        return matrix
 
-    table = [] # List of lists, each list is a row of the table
-
-    # Matrix of semantic_search results, rows are thresholds, columns are ns. Each cell is a list of accuracies. Notice that threshold and n are floats and ints, respectively.
-    semantic_search_thresholds = []
-    semantic_search_ns = []
-    semantic_search_results = [] # Arrary of accuracies
-    accuracy_matrix = [] # Matrix of accuracies (rows in the number of Ns, columns in the number of thresholds)
-    f1_score_matrix = [] # Matrix of F1 scores (rows in the number of Ns, columns in the number of thresholds)
-    nones_matrix = [] # Matrix of percentages of Nones (rows in the number of Ns, columns in the number of thresholds)
-    pure_errors_matrix = [] # Matrix of percentages of pure errors (rows in the number of Ns, columns in the number of thresholds)
-    abstention_rate_matrix = [] # Matrix of abstention rates (rows in the number of Ns, columns in the number of thresholds)
-    pure_error_rate_matrix = [] # Matrix of pure error rates (rows in the number of Ns, columns in the number of thresholds)
-
-    # Check all file names to get the list of thresholds and ns
-    for file in files:
-        args = file.split("-")
-        model = args[0]
-        if model not in models:
-            print("Model not recognized:")
-            print(file, model)
-        elif model == "semantic_search":
-            threshold = args[2]
-            n = args[4].split(".")[0]
-            args = "--threshold " + threshold + " --n " + n
-            threshold = float(threshold)
-            n = int(n)
-            if threshold not in semantic_search_thresholds:
-                semantic_search_thresholds.append(threshold)
-            if n not in semantic_search_ns:
-                semantic_search_ns.append(n)
-
-    # Reiterate over the files to get the accuracies
-    for file in files:
-        # Get the accuracy
-        with open(os.path.join(results_directory, file), "r") as f:
-            for line in f:
-                if line.startswith("Accuracy:"):
-                    accuracy = float(line.split(":")[1].split("%")[0])
-                    semantic_search_results.append(accuracy)
-                if line.startswith("Macro F1 score:"): # be aware there is a space after the colon, but no percentage sign
-                    f1_score = float(line.split(":")[1])
-                if line.startswith("Percentage of NONE (over the number of incorrect predictions):"):
-                    none_percentage = float(line.split(":")[1].split("%")[0])
-                if line.startswith("Percentage of pure errors (over the number of incorrect predictions):"):
-                    pure_error_percentage = float(line.split(":")[1].split("%")[0])
-                if line.startswith("Abstention rate (NONE over the total number of predictions):"):
-                    abstention_rate = float(line.split(":")[1].split("%")[0])
-                if line.startswith("Pure error rate (the number of pure errors over the total number of predictions):"):
-                    pure_error_rate = float(line.split(":")[1].split("%")[0])
-        args = file.split("-")
-        model = args[0]
-        if model == "semantic_search":
-            threshold = args[2]
-            n = args[4].split(".")[0]
-            args = "--threshold " + threshold + " --n " + n
-            threshold = float(threshold)
-            n = int(n)
-            # Update the matrix
-            if len(accuracy_matrix) == 0:
-                for i in range(len(semantic_search_ns)):
-                    accuracy_matrix.append([])
-                    f1_score_matrix.append([])
-                    nones_matrix.append([])
-                    pure_errors_matrix.append([])
-                    abstention_rate_matrix.append([])
-                    pure_error_rate_matrix.append([])
-                for i in range(len(semantic_search_ns)):
-                    for j in range(len(semantic_search_thresholds)):
-                        accuracy_matrix[i].append([])
-                        f1_score_matrix[i].append([])
-                        nones_matrix[i].append([])
-                        pure_errors_matrix[i].append([])
-                        abstention_rate_matrix[i].append([])
-                        pure_error_rate_matrix[i].append([])
-            # Update the matrix
-            idx_n = semantic_search_ns.index(n)
-            idx_threshold = semantic_search_thresholds.index(threshold)
-            accuracy_matrix[idx_n][idx_threshold].append(accuracy)
-            f1_score_matrix[idx_n][idx_threshold].append(f1_score)
-            nones_matrix[idx_n][idx_threshold].append(none_percentage)
-            pure_errors_matrix[idx_n][idx_threshold].append(pure_error_percentage)
-            abstention_rate_matrix[idx_n][idx_threshold].append(abstention_rate)
-            pure_error_rate_matrix[idx_n][idx_threshold].append(pure_error_rate)
-        # print(model + "\t" + args + "\t" + str(accuracy))
-        table.append([model, args, accuracy])
+    accuracy_matrix = results_matrix("accuracy") # Matrix of accuracies
+    f1_score_matrix = results_matrix("macro_f1") # Matrix of F1 scores
+    nones_matrix = results_matrix("percentage_none") # Matrix of percentages of Nones
+    pure_errors_matrix = results_matrix("percentage_pure_errors") # Matrix of percentages of pure errors
+    abstention_rate_matrix = results_matrix("abstention_rate") # Matrix of abstention rates
+    pure_error_rate_matrix = results_matrix("pure_error_rate") # Matrix of pure error rates
 
 
     # LOG FILES =======================================================================================================
@@ -203,6 +184,28 @@ for test in tests:
                     f.write(str(semantic_search_ns[j]) + "\t" + str(semantic_search_thresholds[k]) + "\t" + str(matrices[i][j][k])[1:-1] + "\n")
             f.close()
 
+    # EXACT CURVES ====================================================================================================
+    # Each point holds from its threshold up to the threshold of the previous point of the same n (see factcheck/curves.py)
+
+    curves_path = os.path.join(results_directory, results_store.CURVES_FILE)
+    if os.path.isfile(curves_path):
+        points = [point for point in results_store.read_results(curves_path) if point["model"] == "semantic_search"]
+        with open(os.path.join(output_folder, test + "_curves.tsv"), "w") as f:
+            f.write("n\tthreshold\t" + "\t".join(CURVE_METRICS) + "\n")
+            for point in points:
+                f.write(str(point["n"]) + "\t" + str(point["threshold"]) + "\t" + "\t".join(str(point[metric]) for metric in CURVE_METRICS) + "\n")
+            f.close()
+
+        with open(log_file, "a") as f:
+            f.write("\nBest threshold of each n (exact curves)\n")
+            print("\nBest threshold of each n (exact curves)")
+            for n in sorted(set(point["n"] for point in points)):
+                best = max((point for point in points if point["n"] == n), key=lambda point: (point["accuracy"], point["macro_f1"]))
+                row = str(n) + "\tthreshold >= " + str(round(best["threshold"], 6)) + "\taccuracy " + str(best["accuracy"]) + "\tmacro F1 " + str(best["macro_f1"]) + "\tabstention rate " + str(best["abstention_rate"])
+                f.write(row + "\n")
+                print(row)
+            f.close()
+
 
 # Zip the output folder
 shutil.make_archive(output_directory, "zip", output_directory)
@@ -0,0 +1,102 @@
+#!/usr/bin/python3
+
+# Usage: python3 relabel.py <neighbours> [--examples EXAMPLES_PATH] [--output OUTPUT_PATH] [--policy POLICY] [--decision DECISION] [--min-margin MIN_MARGIN] [--n N] [--threshold THRESHOLD]
+#        python3 relabel.py <neighbours> --sweep --test-set TEST_SET_FILE [--examples EXAMPLES_PATH] [--output OUTPUT_PATH] [--policy POLICY] [--decision DECISION] [--min-margin MIN_MARGIN] [--save-inference]
+
+"""
+Label again the queries of a saved neighbour table (see factcheck/neighbours.py), with any voting policy, threshold and N.
+The table is written by semantic_search.py --save-neighbours, and by every sweep (<mode>/<test_set>/<column>/neighbours).
+Only the labels of the control set are read: the model is not loaded and nothing is encoded.
+With --sweep, every threshold/N combination of factcheck/sweep.py is labelled and evaluated against the test set, as in create_args_and_run.py,
+and the results are saved in OUTPUT_PATH/results/results.jsonl: OUTPUT_PATH is required, and must be another folder than the run of the table,
+whose results are never overwritten. Without --sweep, the inference file is saved by default next to the run, in <run>-relabel-<policy>-<decision>.
+"""
+
+import os, sys, argparse
+from factcheck import datasets, sweep
+from factcheck.labeling import Labeler, POLICIES, DEFAULT_POLICY, DEFAULT_DECISION
+from factcheck.voting import DECISIONS
+from factcheck.neighbours import NeighbourTable
+
+
+def load_examples(examples_path):
+    """
+    Return the claims and the labels of the control set.
+    """
+    dataset = datasets.read_table(examples_path, ["claim", "label"])
+    return dataset["claim"].tolist(), dataset["label"].tolist()
+
+
+def relabel():
+    args = parse_arguments()
+    table = NeighbourTable.load(args.neighbours)
+    examples_path = args.examples if args.examples is not None else table.info["examples"]
+    run_folder = os.path.dirname(os.path.abspath(args.neighbours))
+    if args.output is None and args.sweep:
+        print("Error: --sweep requires --output (a <mode>/<test_set>/<column> folder other than the run of the neighbour table)")
+        sys.exit(1)
+    output = args.output if args.output is not None else run_folder + "-relabel-" + args.policy + "-" + args.decision
+    if os.path.abspath(output) == run_folder:
+        print("Error: the output folder is the run of the neighbour table, whose results would be overwritten")
+        sys.exit(1)
+
+    if table.info.get("dedup_threshold") is not None:
+        print("Error: the neighbours were retrieved from the control set with its near-duplicate claims collapsed (dedup threshold "
+              + str(table.info["dedup_threshold"]) + "), they cannot be labelled again from the raw control set")
+        sys.exit(1)
+    corpus, corpus_labels = load_examples(examples_path)
+    if len(corpus_labels) != table.info["examples_count"]:
+        print("Error: the control set " + examples_path + " has " + str(len(corpus_labels)) + " examples, but the neighbours were retrieved from "
+              + str(table.info["examples_count"]) + " examples")
+        sys.exit(1)
+    labeler = Labeler(corpus, corpus_labels, policy=args.policy, decision=args.decision, min_margin=args.min_margin)
+
+    if args.sweep:
+        if args.test_set is None:
+            print("Error: --sweep requires --test-set")
+            sys.exit(1)
+        ns = [n for n in sweep.NS if n <= table.k]
+        records = sweep.label_sweep(labeler, table.queries, table.scores, table.indices, output, args.test_set, sweep.THRESHOLDS, ns,
+                                    save_inference=args.save_inference)
+        print("Results of " + str(len(records)) + " sets of arguments saved in " + os.path.join(output, "results"))
+        return
+
+    if args.n > table.k:
+        print("Error: N must be at most " + str(table.k) + ", the number of saved neighbours")
+        sys.exit(1)
+    os.makedirs(output, exist_ok=True)
+    output_path = os.path.join(output, "inference.tsv")
+    labels = labeler.label_all(table.scores, table.indices, args.n, args.threshold)
+    labeler.write_inference(output_path, table.queries, labels, table.scores, table.indices, args.n, args.threshold)
+    print("Results are saved in " + output_path)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+
+    # Positional arguments
+    parser.add_argument("neighbours", help="Neighbour table directory")
+
+    # Optional arguments
+    parser.add_argument("--examples", help="Examples dataset (default: the one the neighbours were retrieved from)", default=None)
+    parser.add_argument("--output", help="Output folder where to save results, required with --sweep (default: <run>-relabel-<policy>-<decision>, next to the run of the neighbour table)", default=None)
+    parser.add_argument("--policy", help="Voting policy (default: " + DEFAULT_POLICY + ")", choices=list(POLICIES), default=DEFAULT_POLICY)
+    parser.add_argument("--decision", help="'majority' (one vote per example) or 'weighted' (each example votes with its score) (default: " + DEFAULT_DECISION + ")", choices=DECISIONS, default=DEFAULT_DECISION)
+    parser.add_argument("--min-margin", help="Abstain when the vote margin of the label is below this value, between 0 and 1 (default: 0)", type=float, default=0.0)
+    parser.add_argument("--n", help="Number of examples to use (default: 1)", type=int, default=1)
+    parser.add_argument("--threshold", help="Cosine similarity threshold (default: 0.5)", type=float, default=0.5)
+    parser.add_argument("--sweep", help="Label and evaluate every threshold and N of the sweep", action="store_true")
+    parser.add_argument("--test-set", help="Test set file, for --sweep (the column is the name of the output folder)", default=None)
+    parser.add_argument("--save-inference", help="With --sweep, also write the inference file of every threshold and N", action="store_true")
+
+    return parser.parse_args()
+
+
+# EXECUTION
+
+if __name__ == "__main__":
+    try:
+        relabel()
+    except (ValueError, FileNotFoundError) as e:
+        print("Error: " + str(e))
+        sys.exit(1)
@@ -1,17 +1,27 @@
 #!/usr/bin/python3
 
-# Usage: python3 semantic_search.py input [--examples EXAMPLES_PATH] [--output OUTPUT_PATH] [--n N] [--threshold THRESHOLD]
-
-from sentence_transformers import SentenceTransformer, util
-import torch, sys, csv, os, argparse
-import pandas as pd
+# Usage: python3 semantic_search.py input [--examples EXAMPLES_PATH] [--output OUTPUT_PATH] [--n N] [--threshold THRESHOLD] [--policy POLICY] [--decision DECISION] [--min-margin MIN_MARGIN] [--evidence-weight WEIGHT] [--index-precision PRECISION] [--quantize-encoder] [--dedup-threshold THRESHOLD] [--stream [--resume]] [--save-neighbours] [--verbose]
+
+"""
+Command line interface of the semantic search: label the input claims with the majority label of their nearest examples in the control set.
+The retrieval and the labelling are implemented in the factcheck package (Retriever and Labeler).
+"""
+
+import sys, os, argparse, logging
+from factcheck import datasets
+from factcheck.retrieval import Retriever, load_queries, EVIDENCE_WEIGHT, INDEX_PRECISION, QUANTIZE_ENCODER, DEDUP_THRESHOLD
+from factcheck.search_index import PRECISIONS
+from factcheck.labeling import Labeler, POLICIES, DEFAULT_POLICY, DEFAULT_DECISION
+from factcheck.voting import DECISIONS
+from factcheck.neighbours import NeighbourTable, NEIGHBOURS_FOLDER
+from factcheck.streaming import stream_inference
 
 # SETTINGS
 ASK_STRING_AS_INPUT = False # if True, the user is asked to confirm when inputting a claim
 ASK_OVERWRITE = False # if True, the user is asked to confirm when overwriting an existing file
 
-default_output_path = None
-default_examples_path = None
+DEFAULT_EXAMPLES_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "data", "controlsets", "train.tsv")
+DEFAULT_OUTPUT_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), "semantic_search_results")
 
 def inference():
     """
@@ -19,82 +29,74 @@ def inference():
     Load the control set, compute the embeddings, also for the inputs.
     Compute cosine similarity between control set sentences ('examples') and each input claim ('query'), and label the latter with the majority label of the nearest sentences.
     Nearest examples are those N sentences with the highest similarity score, but only if the score is above the threshold.
-    In case of ties, the label is set appropriately, according to the logic criteria implemented in the function output_label().
+    In case of ties, the label is set appropriately, according to the logic criteria implemented in the function labeling.output_label().
     """
-    global default_output_path, default_examples_path
-
     # Parse the arguments
     args = parse_arguments()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format="%(message)s")
 
     # Check the arguments
     INPUT_TYPE, INPUT, dataset_path, OUTPUT_PATH, N, THRESHOLD = check_args(args)
-        
-    # Load the dataset
-    dataset = pd.read_csv(dataset_path, sep="\t", header=0, quoting=csv.QUOTE_NONE, dtype={"label": str})
-
-    # Map sentences to embeddings
-    embedder = SentenceTransformer('all-MiniLM-L6-v2')
-    corpus = dataset['claim'].tolist()
-    corpus_embeddings = embedder.encode(corpus, convert_to_tensor=True)
-
-    # Save embeddings with labels
-    corpus_labels = dataset['label'].tolist()
-
-    if INPUT_TYPE == "string":
-        query = preprocess_query(INPUT)
-        queries = [query]
-    elif INPUT_TYPE == "file":
-        input_path = INPUT
-        with open(input_path, 'r') as f:
-            queries = f.readlines()
-            queries = [query for query in queries if query.strip() != '']
-            queries = [preprocess_query(query) for query in queries]
-        
+
+    # Load the dataset, and map sentences to embeddings
+    retriever = Retriever(evidence_weight=args.evidence_weight, index_precision=args.index_precision, quantize_encoder=args.quantize_encoder,
+                          dedup_threshold=args.dedup_threshold).load_examples(dataset_path)
+    labeler = Labeler.from_retriever(retriever, policy=args.policy, decision=args.decision, min_margin=args.min_margin)
+
+    # Streaming mode: the queries are read, labelled and written chunk by chunk
+    if args.stream:
+        rows = stream_inference(retriever, labeler, INPUT, OUTPUT_PATH, N, THRESHOLD, resume=args.resume)
+        print("Results are saved in " + OUTPUT_PATH + " (" + str(rows) + " rows)")
+        return
+
+    # Load the queries
+    queries = load_queries(INPUT_TYPE, INPUT)
+
     # Find the closest N sentences of the corpus for each query sentence based on cosine similarity
-    top_k = min(N, len(corpus))
-    
-    with open(OUTPUT_PATH, 'w') as f:
-        f.write("output_label\tquery\tmost_similar_examples\n")
-        for query in queries:
-            query_embedding = embedder.encode(query, convert_to_tensor=True)
-            cos_scores = util.cos_sim(query_embedding, corpus_embeddings)[0]
-            top_results = torch.topk(cos_scores, k=top_k)
-            similar_claims = []
+    top_scores, top_indices = retriever.retrieve(queries, N)
+    if args.save_neighbours:
+        # Save the scores and indices of the retrieved examples, to label them again with relabel.py
+        table = NeighbourTable.from_retrieval(retriever, queries, top_scores, top_indices)
+        table.save(os.path.join(os.path.dirname(OUTPUT_PATH), NEIGHBOURS_FOLDER))
+
+    labels = labeler.label_all(top_scores, top_indices, N, THRESHOLD)
+    if args.verbose:
+        for query, label, scores, indices in zip(queries, labels, top_scores, top_indices):
             print("\n\n======================\n\n")
             print("QUERY:", query)
             print("\nTop " + str(N) + " most similar claims:")
-            for score, idx in zip(top_results[0], top_results[1]):
-                if score > THRESHOLD:
-                    similar_claims.append([corpus[idx], corpus_labels[idx], score.item()])
-                    print(corpus[idx], "(Label:", corpus_labels[idx],", Score: {:.3f})".format(score))
-                else:
-                    # Append [None, NaN] element to keep the same number of elements in the list
-                    similar_claims.append([None, None, float('nan')])
-            # Label the query with the most frequent label of the retrieved sentences
-            similar_claims_labels = [claim[1] for claim in similar_claims]
-            majority_label = output_label(similar_claims_labels)
-            print("\nLABEL:", majority_label)
-            f.write("{}\t{}\t{}\n".format(majority_label, query, similar_claims))
-        f.close()
-    print("\n\n======================\n\n")
+            for claim in labeler.similar_claims(scores, indices, N, THRESHOLD):
+                if claim[0] is not None:
+                    print(claim[0], "(Label:", claim[1],", Score: {:.3f})".format(claim[2]))
+            print("\nLABEL:", label)
+        print("\n\n======================\n\n")
+
+    labeler.write_inference(OUTPUT_PATH, queries, labels, top_scores, top_indices, N, THRESHOLD)
     print("Results are saved in " + OUTPUT_PATH)
 
 
 def parse_arguments():
-    global default_output_path, default_examples_path
-
     parser = argparse.ArgumentParser()
 
     # Positional arguments
     parser.add_argument("input", help="Input claim or file containing claims") # Input: single string or file containing claims
 
     # Optional arguments
-    default_examples_path = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "data", "controlsets", "train.tsv")
-    parser.add_argument("--examples", help="Examples dataset", default=default_examples_path) # Examples: tsv file
-    default_output_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "semantic_search_results")
-    parser.add_argument("--output", help="Output folder where to save results", default=default_output_path) # Output: tsv file
+    parser.add_argument("--examples", help="Examples dataset", default=DEFAULT_EXAMPLES_PATH) # Examples: tsv file
+    parser.add_argument("--output", help="Output folder where to save results", default=DEFAULT_OUTPUT_PATH) # Output: tsv file
     parser.add_argument("--n", help="Number of examples to use (default: 1)", type=int, default=1) # Number of examples to use
     parser.add_argument("--threshold", help="Cosine similarity threshold (default: 0.5)", type=float, default=0.5) # Cosine similarity threshold
+    parser.add_argument("--policy", help="Voting policy (default: " + DEFAULT_POLICY + ")", choices=list(POLICIES), default=DEFAULT_POLICY)
+    parser.add_argument("--decision", help="'majority' (one vote per example) or 'weighted' (each example votes with its score) (default: " + DEFAULT_DECISION + ")", choices=DECISIONS, default=DEFAULT_DECISION)
+    parser.add_argument("--min-margin", help="Abstain when the vote margin of the label is below this value, between 0 and 1 (default: 0)", type=float, default=0.0)
+    parser.add_argument("--evidence-weight", help="Weight of the most similar evidence snippet of each example in its score, between 0 (claims only) and 1 (default: " + str(EVIDENCE_WEIGHT) + ")", type=float, default=EVIDENCE_WEIGHT)
+    parser.add_argument("--index-precision", help="Precision of the stored control set embeddings (default: " + INDEX_PRECISION + ")", choices=PRECISIONS, default=INDEX_PRECISION)
+    parser.add_argument("--quantize-encoder", help="Run the model with int8 dynamic quantization (CPU)", action="store_true", default=QUANTIZE_ENCODER)
+    parser.add_argument("--dedup-threshold", help="Collapse the claims of the control set whose cosine similarity is at least this value, see factcheck/dedup.py (default: " + str(DEDUP_THRESHOLD) + ")", type=float, default=DEDUP_THRESHOLD)
+    parser.add_argument("--stream", help="Read the claims (from the input file, or from stdin if the input is '-') and write the results in chunks, with bounded memory", action="store_true")
+    parser.add_argument("--resume", help="With --stream, keep the rows of an existing output and continue after them", action="store_true")
+    parser.add_argument("--save-neighbours", help="Save the scores and indices of the retrieved examples in the output folder, to label them again with relabel.py", action="store_true")
+    parser.add_argument("--verbose", help="Print each query with its nearest examples and the label counts", action="store_true")
 
     args = parser.parse_args()
 
@@ -105,10 +107,19 @@ def check_args(args):
     """
     Check the arguments and return input type (string or file), input, examples path, output path, N and threshold
     """
-    global ASK_STRING_AS_INPUT, ASK_OVERWRITE, default_output_path
-
     # Check if input is a file
-    if not os.path.isfile(args.input):
+    if args.resume and not args.stream:
+        print("Error: --resume can only be used in streaming mode (--stream)")
+        sys.exit(1)
+    if args.stream:
+        if args.input != "-" and not os.path.isfile(args.input):
+            print("Error: in streaming mode, the input must be a file or '-' (stdin)")
+            sys.exit(1)
+        if args.save_neighbours:
+            print("Error: --save-neighbours can not be used in streaming mode")
+            sys.exit(1)
+        input_type = "file"
+    elif not os.path.isfile(args.input):
         input_type = "string"
         # Ask user if he wants to continue
         print("\033[93mWARNING: Input is not a file. It will be considered a string.\033[0m")
@@ -120,24 +131,30 @@ def check_args(args):
     else:
         input_type = "file"
 
-    # Check if examples_path exists as a file and is a tsv file
-    if not os.path.isfile(args.examples):
+    if args.dedup_threshold is not None and args.evidence_weight > 0:
+        print("Error: --dedup-threshold can not be used with a positive --evidence-weight")
+        sys.exit(1)
+
+    # Check if examples_path exists as a file and is a tsv file (or a columnar dataset, see factcheck/datasets.py)
+    if datasets.is_columnar(args.examples):
+        pass
+    elif not os.path.isfile(args.examples):
         print("Error: examples file does not exist.")
         sys.exit(1)
-    if not args.examples.endswith(".tsv"):
+    elif not args.examples.endswith(".tsv"):
         print("Error: examples file is not a tsv file")
         sys.exit(1)
 
     # Check if output_path already exists
     if not os.path.isdir(args.output): # It doesn't exist
-        if args.output != default_output_path: # Not default: error
+        if args.output != DEFAULT_OUTPUT_PATH: # Not default: error
             print("Error: " + args.output + " is not a directory")
             sys.exit(1)
         else: # Default: create the output directory
             print("Creating output directory " + args.output)
             os.makedirs(args.output, exist_ok=True)
     output_file_path = os.path.join(args.output, "inference.tsv")
-    if os.path.isfile(output_file_path):
+    if os.path.isfile(output_file_path) and not args.resume:
         # Ask user if he wants to overwrite the file
         print("\033[93mWARNING: Output path already exists. It will be overwritten.\033[0m")
         if ASK_OVERWRITE:
@@ -149,68 +166,12 @@ def check_args(args):
     return input_type, args.input, args.examples, output_file_path, args.n, args.threshold
 
 
-def preprocess_query(query):
-    """
-    Remove tabs and newlines from the query.
-    """
-    query = query.replace("\t", " ") # Replace tabs with spaces
-    query = query.replace("\n", "") # Remove newlines
-    return query
-
-
-def output_label(labels):
-    """
-    Return the most frequent label in the list of labels.
-    If there is a tie, return the label according to a logic criteria:
-    - TRUE==FALSE -> HALF-TRUE
-    - TRUE==HALF-TRUE -> TRUE
-    - FALSE==HALF-TRUE -> FALSE
-    If specified in the settings, HALF-TRUE labels are considered as FALSE.
-    If all labels are None, return None.
-    """
-    HALF_TRUE_AS_FALSE = True # If True, HALF-TRUE labels are considered as FALSE
-    
-    # Count occurrences of each label
-    labels=[label.lower() if label!=None else label for label in labels]
-    trues = labels.count('true')
-    falses = labels.count('false')
-    half_trues = labels.count('half-true')
-    nones = labels.count('none')
-    print(trues,falses,half_trues,nones)
-    if trues+falses+half_trues+nones!=len(labels):
-        print("\033[93mWARNING: Some labels not recognized:\033[0m",set(labels))
-    if HALF_TRUE_AS_FALSE:
-        falses += half_trues
-        half_trues = 0
-
-    # If all labels are None, return None
-    if trues == 0 and falses == 0 and half_trues == 0:
-        return None
-    
-    # if the number of None labels is greater than the number of other labels, return None
-    if nones > trues+falses+half_trues:
-        return None
-    
-    # Label the query with the most frequent label
-    if trues > falses and trues > half_trues:
-        output_label = "true"
-    elif falses > trues and falses > half_trues:
-        output_label = "false"
-    elif half_trues > trues and half_trues > falses:
-        output_label = "half-true"
-    elif trues == falses and trues > half_trues:
-        output_label = "half-true"
-    elif trues == half_trues and trues > falses:
-        output_label = "true"
-    elif falses == half_trues and falses > trues:
-        output_label = "false"
-    else:
-        output_label = None
-    
-    return output_label
-
-
 
 # EXECUTION
 
-inference()
+if __name__ == "__main__":
+    try:
+        inference()
+    except (ValueError, FileNotFoundError) as e:
+        print("Error: " + str(e))
+        sys.exit(1)
@@ -0,0 +1,230 @@
+#!/usr/bin/python3
+
+# Usage: python3 serve.py [--examples EXAMPLES_PATH | --live-index INDEX_DIR] [--n N] [--threshold THRESHOLD] [--host HOST] [--port PORT] [--socket SOCKET_PATH]
+
+"""
+This script serves the semantic search labels over HTTP, on a TCP port or on a Unix socket.
+The model and the control set embeddings are loaded once and kept in memory, so a request only pays for encoding its claims.
+Claims received concurrently are grouped in micro-batches, encoded and searched together, and labelled with output_label().
+The claims already seen (by the server or by the experiments) are not encoded again, see factcheck/query_cache.py.
+With --live-index, the control set is an updatable index (see factcheck/live_index.py): its appended, relabelled and deleted examples are picked up
+every LIVE_REFRESH_INTERVAL seconds, between two batches, without restarting the server.
+
+Request:  POST /label  {"claims": ["claim 1", "claim 2"]}  (or {"claim": "claim 1"}), optional "n" and "threshold"
+Response: {"labels": [{"claim": ..., "label": ..., "most_similar_examples": [[claim, label, score], ...]}, ...]}
+"""
+
+import asyncio, argparse, json, os, sys, time
+from factcheck import Retriever, Labeler, datasets
+from factcheck.retrieval import preprocess_query
+
+# SETTINGS
+MAX_BATCH_SIZE = 64 # maximum number of claims encoded together
+MAX_BATCH_DELAY = 0.005 # seconds to wait for more claims before encoding a batch
+MAX_N = 10 # maximum number of examples that a request can ask for
+MAX_BODY_SIZE = 16 * 1024 * 1024 # maximum size of a request body, in bytes
+LIVE_REFRESH_INTERVAL = 2.0 # seconds between two reads of the updates of a live index
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+    default_examples_path = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "data", "controlsets", "train.tsv")
+    parser.add_argument("--examples", help="Examples dataset", default=default_examples_path) # Examples: tsv file
+    parser.add_argument("--live-index", help="Updatable control set index, instead of the examples dataset (see factcheck/live_index.py)", default=None)
+    parser.add_argument("--n", help="Default number of examples to use (default: 1)", type=int, default=1)
+    parser.add_argument("--threshold", help="Default cosine similarity threshold (default: 0.5)", type=float, default=0.5)
+    parser.add_argument("--host", help="Host to listen on (default: 127.0.0.1)", default="127.0.0.1")
+    parser.add_argument("--port", help="Port to listen on (default: 8000)", type=int, default=8000)
+    parser.add_argument("--socket", help="Unix socket path to listen on, instead of host and port", default=None)
+    return parser.parse_args()
+
+
+class Batcher:
+    """
+    Collect the claims of concurrent requests and retrieve their nearest examples in micro-batches.
+    With a refresh interval, the updates of the live index of the retriever are applied before the first batch after each interval.
+    """
+
+    def __init__(self, retriever, top_k, labeler, refresh_interval=None):
+        self.retriever = retriever
+        self.top_k = top_k
+        self.labeler = labeler
+        self.refresh_interval = refresh_interval
+        self.last_refresh = time.monotonic()
+        self.queue = asyncio.Queue()
+
+    async def retrieve(self, queries):
+        """
+        Return the scores and the indices of the top_k examples of each query, and the labeler of the control set they were retrieved from,
+        once the batch containing them has been processed.
+        """
+        loop = asyncio.get_running_loop()
+        futures = []
+        for query in queries:
+            future = loop.create_future()
+            await self.queue.put((query, future))
+            futures.append(future)
+        return await asyncio.gather(*futures)
+
+    def search(self, queries):
+        """
+        Retrieve the nearest examples of a batch, after applying the updates of the live index if the refresh interval has elapsed.
+        The labeler is replaced, not modified, when the control set changes, so the results of the previous batches keep a consistent labeler.
+        """
+        if self.refresh_interval is not None and time.monotonic() - self.last_refresh >= self.refresh_interval:
+            self.last_refresh = time.monotonic()
+            if self.retriever.refresh():
+                self.labeler = self.retriever.index.labeler(self.labeler)
+        top_scores, top_indices = self.retriever.retrieve(queries, self.top_k)
+        return top_scores, top_indices, self.labeler
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + MAX_BATCH_DELAY
+            while len(batch) < MAX_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            queries = [query for query, _ in batch]
+            try:
+                # The encoding runs in a thread, so that the server keeps accepting requests in the meantime
+                top_scores, top_indices, labeler = await loop.run_in_executor(None, self.search, queries)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), scores, indices in zip(batch, top_scores, top_indices):
+                if not future.done():
+                    future.set_result((scores, indices, labeler))
+
+
+async def handle_label(batcher, body, default_n, default_threshold):
+    """
+    Label the claims of a request body. Return the HTTP status and the response object.
+    """
+    try:
+        request = json.loads(body)
+    except ValueError:
+        return 400, {"error": "invalid JSON"}
+    if not isinstance(request, dict):
+        return 400, {"error": "the body must be a JSON object"}
+    claims = request.get("claims", [request["claim"]] if "claim" in request else None)
+    if not isinstance(claims, list) or not all(isinstance(claim, str) for claim in claims):
+        return 400, {"error": "'claims' must be a list of strings"}
+    n = request.get("n", default_n)
+    threshold = request.get("threshold", default_threshold)
+    if not isinstance(n, int) or n < 1 or n > batcher.top_k:
+        return 400, {"error": "'n' must be an integer between 1 and " + str(batcher.top_k)}
+    if not isinstance(threshold, (int, float)):
+        return 400, {"error": "'threshold' must be a number"}
+
+    queries = [preprocess_query(claim) for claim in claims]
+    retrieved = await batcher.retrieve(queries)
+    labels = []
+    for query, (scores, indices, labeler) in zip(queries, retrieved):
+        majority_label = labeler.label(scores, indices, n, threshold)
+        similar_claims = [[claim, label, None if score != score else score] for claim, label, score in labeler.similar_claims(scores, indices, n, threshold)] # NaN is not valid JSON
+        labels.append({"claim": query, "label": majority_label, "most_similar_examples": similar_claims})
+    return 200, {"labels": labels}
+
+
+async def handle_connection(reader, writer, batcher, default_n, default_threshold):
+    """
+    Serve the HTTP requests of a connection (keep-alive is supported).
+    """
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            method, path, _ = request_line.decode("latin-1").split(" ", 2)
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if line == "":
+                    break
+                key, _, value = line.partition(":")
+                headers[key.strip().lower()] = value.strip()
+            length = int(headers.get("content-length", 0))
+
+            start = time.perf_counter()
+            if length > MAX_BODY_SIZE:
+                status, response = 413, {"error": "request body too large"}
+            else:
+                body = await reader.readexactly(length)
+                if method == "POST" and path == "/label":
+                    status, response = await handle_label(batcher, body, default_n, default_threshold)
+                elif method == "GET" and path == "/health":
+                    status, response = 200, {"status": "ok", "examples": batcher.retriever.index.live_count() if batcher.refresh_interval is not None else len(batcher.labeler.corpus)}
+                else:
+                    status, response = 404, {"error": "not found"}
+            response["time_ms"] = round((time.perf_counter() - start) * 1000, 3)
+
+            payload = json.dumps(response).encode("utf-8")
+            keep_alive = headers.get("connection", "keep-alive").lower() != "close" and length <= MAX_BODY_SIZE
+            writer.write(("HTTP/1.1 " + str(status) + " " + ("OK" if status == 200 else "Error") + "\r\n"
+                          "Content-Type: application/json\r\n"
+                          "Content-Length: " + str(len(payload)) + "\r\n"
+                          "Connection: " + ("keep-alive" if keep_alive else "close") + "\r\n\r\n").encode("latin-1") + payload)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(args):
+    print("Loading model and examples...")
+    if args.live_index is not None:
+        # The control set can grow, so the top_k is not bounded by its current size (the retrieval bounds it)
+        retriever = Retriever(batch_size=MAX_BATCH_SIZE).load_live_index(args.live_index)
+        labeler = retriever.index.labeler(Labeler.from_retriever(retriever))
+        batcher = Batcher(retriever, max(MAX_N, args.n), labeler, LIVE_REFRESH_INTERVAL)
+    else:
+        retriever = Retriever(batch_size=MAX_BATCH_SIZE).load_examples(args.examples)
+        labeler = Labeler.from_retriever(retriever)
+        batcher = Batcher(retriever, min(max(MAX_N, args.n), len(retriever.corpus)), labeler)
+    corpus = retriever.corpus
+    worker = asyncio.ensure_future(batcher.run())
+
+    def handler(reader, writer):
+        return handle_connection(reader, writer, batcher, args.n, args.threshold)
+
+    if args.socket is not None:
+        server = await asyncio.start_unix_server(handler, path=args.socket)
+        print("Serving " + str(len(corpus)) + " examples on unix socket " + args.socket)
+    else:
+        server = await asyncio.start_server(handler, host=args.host, port=args.port)
+        print("Serving " + str(len(corpus)) + " examples on http://" + args.host + ":" + str(args.port))
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        worker.cancel()
+        retriever.close()
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    if args.live_index is not None and not os.path.isdir(args.live_index):
+        print("Error: live index does not exist.")
+        sys.exit(1)
+    if args.live_index is None and not os.path.isfile(args.examples) and not datasets.is_columnar(args.examples):
+        print("Error: examples file does not exist.")
+        sys.exit(1)
+    try:
+        asyncio.run(serve(args))
+    except (ValueError, FileNotFoundError) as e:
+        print("Error: " + str(e))
+        sys.exit(1)
+    except KeyboardInterrupt:
+        print("\nExiting...")
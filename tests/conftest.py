@@ -0,0 +1,4 @@
+import os, sys
+
+# The factcheck package is imported from src/, as the scripts do
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "src"))
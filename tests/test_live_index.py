@@ -0,0 +1,95 @@
+"""
+Tests of the updatable control set index (factcheck/live_index.py): append, relabel, delete and compaction.
+"""
+
+import hashlib
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+from factcheck.live_index import LiveIndex
+from factcheck.labeling import Labeler
+
+DIMENSION = 16
+
+
+class Embedder:
+    """
+    Deterministic stand-in for the sentence transformer: the embedding of a claim is drawn from a generator seeded by its hash.
+    """
+
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, claims, convert_to_numpy=True, normalize_embeddings=False):
+        self.encoded.extend(claims)
+        return np.stack([embed(claim) for claim in claims])
+
+
+def embed(claim):
+    return np.random.default_rng(int(hashlib.sha1(claim.encode("utf-8")).hexdigest()[:8], 16)).normal(size=DIMENSION).astype(np.float32)
+
+
+def create(path, claims, labels):
+    return LiveIndex.create(str(path), np.stack([embed(claim) for claim in claims]), claims, labels, "test-model")
+
+
+def live_rows(index):
+    return {index.claims[row]: index.labels[row] for row in np.flatnonzero(index.alive[:index.size])}
+
+
+def test_append_encodes_only_the_new_claims(tmp_path):
+    index = create(tmp_path / "index", ["a", "b", "c"], ["true", "false", "true"])
+    embedder = Embedder()
+    appended, relabelled = index.append(embedder, ["d", "a", "b"], ["false", "true", "true"])
+    assert (appended, relabelled) == (1, 1)
+    assert embedder.encoded == ["d"]
+    assert live_rows(index) == {"a": "true", "b": "true", "c": "true", "d": "false"}
+    scores, indices = index.search(embed("d")[None, :], 1)
+    assert index.claims[indices[0, 0]] == "d"
+    assert scores[0, 0] == pytest.approx(1.0, abs=1e-5)
+
+
+def test_relabel_is_seen_by_readers_and_keeps_labeler_snapshots(tmp_path):
+    writer = create(tmp_path / "index", ["a", "b"], ["true", "false"])
+    reader = LiveIndex(str(tmp_path / "index"))
+    before = reader.labeler(Labeler(reader.claims, reader.labels))
+    writer.append(Embedder(), ["b"], ["true"])
+    assert reader.refresh()
+    after = reader.labeler(before)
+    assert before.corpus_labels == ["true", "false"]
+    assert after.corpus_labels == ["true", "true"]
+    assert list(before.corpus_codes) != list(after.corpus_codes)
+
+
+def test_delete_never_returns_the_tombstoned_rows(tmp_path):
+    index = create(tmp_path / "index", ["a", "b", "c"], ["true", "false", "true"])
+    assert index.delete(["b", "unknown"]) == 1
+    assert index.delete(["b"]) == 0
+    scores, indices = index.search(np.stack([embed("b"), embed("a")]), 3)
+    assert index.live_count() == 2
+    assert set(indices[:, :2].ravel()) == {index.claims.index("a"), index.claims.index("c")}
+    assert (indices[:, 2] == -1).all() and np.isneginf(scores[:, 2]).all()
+
+
+def test_compaction_with_a_duplicate_id(tmp_path):
+    index = create(tmp_path / "index", ["a", "b", "a", "c"], ["true", "false", "false", "true"])
+    assert len(index) == 3 and live_rows(index) == {"a": "false", "b": "false", "c": "true"}
+    index.append(Embedder(), ["d", "d"], ["true", "half-true"])
+    index.delete(["c"])
+    reader = LiveIndex(str(tmp_path / "index"))
+    queries = np.stack([embed(claim) for claim in ["a", "b", "c", "d"]])
+    expected = index.search(queries, 3)
+    expected = [[(index.claims[row], round(float(score), 5)) for score, row in zip(scores, rows) if row >= 0] for scores, rows in zip(*expected)]
+
+    index.compact()
+    assert index.meta["generation"] == 1 and len(index.segments) == 1
+    assert len(index) == index.live_count() == 3
+    assert live_rows(index) == {"a": "false", "b": "false", "d": "half-true"}
+    assert reader.refresh() and live_rows(reader) == live_rows(index)
+    compacted = reader.search(queries, 3)
+    assert [[(reader.claims[row], round(float(score), 5)) for score, row in zip(scores, rows) if row >= 0] for scores, rows in zip(*compacted)] == expected
+
+    # The compacted index can still be updated
+    index.append(Embedder(), ["a", "e"], ["true", "false"])
+    assert live_rows(index) == {"a": "true", "b": "false", "d": "half-true", "e": "false"}
@@ -0,0 +1,84 @@
+"""
+Tests of the vectorized vote (factcheck/voting.py) against output_label(), with the weighted decision, the vote margins and the cluster codes.
+"""
+
+import numpy as np
+import pytest
+from factcheck import voting
+from factcheck.labeling import POLICIES
+
+TRUE, FALSE, HALF_TRUE, NONE, BELOW = voting.TRUE, voting.FALSE, voting.HALF_TRUE, voting.NONE, voting.BELOW_THRESHOLD
+
+
+@pytest.fixture(scope="module")
+def equivalence():
+    return voting.check_equivalence(10)
+
+
+@pytest.mark.parametrize("policy", list(POLICIES))
+def test_vote_matches_output_label(equivalence, policy):
+    combinations, mismatches = equivalence
+    assert combinations > 0
+    assert [mismatch for mismatch in mismatches if mismatch[0] == policy] == []
+
+
+@pytest.mark.parametrize("policy", list(POLICIES))
+def test_integer_weights_match_repeated_votes(policy):
+    # An example with weight w votes as w examples with the same label
+    rng = np.random.default_rng(0)
+    codes = rng.choice([TRUE, FALSE, HALF_TRUE, NONE, BELOW], size=(500, 5)).astype(np.int8)
+    weights = rng.integers(1, 4, size=codes.shape)
+    repeated = np.full((codes.shape[0], int(weights.sum(axis=1).max())), voting.UNKNOWN, dtype=np.int8)
+    for i in range(codes.shape[0]):
+        row = np.repeat(codes[i], weights[i])
+        repeated[i, :row.shape[0]] = row
+    expected = voting.vote(repeated, **POLICIES[policy])
+    assert np.array_equal(voting.vote(codes, weights=weights.astype(np.float64), **POLICIES[policy]), expected)
+
+
+def test_weighted_vote_follows_scores():
+    codes = np.array([[TRUE, FALSE, FALSE], [TRUE, FALSE, FALSE]], dtype=np.int8)
+    weights = np.array([[0.9, 0.3, 0.3], [0.5, 0.3, 0.3]])
+    assert voting.decode(voting.vote(codes, weights=weights)) == ["true", "false"]
+    assert voting.decode(voting.vote(codes)) == ["false", "false"]
+
+
+def test_margins():
+    codes = np.array([[TRUE, TRUE, TRUE], [TRUE, TRUE, FALSE], [TRUE, FALSE, BELOW], [BELOW, BELOW, BELOW]], dtype=np.int8)
+    predicted, margins = voting.vote(codes, return_margins=True)
+    assert voting.decode(predicted) == ["true", "true", "half-true", None]
+    assert np.allclose(margins, [1.0, 1 / 3, 0.0, 0.0])
+    assert ((margins >= 0) & (margins <= 1)).all()
+
+    weighted, weighted_margins = voting.vote(codes[1:2], weights=np.array([[0.5, 0.3, 0.8]]), return_margins=True)
+    assert voting.decode(weighted) == ["half-true"] # tie of the weights (0.8 each)
+    assert np.allclose(weighted_margins, [0.0])
+
+
+@pytest.mark.parametrize("policy", list(POLICIES))
+@pytest.mark.parametrize("threshold", [-1.0, 0.2, 0.6])
+def test_cluster_codes_vote_as_their_members(policy, threshold):
+    # A retrieved cluster votes as all its members retrieved with its score
+    rng = np.random.default_rng(1)
+    corpus_counts = rng.integers(0, 3, size=(20, voting.CLUSTER_CODES))
+    corpus_counts[0] = 0
+    corpus_counts[0, TRUE] = 1
+    top_scores = -np.sort(-rng.uniform(0, 1, size=(200, 4)), axis=1)
+    top_indices = rng.integers(0, 20, size=(200, 4))
+    n = 3
+
+    codes, counts = voting.cluster_codes(corpus_counts, top_scores, top_indices, n, threshold)
+    assert codes.shape == counts.shape == (200, n * voting.CLUSTER_CODES)
+    assert (codes[np.repeat(top_scores[:, :n] <= threshold, voting.CLUSTER_CODES, axis=1)] == BELOW).all()
+
+    members = []
+    for scores, indices in zip(top_scores, top_indices):
+        row = []
+        for score, index in zip(scores[:n], indices[:n]):
+            for code in range(voting.CLUSTER_CODES):
+                row.extend([code if score > threshold else BELOW] * int(corpus_counts[index, code]))
+        members.append(row)
+    expanded = np.full((len(members), max(len(row) for row in members)), voting.UNKNOWN, dtype=np.int8)
+    for i, row in enumerate(members):
+        expanded[i, :len(row)] = row
+    assert np.array_equal(voting.vote(codes, weights=counts, **POLICIES[policy]), voting.vote(expanded, **POLICIES[policy]))